@@ -12,6 +12,7 @@ import 'screens/weather_screen.dart';
 import 'screens/community_screen.dart';
 import 'screens/bookmarks_screen.dart';
 import 'screens/trip_planner_screen.dart';
+import 'core/navigation/navigation_service.dart';
 import 'package:shared_preferences/shared_preferences.dart';
 import 'package:http/http.dart' as http;
 
@@ -35,6 +36,8 @@ class MyApp extends StatelessWidget {
   Widget build(BuildContext context) {
     return MaterialApp(
       debugShowCheckedModeBanner: false,
+      // ApiService sends the user back to /login through it when their token stops working
+      navigatorKey: NavigationService.navigatorKey,
       title: 'KemetPass App',
       theme: ThemeData(primarySwatch: Colors.orange),
       home: SplashScreen(), // استخدام شاشة البداية
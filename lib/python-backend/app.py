@@ -1,37 +1,74 @@
-from flask import Flask, request, jsonify, session, send_from_directory
+from flask import Flask, request, jsonify, session, g, Response, stream_with_context
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
 import os
 import numpy as np
-from tensorflow.keras.applications.vgg16 import VGG16, preprocess_input
-from tensorflow.keras.preprocessing import image
-from sklearn.metrics.pairwise import cosine_similarity
 import pickle
-from tensorflow.keras.models import load_model
-import joblib
 from groq import Groq
 from database import DatabaseHandler
+import passwords
+import user_cache
+from jobs import JobQueue, QueueFull
+import preprocessing
+from preprocessing import PreprocessPool
+import quantize
+from quantize import TFLiteModel
+from descriptors import DescriptorHead
+from retrieval import Gallery, l2_normalize
+from derivatives import DerivativeStore, normalize_image_path
+from static_files import send_upload, HANDOFF as UPLOADS_HANDOFF
+from blobstore import BlobStore, saved_image_paths
+from search import SearchIndex
+from trending import TrendingScores
+from etags import DataVersions, conditional, user_scope
+import auth
+import compression
+import fastjson
+import ratelimit
+import uploads
+import logs
+import metrics
+import profiling
+from metrics import TimedConnection
 import sqlite3
 import uuid
 from datetime import datetime
 import json
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+logs.configure()
+log = logs.get_logger("app")
 
 app = Flask(__name__)
 app.secret_key = 'Key'
-CORS(app, supports_credentials=True, resources={r"/*": {"origins": "*", "allow_headers": ["Content-Type", "User-ID"]}})
-
-db = DatabaseHandler()
+app.config['USE_X_SENDFILE'] = UPLOADS_HANDOFF == 'x-sendfile'
+metrics.install(app)
+profiling.install(app, tf_routes=('/predict_where_im', '/who_am_i', '/translate_hieroglyphic'))
+fastjson.install(app)
+compression.install(app)
+# Legacy user ids are vetted through db (created below) and its user cache
+AUTH = auth.from_env(user_exists=lambda user_id: db.get_user(user_id) is not None)
+metrics.REGISTRY.add_collector(AUTH.collect)
+ADMISSION = ratelimit.from_env()
+ratelimit.install(app, ADMISSION, identify=lambda: AUTH.user_id(read_body=False))
+metrics.REGISTRY.add_collector(ADMISSION.collect)
+uploads.install(app)
+CORS(app, supports_credentials=True, resources={r"/*": {"origins": "*", "allow_headers": ["Content-Type", "Authorization", "User-ID"]}})
+
+# The shared generation table must exist before gunicorn forks (preload_app) to be seen by every worker
+USER_CACHE = user_cache.from_env()
+metrics.REGISTRY.add_collector(USER_CACHE.collect)
+db = DatabaseHandler(user_cache=USER_CACHE)
+# Triggers are added by VERSIONS.track() once the community tables exist
+VERSIONS = DataVersions(db.db_path)
 
 USERS_IMAGES_FOLDER = 'uploads/users_images'
 os.makedirs(USERS_IMAGES_FOLDER, exist_ok=True)
 
-print(f"Current working directory: {os.getcwd()}")
-print(f"Uploads folder exists: {os.path.exists('uploads')}")
-print(f"Users images folder exists: {os.path.exists(USERS_IMAGES_FOLDER)}")
+log.info("starting", extra={"cwd": os.getcwd(), "uploads_exists": os.path.exists('uploads')})
 
-@app.route('/uploads/<path:filename>')
-def serve_uploads(filename):
-    return send_from_directory('uploads', filename)
+SERVER_URL = "http://192.168.1.4:8000"
 
 def get_full_image_url(image_path):
     if not image_path:
@@ -40,34 +77,81 @@ def get_full_image_url(image_path):
     if image_path.startswith(('http://', 'https://')):
         return image_path
         
-    server_url = "http://192.168.1.4:8000"
-    
     if image_path.startswith('/'):
         image_path = image_path[1:]
         
-    return f"{server_url}/{image_path}"
+    return f"{SERVER_URL}/{image_path}"
 
-WHERE_IM_UPLOAD_FOLDER = 'uploads/where_im'
-WHO_IM_UPLOAD_FOLDER = 'uploads/who_im'
-
-os.makedirs(WHERE_IM_UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(WHO_IM_UPLOAD_FOLDER, exist_ok=True)
 WHERE_IM_CLIENT = Groq(api_key="API")
-WHERE_IM_MODEL = VGG16(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
-WHO_AM_I_MODEL = VGG16(weights='imagenet', include_top=False, input_shape=(224, 224, 3))  # Separate model for Who Am I
+WHERE_IM_MODEL, WHO_AM_I_MODEL = None, None
 WHERE_IM_FEATURES, WHERE_IM_LABELS, WHERE_IM_IMAGE_PATHS = None, None, None
 WHO_AM_I_FEATURES, WHO_AM_I_LABELS, WHO_AM_I_IMAGE_PATHS = None, None, None
+WHERE_IM_DESCRIPTOR, WHO_AM_I_DESCRIPTOR = DescriptorHead(), DescriptorHead()
+WHERE_IM_GALLERY, WHO_AM_I_GALLERY = None, None
 
-TRANSLATE_UPLOAD_FOLDER = 'uploads/translate'
-os.makedirs(TRANSLATE_UPLOAD_FOLDER, exist_ok=True)
-TRANSLATE_MODEL = load_model("Egyptian_hieroglyphic_Model_classification.h5")
-TRANSLATE_LABEL_ENCODER = joblib.load("Egyptian_hieroglyphic_label_encoder.joblib")
+TRANSLATE_MODEL, TRANSLATE_LABEL_ENCODER = None, None
 TRANSLATE_CLIENT = Groq(api_key="API")
 
+# Set by serve.py: the master process preloads everything fork-safe and
+# each worker builds its own TensorFlow models in init_worker().
+PREFORK = os.getenv("KEMETPASS_PREFORK") == "1"
+
+# 'keras' serves the float32 .h5 / ImageNet models, 'tflite' the quantised exports
+INFERENCE_BACKEND = os.getenv("KEMETPASS_INFERENCE_BACKEND", "keras")
+TFLITE_VARIANT = os.getenv("KEMETPASS_TFLITE_VARIANT", "dynamic")
+# 'none' builds the backbones with random weights (benchmarks, offline machines)
+VGG16_WEIGHTS = os.getenv("KEMETPASS_VGG16_WEIGHTS", "imagenet")
+
+
+def load_models():
+    # TensorFlow is imported here, in the process that serves with it: the
+    # prefork master never touches it, and neither do tests of the plain routes
+    import joblib
+    import tensorflow as tf
+    from tensorflow.keras.applications.vgg16 import VGG16
+    from tensorflow.keras.models import load_model
+
+    global WHERE_IM_MODEL, WHO_AM_I_MODEL, TRANSLATE_MODEL, TRANSLATE_LABEL_ENCODER
+    TRANSLATE_LABEL_ENCODER = joblib.load("Egyptian_hieroglyphic_label_encoder.joblib")
+    intra_op_threads = int(os.getenv("KEMETPASS_TF_INTRA_OP_THREADS", "0"))
+    inter_op_threads = int(os.getenv("KEMETPASS_TF_INTER_OP_THREADS", "0"))
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+    if INFERENCE_BACKEND == 'tflite':
+        # Quantised artefacts from `python quantize.py export --mode <variant>`
+        num_threads = intra_op_threads or None
+        WHERE_IM_MODEL = TFLiteModel(quantize.artefact_path(quantize.BACKBONE, TFLITE_VARIANT), num_threads)
+        WHO_AM_I_MODEL = WHERE_IM_MODEL
+        TRANSLATE_MODEL = TFLiteModel(quantize.artefact_path(quantize.HIEROGLYPH, TFLITE_VARIANT), num_threads)
+        return
+
+    weights = None if VGG16_WEIGHTS == 'none' else VGG16_WEIGHTS
+    WHERE_IM_MODEL = VGG16(weights=weights, include_top=False, input_shape=(224, 224, 3))
+    # Both routes embed with the same frozen ImageNet backbone; one copy per worker is enough
+    WHO_AM_I_MODEL = WHERE_IM_MODEL
+    TRANSLATE_MODEL = load_model("Egyptian_hieroglyphic_Model_classification.h5")
+
 CHATBOT_MEMORY = []
 
+PREPROCESS_POOL = PreprocessPool(
+    int(os.environ["KEMETPASS_PREPROCESS_WORKERS"]) if "KEMETPASS_PREPROCESS_WORKERS" in os.environ else None
+)
+
+def rejection_threshold(data, feature_file):
+    # Explicit override, then the threshold descriptors.py calibrated offline and stored with the gallery
+    if os.getenv("KEMETPASS_REJECTION_THRESHOLD"):
+        return float(os.environ["KEMETPASS_REJECTION_THRESHOLD"])
+    if data.get("threshold") is None:
+        # Gallery falls back to a genuine-only pass over the whole gallery, on every load
+        log.warning("gallery has no calibrated threshold; run descriptors.py calibrate",
+                    extra={"feature_file": feature_file})
+    return data.get("threshold")
+
 def load_where_im_features(feature_file="WHERE_IM_image_features.pkl"):
-    global WHERE_IM_FEATURES, WHERE_IM_LABELS, WHERE_IM_IMAGE_PATHS
+    global WHERE_IM_FEATURES, WHERE_IM_LABELS, WHERE_IM_IMAGE_PATHS, WHERE_IM_DESCRIPTOR, WHERE_IM_GALLERY
     try:
         with open(feature_file, "rb") as f:
             data = pickle.load(f)
@@ -76,13 +160,17 @@ def load_where_im_features(feature_file="WHERE_IM_image_features.pkl"):
             data["labels"],
             data["image_paths"],
         )
+        # Galleries re-pooled by descriptors.py carry the head their features were built with
+        WHERE_IM_DESCRIPTOR = DescriptorHead.from_dict(data.get("descriptor"))
+        WHERE_IM_GALLERY = Gallery(WHERE_IM_FEATURES, WHERE_IM_LABELS, rejection_threshold(data, feature_file))
+        WHERE_IM_FEATURES = WHERE_IM_GALLERY.features
     except Exception as e:
         raise FileNotFoundError(f"Error loading Where Am I features file: {e}")
 
-load_where_im_features("WHERE_IM_image_features.pkl")
+load_where_im_features(os.getenv("KEMETPASS_WHERE_IM_FEATURES", "WHERE_IM_image_features.pkl"))
 
 def load_who_am_i_features(feature_file="who_im_image_features.pkl"):
-    global WHO_AM_I_FEATURES, WHO_AM_I_LABELS, WHO_AM_I_IMAGE_PATHS
+    global WHO_AM_I_FEATURES, WHO_AM_I_LABELS, WHO_AM_I_IMAGE_PATHS, WHO_AM_I_DESCRIPTOR, WHO_AM_I_GALLERY
     try:
         with open(feature_file, "rb") as f:
             data = pickle.load(f)
@@ -91,12 +179,14 @@ def load_who_am_i_features(feature_file="who_im_image_features.pkl"):
             data["labels"],
             data["image_paths"],
         )
-        print("Who Am I features loaded successfully")
+        WHO_AM_I_DESCRIPTOR = DescriptorHead.from_dict(data.get("descriptor"))
+        WHO_AM_I_GALLERY = Gallery(WHO_AM_I_FEATURES, WHO_AM_I_LABELS, rejection_threshold(data, feature_file))
+        WHO_AM_I_FEATURES = WHO_AM_I_GALLERY.features
+        log.info("Who Am I features loaded", extra={"gallery_size": len(WHO_AM_I_LABELS)})
     except Exception as e:
-        print(f"Error loading Who Am I features file: {e}")
         raise FileNotFoundError(f"Error loading Who Am I features file: {e}")
         
-load_who_am_i_features("who_im_image_features.pkl")
+load_who_am_i_features(os.getenv("KEMETPASS_WHO_AM_I_FEATURES", "who_im_image_features.pkl"))
 
 
 def add_to_chatbot_memory(role, content):
@@ -104,52 +194,52 @@ def add_to_chatbot_memory(role, content):
     if len(CHATBOT_MEMORY) > 50:
         CHATBOT_MEMORY.pop(0)
 
-def preprocess_image_where_im(img_path, target_size=(224, 224)):
-    img = image.load_img(img_path, target_size=target_size)
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    return preprocess_input(img_array)
-
-def extract_where_im_features(path):
-    img = preprocess_image_where_im(path, target_size=(224, 224))
-    return WHERE_IM_MODEL.predict(img).flatten()
-
-def find_most_similar_place_where_im(query_img_path):
-    query_feature = extract_where_im_features(query_img_path).reshape(1, -1)
-    similarities = cosine_similarity(query_feature, WHERE_IM_FEATURES)[0]
-    if len(similarities) == 0:
-        return "Unknown Place"
-    most_similar_index = np.argmax(similarities)
-    return WHERE_IM_LABELS[most_similar_index]
-
-def preprocess_image_who_am_i(img_path, target_size=(224, 224)):
-    img = image.load_img(img_path, target_size=target_size)
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    return preprocess_input(img_array)
-
-def extract_who_am_i_features(path):
-    img = preprocess_image_who_am_i(path, target_size=(224, 224))
-    return WHO_AM_I_MODEL.predict(img).flatten()
-
-def find_most_similar_person_who_am_i(query_img_path):
-    query_feature = extract_who_am_i_features(query_img_path).reshape(1, -1)
-    similarities = cosine_similarity(query_feature, WHO_AM_I_FEATURES)[0]
-    if len(similarities) == 0:
-        return "Unknown Person"
-    most_similar_index = np.argmax(similarities)
-    return WHO_AM_I_LABELS[most_similar_index]
+def preprocess_image_where_im(img_path, target_size=(224, 224), views=1):
+    with metrics.span("decode"):
+        return PREPROCESS_POOL.load(img_path, target_size, preprocessing.VGG16, views)
+
+def fuse_view_embeddings(embeddings):
+    # Average the unit-normalised per-view descriptors into one query descriptor
+    return l2_normalize(embeddings).mean(axis=0)
+
+def request_views():
+    views = request.form.get('views', 1, type=int)
+    return max(1, min(views, preprocessing.MAX_VIEWS))
+
+def extract_where_im_features(path, views=1):
+    img = preprocess_image_where_im(path, target_size=(224, 224), views=views)
+    with metrics.span("predict"):
+        embeddings = WHERE_IM_MODEL.predict(img)
+    return fuse_view_embeddings(WHERE_IM_DESCRIPTOR(embeddings))
+
+def find_most_similar_place_where_im(query_img_path, k=3, views=1):
+    query_feature = extract_where_im_features(query_img_path, views)
+    with metrics.span("similarity"):
+        return WHERE_IM_GALLERY.identify(query_feature, k, unknown="Unknown Place")
+
+def preprocess_image_who_am_i(img_path, target_size=(224, 224), views=1):
+    with metrics.span("decode"):
+        return PREPROCESS_POOL.load(img_path, target_size, preprocessing.VGG16, views)
+
+def extract_who_am_i_features(path, views=1):
+    img = preprocess_image_who_am_i(path, target_size=(224, 224), views=views)
+    with metrics.span("predict"):
+        embeddings = WHO_AM_I_MODEL.predict(img)
+    return fuse_view_embeddings(WHO_AM_I_DESCRIPTOR(embeddings))
+
+def find_most_similar_person_who_am_i(query_img_path, k=3, views=1):
+    query_feature = extract_who_am_i_features(query_img_path, views)
+    with metrics.span("similarity"):
+        return WHO_AM_I_GALLERY.identify(query_feature, k, unknown="Unknown Person")
 
 def preprocess_translate_image(img_path):
-    img = image.load_img(img_path, target_size=(128, 128))
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array /= 255.0
-    return img_array
+    with metrics.span("decode"):
+        return PREPROCESS_POOL.load(img_path, (128, 128), preprocessing.UNIT_SCALE)
 
 def predict_translate_class(img_path):
     processed_image = preprocess_translate_image(img_path)
-    predictions = TRANSLATE_MODEL.predict(processed_image)
+    with metrics.span("predict"):
+        predictions = TRANSLATE_MODEL.predict(processed_image)
     predicted_class_index = np.argmax(predictions, axis=1)
     return TRANSLATE_LABEL_ENCODER.inverse_transform(predicted_class_index)[0]
 
@@ -182,13 +272,15 @@ def generate_translate_sentence(predicted_classes):
         "stream": False,
     }
 
-    completion = TRANSLATE_CLIENT.chat.completions.create(**request_params)
+    with metrics.span("groq"):
+        completion = TRANSLATE_CLIENT.chat.completions.create(**request_params)
     response_content = completion.choices[0].message.content
 
     return response_content.strip()
 
 
 @app.route('/register', methods=['POST'])
+@AUTH.authenticated(optional=True)
 def register():
     try:
         data = request.json
@@ -200,9 +292,7 @@ def register():
         
         if not email or not password:
             return jsonify({"error": "Email and password are required"}), 400
-            
-        print(f"Register API: username={username}, firstName={firstName}, secondName={secondName}")
-            
+
         result = db.register_user(
             email, 
             password, 
@@ -216,48 +306,46 @@ def register():
             user_id = result["user_id"]
             user_folder = os.path.join(USERS_IMAGES_FOLDER, str(user_id))
             os.makedirs(user_folder, exist_ok=True)
-            print(f"Created user folder: {user_folder}")
+            log.info("user registered", extra={"user_id": user_id})
             
-            session['user_id'] = user_id
+            if AUTH.legacy:
+                session['user_id'] = user_id
+            token, token_expires = AUTH.issue(user_id)
             
-            conn = sqlite3.connect(db.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                'SELECT id, email, username, profile_picture, firstName, secondName, phone, country, language FROM users WHERE id = ?', 
-                (user_id,)
-            )
-            user = cursor.fetchone()
-            conn.close()
+            user = db.get_user(user_id)
             
             if user:
-                profile_picture = user[3]
+                profile_picture = user["profile_picture"]
                 full_profile_picture_url = get_full_image_url(profile_picture) if profile_picture else ""
                 
                 return jsonify({
                     "success": True, 
                     "user_id": user_id,
+                    "token": token,
+                    "tokenExpiresAt": token_expires,
                     "user": {
-                        "id": user[0],
-                        "email": user[1],
-                        "username": user[2],
+                        "id": user["id"],
+                        "email": user["email"],
+                        "username": user["username"],
                         "profileImageUrl": full_profile_picture_url,
-                        "firstName": user[4] or "",
-                        "secondName": user[5] or "",
-                        "phone": user[6] or "",
-                        "country": user[7] or "Egypt",
-                        "language": user[8] or "English"
+                        "firstName": user["firstName"] or "",
+                        "secondName": user["secondName"] or "",
+                        "phone": user["phone"] or "",
+                        "country": user["country"] or "Egypt",
+                        "language": user["language"] or "English"
                     }
                 })
             
-            return jsonify({"success": True, "user_id": user_id})
+            return jsonify({"success": True, "user_id": user_id, "token": token, "tokenExpiresAt": token_expires})
         else:
             return jsonify({"error": result["error"]}), 400
             
     except Exception as e:
-        print(f"Register API error: {str(e)}")
+        log.exception("register failed")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/login', methods=['POST'])
+@AUTH.authenticated(optional=True)
 def login():
     try:
         data = request.json
@@ -270,8 +358,10 @@ def login():
         result = db.login_user(email, password)
         
         if result["success"]:
-            session['user_id'] = result["user"]["id"]
-            return jsonify({"success": True, "user": result["user"]})
+            if AUTH.legacy:
+                session['user_id'] = result["user"]["id"]
+            token, token_expires = AUTH.issue(result["user"]["id"])
+            return jsonify({"success": True, "user": result["user"], "token": token, "tokenExpiresAt": token_expires})
         else:
             return jsonify({"error": result["error"]}), 401
             
@@ -279,35 +369,25 @@ def login():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/logout', methods=['POST'])
+@AUTH.authenticated(optional=True)
 def logout():
+    # Signed tokens can't be revoked here; the client drops its token and it expires
     session.pop('user_id', None)
     return jsonify({"success": True})
 
+def current_profile_picture(user_id):
+    conn = sqlite3.connect(db.db_path, factory=TimedConnection)
+    cursor = conn.cursor()
+    cursor.execute('SELECT profile_picture FROM users WHERE id = ?', (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
 @app.route('/update_profile', methods=['POST'])
+@AUTH.authenticated()
 def update_profile():
     try:
-
-        user_id = None
-        if 'user_id' in session:
-            user_id = session['user_id']
-        elif 'User-ID' in request.headers:
-            try:
-                user_id = int(request.headers['User-ID'])
-            except ValueError:
-                return jsonify({"error": "Invalid User-ID in header"}), 400
-        elif request.json and 'userId' in request.json:
-            try:
-                user_id = int(request.json['userId'])
-            except ValueError:
-                return jsonify({"error": "Invalid userId in request body"}), 400
-        elif request.form and 'userId' in request.form:
-            try:
-                user_id = int(request.form['userId'])
-            except ValueError:
-                return jsonify({"error": "Invalid userId in form data"}), 400
-        
-        if user_id is None:
-            return jsonify({"error": "Not authenticated"}), 401
+        user_id = g.user_id
         
         is_multipart = request.content_type and 'multipart/form-data' in request.content_type
         
@@ -320,23 +400,13 @@ def update_profile():
             phone = request.form.get('phone')
             country = request.form.get('country')
             language = request.form.get('language')
-            
-            print(f"Update profile - firstName: {firstName}, secondName: {secondName}")
-            
+
             profile_picture = None
             if 'profile_picture' in request.files:
                 file = request.files['profile_picture']
                 if file.filename:
-
-                    user_folder = os.path.join(USERS_IMAGES_FOLDER, str(user_id))
-                    os.makedirs(user_folder, exist_ok=True)
-                    
-                    filename = secure_filename(file.filename)
-                    filepath = os.path.join(user_folder, filename)
-                    file.save(filepath)
-                    
-                    profile_picture = f"/uploads/users_images/{user_id}/{filename}"
-                    print(f"Uploaded profile picture to {filepath}, URL: {profile_picture}")
+                    profile_picture = BLOBS.put(file)
+                    DERIVATIVES.schedule(profile_picture)
         else:
             data = request.json
             username = data.get('username')
@@ -346,10 +416,15 @@ def update_profile():
             phone = data.get('phone')
             country = data.get('country')
             language = data.get('language')
-            profile_picture = data.get('profileImageUrl')
-            
-            print(f"Update profile - firstName: {firstName}, secondName: {secondName}")
+            profile_picture = data.get('profileImageUrl') or None
+            if profile_picture:
+                # Usually the avatar URL we handed out; only a blob we stored may become one
+                profile_picture = BLOBS.key(profile_picture)
+                if not BLOBS.exists(profile_picture):
+                    log.info("ignoring profileImageUrl that is not a stored blob", extra={"user_id": user_id})
+                    profile_picture = None
         
+        old_profile_picture = BLOBS.key(current_profile_picture(user_id)) if profile_picture else None
         result = db.update_user_profile(
             user_id, 
             firstName=firstName,
@@ -364,31 +439,26 @@ def update_profile():
         
         if result["success"]:
             response_data = {"success": True}
+            if profile_picture and profile_picture != old_profile_picture:
+                BLOBS.incref(profile_picture)
+                BLOBS.decref(old_profile_picture)
             if profile_picture:
                 full_profile_picture_url = get_full_image_url(profile_picture)
                 response_data["profileImageUrl"] = full_profile_picture_url
-                print(f"Returning full profile picture URL: {full_profile_picture_url}")
+            log.info("profile updated", extra={"user_id": user_id, "picture_changed": bool(profile_picture)})
             return jsonify(response_data)
         else:
             return jsonify({"error": result["error"]}), 400
             
     except Exception as e:
-        print(f"Error in update_profile: {str(e)}")
+        log.exception("update_profile failed")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/upload_profile_image', methods=['POST'])
+@AUTH.authenticated()
 def upload_profile_image():
     try:
-        user_id = None
-        if 'user_id' in session:
-            user_id = session['user_id']
-        elif 'User-ID' in request.headers:
-            user_id = request.headers['User-ID']
-        elif request.form and 'userId' in request.form:
-            user_id = request.form['userId']
-        
-        if user_id is None:
-            return jsonify({"error": "Not authenticated"}), 401
+        user_id = g.user_id
             
         if 'profile_picture' not in request.files:
             return jsonify({"error": "No profile picture uploaded"}), 400
@@ -397,31 +467,19 @@ def upload_profile_image():
         if not file.filename:
             return jsonify({"error": "No file selected"}), 400
 
-        print(f"Uploading profile picture for user ID: {user_id}")
-            
-        user_folder = os.path.join(USERS_IMAGES_FOLDER, str(user_id))
-        os.makedirs(user_folder, exist_ok=True)
-        
-        for old_file in os.listdir(user_folder):
-            old_file_path = os.path.join(user_folder, old_file)
-            if os.path.isfile(old_file_path):
-                os.remove(old_file_path)
-                print(f"Deleted old profile picture: {old_file_path}")
-        
-        timestamp = int(datetime.now().timestamp())
-        filename = secure_filename(f"{user_id}_{timestamp}_{file.filename}")
-        filepath = os.path.join(user_folder, filename)
-        file.save(filepath)
-        
-        profile_picture_url = f"/uploads/users_images/{user_id}/{filename}"
-        print(f"Uploaded profile picture to {filepath}, URL: {profile_picture_url}")
+        old_profile_picture = BLOBS.key(current_profile_picture(user_id))
+        profile_picture_url = BLOBS.put(file)
+        DERIVATIVES.schedule(profile_picture_url)
+        log.info("profile picture uploaded", extra={"user_id": user_id, "key": profile_picture_url})
         
         full_profile_picture_url = get_full_image_url(profile_picture_url)
-        print(f"Full profile picture URL: {full_profile_picture_url}")
         
         result = db.update_user_profile(user_id, profile_picture=profile_picture_url)
         
         if result["success"]:
+            if profile_picture_url != old_profile_picture:
+                BLOBS.incref(profile_picture_url)
+                BLOBS.decref(old_profile_picture)
             return jsonify({
                 "success": True,
                 "profileImageUrl": full_profile_picture_url
@@ -430,76 +488,51 @@ def upload_profile_image():
             return jsonify({"error": result["error"]}), 400
             
     except Exception as e:
-        print(f"Error in upload_profile_image: {str(e)}")
+        log.exception("upload_profile_image failed")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/get_profile', methods=['GET'])
+@AUTH.authenticated()
 def get_profile():
     try:
-
-        user_id = None
-        if 'user_id' in session:
-            user_id = session['user_id']
-        elif 'User-ID' in request.headers:
-            try:
-                user_id = request.headers['User-ID']
-            except ValueError:
-                return jsonify({"error": "Invalid User-ID in header"}), 400
-        
-        if user_id is None:
-            return jsonify({"error": "Not authenticated"}), 401
+        user_id = g.user_id
             
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        
-        print(f"Fetching profile for user_id: {user_id}, type: {type(user_id)}")
-        
-        cursor.execute(
-            'SELECT id, email, username, profile_picture, firstName, secondName, phone, country, language FROM users WHERE id = ?', 
-            (user_id,)
-        )
-        
-        user = cursor.fetchone()
-        conn.close()
+        user = db.get_user(user_id)
         
         if user:
 
-            profile_picture = user[3]
+            profile_picture = user["profile_picture"]
             full_profile_picture_url = get_full_image_url(profile_picture) if profile_picture else ""
             
-            print(f"Original profile picture path: {profile_picture}")
-            print(f"Full profile picture URL: {full_profile_picture_url}")
-            
             return jsonify({
                 "success": True,
                 "profile": {
-                    "id": user[0],
-                    "email": user[1],
-                    "username": user[2],
+                    "id": user["id"],
+                    "email": user["email"],
+                    "username": user["username"],
                     "profileImageUrl": full_profile_picture_url,
-                    "firstName": user[4] or "",
-                    "secondName": user[5] or "",
-                    "phone": user[6] or "",
-                    "country": user[7] or "Egypt",
-                    "language": user[8] or "English"
+                    "firstName": user["firstName"] or "",
+                    "secondName": user["secondName"] or "",
+                    "phone": user["phone"] or "",
+                    "country": user["country"] or "Egypt",
+                    "language": user["language"] or "English",
+                    "profileImageSizes": image_size_urls(profile_picture, DERIVATIVES.lookup([profile_picture])) if profile_picture else None
                 }
             })
         else:
-            print(f"No user found with id: {user_id}")
+            log.info("profile not found", extra={"user_id": user_id})
             return jsonify({"error": "User not found"}), 404
             
     except Exception as e:
-        print(f"Error in get_profile: {str(e)}")
+        log.exception("get_profile failed")
         return jsonify({"error": str(e)}), 500
 
 
 
 @app.route('/save_item', methods=['POST'])
+@AUTH.authenticated()
 def save_item():
     try:
-        if 'user_id' not in session:
-            return jsonify({"error": "Not authenticated"}), 401
-            
         data = request.json
         item_type = data.get('type')
         content = data.get('content')
@@ -507,7 +540,7 @@ def save_item():
         if not item_type or not content:
             return jsonify({"error": "Type and content are required"}), 400
             
-        result = db.save_item(session['user_id'], item_type, content)
+        result = db.save_item(g.user_id, item_type, content)
         
         if result["success"]:
             return jsonify({"success": True, "save_id": result["save_id"]})
@@ -517,18 +550,46 @@ def save_item():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def save_payload(save):
+    # The database hands back content as the stored JSON text; splice it in without re-parsing
+    return dict(save, content=fastjson.raw_json(save["content"]))
+
+def sync_response(key, result, row_payload=None):
+    """Delta sync payload: rows changed since `since`, ids deleted, and where to continue"""
+    return {
+        "success": True,
+        key: [row_payload(row) for row in result["rows"]] if row_payload else result["rows"],
+        "deleted": result["deleted"],
+        "nextSince": result["next_since"],
+        "hasMore": result["has_more"],
+        "reset": result["reset"],
+    }
+
+
 @app.route('/get_saves', methods=['GET'])
+@AUTH.authenticated()
+@conditional(VERSIONS, lambda: (user_scope('user_saves', g.user_id),))
 def get_saves():
     try:
-        if 'user_id' not in session:
-            return jsonify({"error": "Not authenticated"}), 401
-            
         item_type = request.args.get('type')
+        since = request.args.get('since', type=int)
         
-        result = db.get_user_saves(session['user_id'], item_type)
+        if since is not None:
+            result = db.get_changes('user_saves', g.user_id, since,
+                                    limit=request.args.get('limit', 200, type=int), item_type=item_type)
+            return jsonify(sync_response("saves", result, save_payload))
+        
+        # Read before the page so nothing written meanwhile falls before syncSince
+        sync_since = db.sync_position('user_saves', g.user_id)
+        result = db.get_user_saves(
+            g.user_id,
+            item_type,
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor', type=int)
+        )
         
         if result["success"]:
-            return jsonify({"success": True, "saves": result["saves"]})
+            return jsonify({"success": True, "saves": [save_payload(save) for save in result["saves"]], "nextCursor": result["next_cursor"], "syncSince": sync_since})
         else:
             return jsonify({"error": "Failed to get saved items"}), 500
             
@@ -536,14 +597,13 @@ def get_saves():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/delete_save/<int:save_id>', methods=['DELETE'])
+@AUTH.authenticated()
 def delete_save(save_id):
     try:
-        if 'user_id' not in session:
-            return jsonify({"error": "Not authenticated"}), 401
-            
-        result = db.delete_saved_item(save_id, session['user_id'])
+        result = db.delete_saved_item(save_id, g.user_id)
         
         if result["success"]:
+            BLOBS.decref(*saved_image_paths(result["content"]))
             return jsonify({"success": True})
         else:
             return jsonify({"error": "Failed to delete saved item"}), 404
@@ -552,53 +612,60 @@ def delete_save(save_id):
         return jsonify({"error": str(e)}), 500
 
 
+def answer_chat(context, question, user_id=None):
+    add_to_chatbot_memory("user", f"Context: {context}\nQuestion: {question}")
+
+    messages = [
+        {
+            "role": "system",
+            "content": """
+            You are a chatbot specializing in Ancient Egyptian history. 
+            Answer only questions related to pharaonic figures, ancient Egyptian stories, historical sites, Egyptian identity, pyramids, and ancient Egyptian history. 
+            If you don't know the answer, respond with: "I have not been provided with sufficient information on this topic."
+            Always reply in English only, using a concise and easy-to-understand style.
+            """
+        }
+    ] + CHATBOT_MEMORY
+
+    request_params = {
+        "model": "llama3-70b-8192",
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 1024,
+        "top_p": 1,
+        "stream": True,
+        "stop": None,
+    }
+
+    response_content = ""
+    with metrics.span("groq"):
+        completion = WHERE_IM_CLIENT.chat.completions.create(**request_params)
+        for chunk in completion:
+            chunk_content = chunk.choices[0].delta.content or ""
+            response_content += chunk_content
+
+    add_to_chatbot_memory("assistant", response_content)
+    
+
+    if user_id:
+        db.save_chat(user_id, question, response_content)
+
+    return response_content
+
+
 @app.route('/chat', methods=['POST'])
+@AUTH.authenticated(optional=True)
 def chat():
     try:
         data = request.json
         context = data.get('context', '')
         question = data.get('question', '')
-        user_id = session.get('user_id')
+        user_id = g.user_id
 
         if not question:
             return jsonify({"error": "Question is required"}), 400
 
-        add_to_chatbot_memory("user", f"Context: {context}\nQuestion: {question}")
-
-        messages = [
-            {
-                "role": "system",
-                "content": """
-                You are a chatbot specializing in Ancient Egyptian history. 
-                Answer only questions related to pharaonic figures, ancient Egyptian stories, historical sites, Egyptian identity, pyramids, and ancient Egyptian history. 
-                If you don't know the answer, respond with: "I have not been provided with sufficient information on this topic."
-                Always reply in English only, using a concise and easy-to-understand style.
-                """
-            }
-        ] + CHATBOT_MEMORY
-
-        request_params = {
-            "model": "llama3-70b-8192",
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 1024,
-            "top_p": 1,
-            "stream": True,
-            "stop": None,
-        }
-
-        completion = WHERE_IM_CLIENT.chat.completions.create(**request_params)
-        response_content = ""
-
-        for chunk in completion:
-            chunk_content = chunk.choices[0].delta.content or ""
-            response_content += chunk_content
-
-        add_to_chatbot_memory("assistant", response_content)
-        
-
-        if user_id:
-            db.save_chat(user_id, question, response_content)
+        response_content = answer_chat(context, question, user_id)
             
         return jsonify({"response": response_content})
 
@@ -606,17 +673,21 @@ def chat():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/chat_history', methods=['GET'])
+@AUTH.authenticated()
+@conditional(VERSIONS, lambda: (user_scope('chat_history', g.user_id),))
 def get_chat_history():
     try:
-        if 'user_id' not in session:
-            return jsonify({"error": "Not authenticated"}), 401
-            
         limit = request.args.get('limit', 50, type=int)
+        since = request.args.get('since', type=int)
         
-        result = db.get_chat_history(session['user_id'], limit)
+        if since is not None:
+            return jsonify(sync_response("history", db.get_changes('chat_history', g.user_id, since, limit=limit)))
+        
+        sync_since = db.sync_position('chat_history', g.user_id)
+        result = db.get_chat_history(g.user_id, limit, cursor=request.args.get('cursor', type=int))
         
         if result["success"]:
-            return jsonify({"success": True, "history": result["history"]})
+            return jsonify({"success": True, "history": result["history"], "nextCursor": result["next_cursor"], "syncSince": sync_since})
         else:
             return jsonify({"error": "Failed to get chat history"}), 500
             
@@ -625,7 +696,22 @@ def get_chat_history():
 
 
 
+@app.route('/chat_history/search', methods=['GET'])
+@AUTH.authenticated()
+def search_chat_history():
+    result = SEARCH.search_chat(
+        g.user_id,
+        request.args.get('q', ''),
+        limit=request.args.get('limit', 20, type=int),
+        offset=request.args.get('offset', 0, type=int)
+    )
+    if not result["success"]:
+        return jsonify({"error": result["error"]}), 400
+    return jsonify({"success": True, "history": result["results"], "nextOffset": result["next_offset"]})
+
+
 @app.route('/predict_where_im', methods=['POST'])
+@AUTH.authenticated(optional=True)
 def predict_where_im():
     try:
         if 'file' not in request.files:
@@ -635,22 +721,25 @@ def predict_where_im():
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
 
-        filepath = os.path.join(WHERE_IM_UPLOAD_FOLDER, secure_filename(file.filename))
-        file.save(filepath)
+        image_key = BLOBS.put(file)
+        filepath = BLOBS.path(image_key)
 
-        most_similar_place = find_most_similar_place_where_im(filepath)
+        top_k = request.form.get('top_k', 3, type=int)
+        most_similar_place, candidates, confident = find_most_similar_place_where_im(filepath, top_k, request_views())
         
 
-        if 'user_id' in session:
-            db.save_item(session['user_id'], 'where_im', {"place": most_similar_place, "image": filepath})
+        if g.user_id:
+            db.save_item(g.user_id, 'where_im', {"place": most_similar_place, "image": image_key})
+            BLOBS.incref(image_key)
             
-        return jsonify({"place": most_similar_place})
+        return jsonify({"place": most_similar_place, "confident": confident, "candidates": candidates})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
 
 @app.route('/who_am_i', methods=['POST'])
+@AUTH.authenticated(optional=True)
 def who_am_i():
     try:
         if 'file' not in request.files:
@@ -660,21 +749,47 @@ def who_am_i():
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
 
-        filepath = os.path.join(WHO_IM_UPLOAD_FOLDER, secure_filename(file.filename))
-        file.save(filepath)
+        image_key = BLOBS.put(file)
+        filepath = BLOBS.path(image_key)
 
-        most_similar_person = find_most_similar_person_who_am_i(filepath)
+        top_k = request.form.get('top_k', 3, type=int)
+        most_similar_person, candidates, confident = find_most_similar_person_who_am_i(filepath, top_k, request_views())
         
-        if 'user_id' in session:
-            db.save_item(session['user_id'], 'who_im', {"person": most_similar_person, "image": filepath})
+        if g.user_id:
+            db.save_item(g.user_id, 'who_im', {"person": most_similar_person, "image": image_key})
+            BLOBS.incref(image_key)
                     
-        return jsonify({"person": most_similar_person})
+        return jsonify({"person": most_similar_person, "confident": confident, "candidates": candidates})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def save_translate_uploads(files):
+    return [BLOBS.put(file) for file in files]
+
+
+def translate_images(file_paths, user_id=None):
+    predicted_classes = [predict_translate_class(BLOBS.path(filepath)) for filepath in file_paths]
+    translation = generate_translate_sentence(predicted_classes)
+
+    if user_id:
+        db.save_item(
+            user_id, 
+            'translate', 
+            {
+                "translation": translation,
+                "classes": predicted_classes,
+                "images": file_paths
+            }
+        )
+        BLOBS.incref(*file_paths)
+
+    return translation, predicted_classes
+
+
 @app.route('/translate_hieroglyphic', methods=['POST'])
+@AUTH.authenticated(optional=True)
 def translate_hieroglyphics():
     try:
         if 'files' not in request.files:
@@ -684,27 +799,8 @@ def translate_hieroglyphics():
         if not files or len(files) > 10:
             return jsonify({"error": "You can upload between 1 and 10 images."}), 400
 
-        predicted_classes = []
-        file_paths = []
-        for file in files:
-            filepath = os.path.join(TRANSLATE_UPLOAD_FOLDER, secure_filename(file.filename))
-            file.save(filepath)
-            file_paths.append(filepath)
-            predicted_class = predict_translate_class(filepath)
-            predicted_classes.append(predicted_class)
-
-        translation = generate_translate_sentence(predicted_classes)
-        
-        if 'user_id' in session:
-            db.save_item(
-                session['user_id'], 
-                'translate', 
-                {
-                    "translation": translation,
-                    "classes": predicted_classes,
-                    "images": file_paths
-                }
-            )
+        file_paths = save_translate_uploads(files)
+        translation, predicted_classes = translate_images(file_paths, g.user_id)
             
         return jsonify({"translation": translation, "classes": predicted_classes})
 
@@ -712,7 +808,7 @@ def translate_hieroglyphics():
         return jsonify({"error": str(e)}), 500
 
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.getenv("KEMETPASS_BASE_DIR", os.path.dirname(os.path.abspath(__file__)))
 UPLOADS_DIR = os.path.join(BASE_DIR, 'uploads')
 POST_IMAGES_DIR = os.path.join(UPLOADS_DIR, 'post_images')
 USER_IMAGES_DIR = os.path.join(UPLOADS_DIR, 'user_images')
@@ -722,9 +818,13 @@ for directory in [UPLOADS_DIR, POST_IMAGES_DIR, USER_IMAGES_DIR]:
     if not os.path.exists(directory):
         os.makedirs(directory)
 
+# The client sends back the absolute URLs get_full_image_url() gave it
+BLOBS = BlobStore(db.db_path, BASE_DIR, hosts=[urlsplit(SERVER_URL).netloc])
+DERIVATIVES = DerivativeStore(db.db_path, BASE_DIR, max_workers=int(os.getenv("KEMETPASS_DERIVATIVE_WORKERS", "2")))
+
 
 def init_community_tables():
-    conn = sqlite3.connect('kemetpass.db')
+    conn = sqlite3.connect('kemetpass.db', factory=TimedConnection)
     cursor = conn.cursor()
     
 
@@ -747,6 +847,7 @@ def init_community_tables():
         FOREIGN KEY (post_id) REFERENCES community_posts (id)
     )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_community_post_images_post ON community_post_images (post_id, id)')
     
 
     cursor.execute('''
@@ -789,34 +890,140 @@ def init_community_tables():
     
     conn.commit()
     conn.close()
-    print("تم إنشاء جداول المجتمع بنجاح")
+    log.info("community tables ready")
 
 
 init_community_tables()
+SEARCH = SearchIndex(db.db_path)
+TRENDING = TrendingScores(db.db_path, half_life_hours=float(os.getenv("KEMETPASS_TRENDING_HALF_LIFE_HOURS", "24")))
+VERSIONS.track()
 
 
-def get_post_stats(post_id):
-    conn = sqlite3.connect('kemetpass.db')
-    conn.row_factory = sqlite3.Row
+def get_page_details(post_ids):
+    """Images, like counts and comment counts for a page of posts: one connection, one query each"""
+    images = {post_id: [] for post_id in post_ids}
+    likes, comments = {}, {}
+    if not post_ids:
+        return images, likes, comments
+
+    placeholders = ', '.join('?' for _ in post_ids)
+    conn = sqlite3.connect(db.db_path, factory=TimedConnection)
     cursor = conn.cursor()
-    
+    cursor.execute(
+        f'SELECT post_id, image_path FROM community_post_images WHERE post_id IN ({placeholders}) ORDER BY post_id, id',
+        post_ids
+    )
+    for post_id, image_path in cursor.fetchall():
+        images[post_id].append(image_path)
+    for table, counts in (('community_likes', likes), ('community_comments', comments)):
+        cursor.execute(f'SELECT post_id, COUNT(*) FROM {table} WHERE post_id IN ({placeholders}) GROUP BY post_id', post_ids)
+        counts.update(cursor.fetchall())
+    conn.close()
+    return images, likes, comments
 
-    cursor.execute('SELECT COUNT(*) FROM community_likes WHERE post_id = ?', (post_id,))
-    likes_count = cursor.fetchone()[0]
-    
 
-    cursor.execute('SELECT COUNT(*) FROM community_comments WHERE post_id = ?', (post_id,))
-    comments_count = cursor.fetchone()[0]
-    
-    conn.close()
-    
-    return likes_count, comments_count
+def image_size_urls(image_path, derived):
+    urls = {"original": get_full_image_url(image_path)}
+    for size, path in derived.get(normalize_image_path(image_path), {}).items():
+        urls[size] = get_full_image_url(path)
+    return urls
+
+
+def attach_image_sizes(entries, originals=False):
+    # entries: (post_dict, raw user image path, raw post image paths); one derivative lookup for the page
+    derived = DERIVATIVES.lookup([path for _, user_image, paths in entries for path in [user_image, *paths]])
+    for post_dict, user_image, image_paths in entries:
+        if user_image:
+            user_urls = image_size_urls(user_image, derived)
+            post_dict['userImage'] = user_urls.get('thumb', user_urls['original'])
+        sizes = [image_size_urls(path, derived) for path in image_paths]
+        post_dict['imageSizes'] = sizes or None
+        if sizes:
+            # Feed cards only need the medium size; originals are opt-in
+            post_dict['images'] = [urls['original'] if originals else urls.get('medium', urls['original']) for urls in sizes]
+
+
+def build_post_dicts(posts_data):
+    """Feed entries for community_posts rows joined with their author; also returns image entries for attach_image_sizes"""
+    posts = []
+    image_entries = []
+    images, likes, comments = get_page_details([post['id'] for post in posts_data])
+    for post in posts_data:
+        post_id = post['id']
+        image_paths = images[post_id]
+        likes_count, comments_count = likes.get(post_id, 0), comments.get(post_id, 0)
+        
+
+        username = post['username'] or f"{post['firstName']} {post['secondName']}"
+        
+
+        user_image = post['userImage']
+        if user_image:
+            user_image = get_full_image_url(user_image)
+        else:
+            user_image = 'https://randomuser.me/api/portraits/lego/1.jpg'
+        
+
+        full_image_paths = [get_full_image_url(image_path) for image_path in image_paths]
+        
+
+        post_dict = {
+            'id': post_id,
+            'userId': post['user_id'],
+            'username': username,
+            'userImage': user_image,
+            'content': post['content'],
+            'createdAt': post['created_at'],
+            'likes': likes_count,
+            'comments': comments_count,
+            'shares': 0,
+            'images': full_image_paths if full_image_paths else None
+        }
+        
+        posts.append(post_dict)
+        image_entries.append((post_dict, post['userImage'], image_paths))
+
+    return posts, image_entries
+
+
+@app.route('/posts/search', methods=['GET'])
+@AUTH.authenticated(optional=True)
+def search_posts():
+    result = SEARCH.search_posts(
+        request.args.get('q', ''),
+        limit=request.args.get('limit', 20, type=int),
+        offset=request.args.get('offset', 0, type=int)
+    )
+    if not result["success"]:
+        return jsonify(result), 400
+
+    posts, image_entries = build_post_dicts(result["results"])
+    for post_dict, row in zip(posts, result["results"]):
+        post_dict['snippet'] = row['snippet']
+    attach_image_sizes(image_entries, originals=request.args.get('originals') == 'true')
+    return jsonify({"success": True, "posts": posts, "nextOffset": result["next_offset"]}), 200
+
+
+@app.route('/posts/trending', methods=['GET'])
+@AUTH.authenticated(optional=True)
+def get_trending_posts():
+    result = TRENDING.page(
+        limit=request.args.get('limit', 20, type=int),
+        cursor=request.args.get('cursor')
+    )
+    if not result["success"]:
+        return jsonify(result), 400
+
+    posts, image_entries = build_post_dicts(result["results"])
+    attach_image_sizes(image_entries, originals=request.args.get('originals') == 'true')
+    return jsonify({"success": True, "posts": posts, "nextCursor": result["next_cursor"]}), 200
 
 
 @app.route('/ping', methods=['GET'])
+@AUTH.authenticated(optional=True)
 def ping():
-    user_id = request.headers.get('User-ID')
-    print(f"Ping received from user_id: {user_id}")
+    user_id = g.user_id
+    log.debug("ping", extra={"user_id": user_id, "sample": "ping"})
     
     response = {
         "success": True, 
@@ -827,27 +1034,31 @@ def ping():
 
     if user_id:
         try:
-            conn = sqlite3.connect(db.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
-            result = cursor.fetchone()
-            conn.close()
+            user = db.get_user(user_id)
             
-            if result:
-                response["username"] = result[0]
+            if user:
+                response["username"] = user["username"]
                 response["authenticated"] = True
             else:
                 response["authenticated"] = False
         except Exception as e:
-            print(f"Error in ping: {str(e)}")
+            log.exception("ping failed")
             response["error"] = str(e)
+    elif 'Authorization' in request.headers or 'User-ID' in request.headers:
+        response["authenticated"] = False
     
     return jsonify(response), 200
 
 
+# Feed entries carry author names and pictures and derivative URLs as well as post data
+FEED_SCOPES = ('community', 'users', 'image_derivatives')
+
+
 @app.route('/posts', methods=['GET'])
+@AUTH.authenticated(optional=True)
+@conditional(VERSIONS, lambda: FEED_SCOPES)
 def get_posts():
-    conn = sqlite3.connect('kemetpass.db')
+    conn = sqlite3.connect('kemetpass.db', factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
@@ -864,110 +1075,49 @@ def get_posts():
     posts_data = cursor.fetchall()
     conn.close()
     
-    posts = []
-    for post in posts_data:
-        post_id = post['id']
-        
-
-        conn = sqlite3.connect('kemetpass.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT image_path FROM community_post_images WHERE post_id = ?', (post_id,))
-        images_data = cursor.fetchall()
-        conn.close()
-        
-
-        likes_count, comments_count = get_post_stats(post_id)
-        
-
-        username = post['username'] or f"{post['firstName']} {post['secondName']}"
-        
-
-        user_image = post['userImage']
-        if user_image:
-            user_image = get_full_image_url(user_image)
-        else:
-            user_image = 'https://randomuser.me/api/portraits/lego/1.jpg'
-        
-
-        full_image_paths = []
-        if images_data:
-            for img in images_data:
-                image_path = img['image_path']
-                full_path = get_full_image_url(image_path)
-                full_image_paths.append(full_path)
-        
-
-        post_dict = {
-            'id': post_id,
-            'userId': post['user_id'],
-            'username': username,
-            'userImage': user_image,
-            'content': post['content'],
-            'createdAt': post['created_at'],
-            'likes': likes_count,
-            'comments': comments_count,
-            'shares': 0,
-            'images': full_image_paths if full_image_paths else None
-        }
-        
-        posts.append(post_dict)
-    
+    posts, image_entries = build_post_dicts(posts_data)
+    attach_image_sizes(image_entries, originals=request.args.get('originals') == 'true')
     return jsonify({"success": True, "posts": posts}), 200
 
 
 @app.route('/posts', methods=['POST'])
+@AUTH.authenticated()
 def create_post():
 
-    user_id = request.headers.get('User-ID') or request.form.get('userId')
+    user_id = g.user_id
     content = request.form.get('content')
     
-    if not user_id or not content:
+    if not content:
         return jsonify({"success": False, "error": "Missing required fields"}), 400
     
-
-    conn = sqlite3.connect('kemetpass.db')
-    conn.row_factory = sqlite3.Row
+    conn = sqlite3.connect('kemetpass.db', factory=TimedConnection)
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-    user = cursor.fetchone()
-    
-    if not user:
-        conn.close()
-        return jsonify({"success": False, "error": "User not found"}), 404
-    
 
     post_id = f"post_{uuid.uuid4().hex}"
     
 
-    cursor.execute('INSERT INTO community_posts (id, user_id, content) VALUES (?, ?, ?)',
-                  (post_id, user_id, content))
-    
-
+    # Store the image before opening the write transaction; the blob store writes its own table
+    image_url = None
     if 'image' in request.files:
         file = request.files['image']
         if file and file.filename:
+            image_url = BLOBS.put(file)
+            log.debug("stored post image", extra={"key": image_url})
 
-            filename = secure_filename(f"{post_id}_{file.filename}")
-            
-
-            os.makedirs(POST_IMAGES_DIR, exist_ok=True)
-            
-            file_path = os.path.join(POST_IMAGES_DIR, filename)
-            file.save(file_path)
-            
-            print(f"Saved image to: {file_path}")
-            print(f"File exists after save: {os.path.exists(file_path)}")
-            
+    cursor.execute('INSERT INTO community_posts (id, user_id, content) VALUES (?, ?, ?)',
+                  (post_id, user_id, content))
+    
 
-            image_url = f"uploads/post_images/{filename}"
-            cursor.execute('INSERT INTO community_post_images (post_id, image_path) VALUES (?, ?)',
-                          (post_id, image_url))
-            
-            print(f"Stored image URL in database: {image_url}")
+    if image_url:
+        cursor.execute('INSERT INTO community_post_images (post_id, image_path) VALUES (?, ?)',
+                      (post_id, image_url))
     
     conn.commit()
     conn.close()
+
+    if image_url:
+        BLOBS.incref(image_url)
+        DERIVATIVES.schedule(image_url)
     
     return jsonify({
         "success": True,
@@ -977,13 +1127,11 @@ def create_post():
 
 
 @app.route('/posts/<post_id>/like', methods=['POST'])
+@AUTH.authenticated()
 def like_post(post_id):
-    user_id = request.headers.get('User-ID')
-    
-    if not user_id:
-        return jsonify({"success": False, "error": "User ID is required"}), 400
+    user_id = g.user_id
     
-    conn = sqlite3.connect('kemetpass.db')
+    conn = sqlite3.connect('kemetpass.db', factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
@@ -1022,15 +1170,13 @@ def like_post(post_id):
 
 
 @app.route('/posts/<post_id>/bookmark', methods=['POST'])
+@AUTH.authenticated()
 def bookmark_post(post_id):
-    user_id = request.headers.get('User-ID')
+    user_id = g.user_id
     data = request.get_json() or {}
     bookmark = data.get('bookmark', True)
     
-    if not user_id:
-        return jsonify({"success": False, "error": "User ID is required"}), 400
-    
-    conn = sqlite3.connect('kemetpass.db')
+    conn = sqlite3.connect('kemetpass.db', factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
@@ -1068,13 +1214,12 @@ def bookmark_post(post_id):
 
 
 @app.route('/posts/bookmarked', methods=['GET'])
+@AUTH.authenticated()
+@conditional(VERSIONS, lambda: FEED_SCOPES)
 def get_bookmarked_posts():
-    user_id = request.headers.get('User-ID')
-    
-    if not user_id:
-        return jsonify({"success": False, "error": "User ID is required"}), 400
+    user_id = g.user_id
     
-    conn = sqlite3.connect('kemetpass.db')
+    conn = sqlite3.connect('kemetpass.db', factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
@@ -1094,19 +1239,12 @@ def get_bookmarked_posts():
     conn.close()
     
     posts = []
+    image_entries = []
+    images, likes, comments = get_page_details([post['id'] for post in posts_data])
     for post in posts_data:
         post_id = post['id']
-        
-
-        conn = sqlite3.connect('kemetpass.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT image_path FROM community_post_images WHERE post_id = ?', (post_id,))
-        images_data = cursor.fetchall()
-        conn.close()
-        
-
-        likes_count, comments_count = get_post_stats(post_id)
+        image_paths = images[post_id]
+        likes_count, comments_count = likes.get(post_id, 0), comments.get(post_id, 0)
         
 
         username = post['username'] or f"{post['firstName']} {post['secondName']}"
@@ -1122,39 +1260,27 @@ def get_bookmarked_posts():
             'likes': likes_count,
             'comments': comments_count,
             'shares': 0,
-            'images': [img['image_path'] for img in images_data] if images_data else None
+            'images': image_paths or None
         }
         
         posts.append(post_dict)
+        image_entries.append((post_dict, post['userImage'], image_paths))
     
+    attach_image_sizes(image_entries, originals=request.args.get('originals') == 'true')
     return jsonify({"success": True, "posts": posts}), 200
 
 
 @app.route('/uploads/<path:filename>')
-def uploaded_file(filename):
-
-    print(f"Requested file: {filename}")
-    print(f"UPLOADS_DIR: {UPLOADS_DIR}")
-    print(f"Full path: {os.path.join(UPLOADS_DIR, filename)}")
-    print(f"File exists: {os.path.exists(os.path.join(UPLOADS_DIR, filename))}")
-    
-    try:
-
-        return send_from_directory(UPLOADS_DIR, filename)
-    except Exception as e:
-        print(f"Error serving file {filename}: {str(e)}")
-
-        try:
-            return send_from_directory('uploads', filename)
-        except Exception as e2:
-            print(f"Second attempt failed: {str(e2)}")
-            return jsonify({"error": f"File not found: {filename}"}), 404
+@AUTH.authenticated(optional=True)
+def serve_uploads(filename):
+    # Blob names are bare content hashes; their type was sniffed when they were stored
+    return send_upload(UPLOADS_DIR, filename, BLOBS.content_type('uploads/' + filename))
 
 
 @app.route('/community/check_connection', methods=['GET'])
+@AUTH.authenticated(optional=True)
 def check_community_connection():
-    user_id = request.headers.get('User-ID')
-    print(f"Community connection check from user: {user_id}")
+    log.debug("community connection check", extra={"user_id": g.user_id, "sample": "ping"})
     
     return jsonify({
         "success": True,
@@ -1170,6 +1296,7 @@ import nltk
 import pandas as pd
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
+from itinerary_stream import PlanDayParser
 PROJECT_ROOT = Path(__file__).resolve().parent
 load_dotenv(PROJECT_ROOT / ".env")
 
@@ -1177,12 +1304,17 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", default="API")
 if not GEMINI_API_KEY:
     raise EnvironmentError("GEMINI_API_KEY missing - add it to .env")
 
-genai.configure(api_key=GEMINI_API_KEY)
+GEMINI_ENDPOINT = os.getenv("KEMETPASS_GEMINI_ENDPOINT")
+if GEMINI_ENDPOINT:
+    # Only the REST transport accepts a plain http:// endpoint such as benchmarks/fake_llm.py
+    genai.configure(api_key=GEMINI_API_KEY, transport="rest", client_options={"api_endpoint": GEMINI_ENDPOINT})
+else:
+    genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel("gemini-1.5-flash")
 data_dir = PROJECT_ROOT / "data"
 df = pd.read_csv("historical_places.csv")
 index = faiss.read_index("historical_places.index")
-encoder = SentenceTransformer("all-mpnet-base-v2")
+encoder = SentenceTransformer(os.getenv("KEMETPASS_SENTENCE_ENCODER", "all-mpnet-base-v2"))
 
 nltk.download("punkt", quiet=True)
 
@@ -1226,8 +1358,10 @@ SCHEMA = {
 
 
 def search_places(query: str, k: int = 5) -> List[Dict[str, Any]]:
-    emb = encoder.encode([query])
-    _, idx = index.search(emb, k)
+    with metrics.span("embed"):
+        emb = encoder.encode([query])
+    with metrics.span("faiss"):
+        _, idx = index.search(emb, k)
     return df.iloc[idx[0]].to_dict("records")
 
 
@@ -1240,54 +1374,273 @@ def build_content(user_prefs: Dict[str, Any], places: List[Dict[str, Any]]):
         + json.dumps(places, ensure_ascii=False)
     )
     return [{"role": "user", "parts": [msg]}]
+
+ITINERARY_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "response_mime_type": "application/json",
+    "response_schema": SCHEMA,
+}
+
+PLAN_TRIP_FIRST_DAY_SECONDS = deque(maxlen=1000)
+
+
+def record_first_day(started):
+    """Time from the start of a plan_trip request to its first usable day, for /plan_trip/stats and /metrics"""
+    elapsed = time.perf_counter() - started
+    PLAN_TRIP_FIRST_DAY_SECONDS.append(elapsed)
+    metrics.observe("gemini.first_day", elapsed)
+    log.info("plan_trip first day", extra={"seconds": round(elapsed, 3)})
+
+
 def generate_itinerary(prefs: Dict[str, Any], k: int = 6) -> Dict[str, Any]:
+    started = time.perf_counter()
+    places = search_places(prefs["query"], k)
+    content = build_content(prefs, places)
+
+    with metrics.span("gemini"):
+        resp = model.generate_content(
+            contents=content,
+            generation_config=ITINERARY_GENERATION_CONFIG,
+        )
+
+    itinerary = json.loads(resp.text)
+    # Unstreamed, the first day arrives with the whole plan
+    record_first_day(started)
+    return itinerary
+
+
+def generate_itinerary_stream(prefs: Dict[str, Any], k: int = 6):
+    """Yield ("day", day) for every completed day of the plan, then ("done", itinerary)"""
+    started = time.perf_counter()
     places = search_places(prefs["query"], k)
     content = build_content(prefs, places)
 
     resp = model.generate_content(
         contents=content,
-        generation_config={
-            "temperature": 0.7,
-            "response_mime_type": "application/json",
-            "response_schema": SCHEMA,
-        },
+        generation_config=ITINERARY_GENERATION_CONFIG,
+        stream=True,
     )
 
-    return json.loads(resp.text)
+    parser = PlanDayParser(SCHEMA)
+    first_day_seen = False
+    for chunk in resp:
+        for day in parser.feed(chunk.text):
+            if not first_day_seen:
+                first_day_seen = True
+                record_first_day(started)
+            yield "day", day
+
+    metrics.observe("gemini", time.perf_counter() - started)
+    yield "done", parser.close(SCHEMA)
+
+
+def plan_trip_stats():
+    samples = sorted(PLAN_TRIP_FIRST_DAY_SECONDS)
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+    }
+
+
+def parse_trip_prefs(data):
+    """Trip preferences from a request body; None when fields are missing, ValueError when days isn't a number"""
+    query = data.get('query')
+    start = data.get('start')
+    days = data.get('days')
+    budget = data.get('budget')
+    if not all([query, start, days, budget]):
+        return None
+    try:
+        days = int(days)
+    except (TypeError, ValueError):
+        raise ValueError("days must be an integer") from None
+
+    return {
+        "query": query,
+        "start": start,
+        "days": days,
+        "budget": budget
+    }
 
 
 @app.route('/plan_trip', methods=['POST'])
+@AUTH.authenticated(optional=True)
 def plan_trip():
     try:
-        data = request.json
+        prefs = parse_trip_prefs(request.json or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if prefs is None:
+        return jsonify({"error": "Missing required fields"}), 400
 
-        query = data.get('query')
-        start = data.get('start')
-        days = data.get('days')
-        budget = data.get('budget')
-        if not all([query, start, days, budget]):
-            return jsonify({"error": "Missing required fields"}), 400
-
-        prefs = {
-            "query": query,
-            "start": start,
-            "days": int(days),
-            "budget": budget
-        }
+    try:
         itinerary = generate_itinerary(prefs)
         return jsonify({"success": True, "itinerary": itinerary})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route('/plan_trip/stream', methods=['POST'])
+@AUTH.authenticated(optional=True)
+def plan_trip_stream():
+    try:
+        prefs = parse_trip_prefs(request.json or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if prefs is None:
+        return jsonify({"error": "Missing required fields"}), 400
+
+    def events():
+        try:
+            for event, payload in generate_itinerary_stream(prefs):
+                if event == "day":
+                    yield json.dumps({"event": "day", "day": payload}, ensure_ascii=False) + "\n"
+                else:
+                    yield json.dumps({"event": "done", "success": True, "itinerary": payload}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "success": False, "error": str(e)}) + "\n"
+
+    return Response(stream_with_context(events()), mimetype='application/x-ndjson')
+
+
+@app.route('/plan_trip/stats', methods=['GET'])
+@AUTH.authenticated(optional=True)
+def get_plan_trip_stats():
+    return jsonify({"success": True, "time_to_first_day": plan_trip_stats()})
+
+
+@app.route('/metrics', methods=['GET'])
+@AUTH.authenticated(optional=True)
+def get_metrics():
+    if not metrics.ENABLED:
+        return jsonify({"error": "Metrics are disabled; set KEMETPASS_METRICS=1"}), 404
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+def run_chat_job(payload):
+    return {"response": answer_chat(payload["context"], payload["question"], payload.get("user_id"))}
+
+
+def run_translate_job(payload):
+    translation, predicted_classes = translate_images(payload["images"], payload.get("user_id"))
+    return {"translation": translation, "classes": predicted_classes}
+
+
+def run_plan_trip_job(payload):
+    return {"itinerary": generate_itinerary(payload["prefs"])}
+
+
+JOBS = JobQueue(db.db_path, max_workers=int(os.getenv("KEMETPASS_JOB_WORKERS", "2")))
+JOBS.register('chat', run_chat_job, priority=0)
+JOBS.register('translate_hieroglyphic', run_translate_job, priority=1)
+JOBS.register('plan_trip', run_plan_trip_job, priority=2)
+
+
+def init_worker():
+    # Fork the process pools before TensorFlow starts its thread pools
+    PREPROCESS_POOL.start()
+    passwords.start()
+    load_models()
+    JOBS.start()
+    TRENDING.start(interval=float(os.getenv("KEMETPASS_TRENDING_INTERVAL", "30")))
+
+
+if not PREFORK:
+    init_worker()
+
+
+def job_user_key():
+    # Anonymous jobs belong to the client address
+    return str(g.user_id or request.remote_addr)
+
+
+def submit_job(kind, payload):
+    try:
+        job_id = JOBS.submit(kind, payload, job_user_key())
+    except QueueFull as e:
+        return jsonify({"success": False, "error": str(e)}), 503
+    return jsonify({"success": True, "job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+
+@app.route('/jobs/chat', methods=['POST'])
+@AUTH.authenticated(optional=True)
+def submit_chat_job():
+    data = request.json or {}
+    question = data.get('question', '')
+    if not question:
+        return jsonify({"error": "Question is required"}), 400
+
+    return submit_job('chat', {
+        "context": data.get('context', ''),
+        "question": question,
+        "user_id": g.user_id
+    })
+
+
+@app.route('/jobs/translate_hieroglyphic', methods=['POST'])
+@AUTH.authenticated(optional=True)
+def submit_translate_job():
+    if 'files' not in request.files:
+        return jsonify({"error": "No files part in the request"}), 400
+
+    files = request.files.getlist('files')
+    if not files or len(files) > 10:
+        return jsonify({"error": "You can upload between 1 and 10 images."}), 400
+
+    return submit_job('translate_hieroglyphic', {
+        "images": save_translate_uploads(files),
+        "user_id": g.user_id
+    })
+
+
+@app.route('/jobs/plan_trip', methods=['POST'])
+@AUTH.authenticated(optional=True)
+def submit_plan_trip_job():
+    try:
+        prefs = parse_trip_prefs(request.json or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if prefs is None:
+        return jsonify({"error": "Missing required fields"}), 400
+
+    return submit_job('plan_trip', {"prefs": prefs})
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@AUTH.authenticated(optional=True)
+def get_job(job_id):
+    job = JOBS.get(job_id, job_user_key())
+    if not job:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    return jsonify({"success": True, "job": job})
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+@AUTH.authenticated(optional=True)
+def job_events(job_id):
+    user_key = job_user_key()
+    if not JOBS.get(job_id, user_key):
+        return jsonify({"success": False, "error": "Job not found"}), 404
+
+    def events():
+        # Ends when the job finishes or disappears
+        for job in JOBS.events(job_id, user_key):
+            yield f"event: {job['status']}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache"})
+
+
 @app.route('/posts/<post_id>', methods=['DELETE'])
+@AUTH.authenticated()
 def delete_post(post_id):
-    user_id = request.headers.get('User-ID')
-    
-    if not user_id:
-        return jsonify({"success": False, "error": "User ID is required"}), 400
+    user_id = g.user_id
     
-    conn = sqlite3.connect('kemetpass.db')
+    conn = sqlite3.connect('kemetpass.db', factory=TimedConnection)
     cursor = conn.cursor()
     
     try:
@@ -1299,20 +1652,23 @@ def delete_post(post_id):
             conn.close()
             return jsonify({"success": False, "error": "Post not found"}), 404
         
-        if post_owner_id[0] != user_id:
+        # community_posts.user_id is TEXT
+        if post_owner_id[0] != str(user_id):
             conn.close()
             return jsonify({"success": False, "error": "Unauthorized: You do not own this post"}), 403
             
 
         cursor.execute('SELECT image_path FROM community_post_images WHERE post_id = ?', (post_id,))
-        images_to_delete = cursor.fetchall()
-        for img_path_tuple in images_to_delete:
-            img_path = img_path_tuple[0]
+        images_to_delete = [row[0] for row in cursor.fetchall()]
+        for img_path in images_to_delete:
+            if BLOBS.is_blob(img_path):
+                # Shared by content; released below and collected by `blobstore.py gc`
+                continue
 
             full_img_path = os.path.join(BASE_DIR, img_path)
             if os.path.exists(full_img_path):
                 os.remove(full_img_path)
-                print(f"Deleted image file: {full_img_path}")
+                log.debug("deleted image file", extra={"path": img_path})
         cursor.execute('DELETE FROM community_post_images WHERE post_id = ?', (post_id,))
         
 
@@ -1327,11 +1683,12 @@ def delete_post(post_id):
 
         cursor.execute('DELETE FROM community_posts WHERE id = ?', (post_id,))
         conn.commit()
+        BLOBS.decref(*images_to_delete)
         
         return jsonify({"success": True, "message": "Post deleted successfully"}), 200
     except Exception as e:
         conn.rollback()
-        print(f"Error deleting post: {str(e)}")
+        log.exception("delete_post failed")
         return jsonify({"success": False, "error": f"Failed to delete post: {str(e)}"}), 500
     finally:
         conn.close()
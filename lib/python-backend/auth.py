@@ -0,0 +1,232 @@
+"""Signed bearer tokens: who the caller is, without a database round trip.
+
+/login and /register return a token that the client sends back as
+`Authorization: Bearer <token>`. A token is
+
+    <kid>.<user id>.<expiry unix time>.<base64url HMAC-SHA256 of the first three fields>
+
+so checking one takes a split and an HMAC. Tokens are signed with the first
+key of KEMETPASS_AUTH_KEYS; the other keys still verify. To rotate, put a
+new key first and drop the old one after KEMETPASS_AUTH_TTL.
+
+Views decorated with Auth.authenticated() find the caller in g.user_id.
+Legacy mode, off by default, also accepts the unsigned ids of clients
+from before tokens: the session cookie, the User-ID header and a userId
+form or JSON field. Anyone can send those, so it only vets them against
+the users table (through the user cache); turn it on just long enough for
+old clients to update. kemetpass_auth_total{result="legacy"} shows who
+still relies on it.
+
+Without KEMETPASS_AUTH_KEYS, tokens are signed with a random key that
+dies with the process. That is allowed only with KEMETPASS_ENV=dev (the
+default for `python app.py`; serve.py sets production).
+
+    KEMETPASS_AUTH_KEYS=k2:secret,k1:older   kid:secret pairs, signing key first
+    KEMETPASS_AUTH_TTL=2592000               token lifetime in seconds (30 days)
+    KEMETPASS_AUTH_LEGACY=0                  1 also accepts unsigned legacy ids
+    KEMETPASS_ENV=dev                        anything else refuses to start without keys
+
+    python auth.py new-key                   print a kid:secret pair for KEMETPASS_AUTH_KEYS
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+import logs
+
+log = logs.get_logger("auth")
+
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def parse_keys(text):
+    """'k2:secret,k1:older' -> [('k2', b'secret'), ('k1', b'older')]"""
+    keys = []
+    for pair in text.split(','):
+        kid, sep, secret = pair.strip().partition(':')
+        if not sep or not kid or not secret or '.' in kid:
+            raise ValueError(f"Bad auth key {kid!r}: expected kid:secret with no '.' in the kid")
+        keys.append((kid, secret.encode()))
+    return keys
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenSigner:
+    def __init__(self, keys, ttl=DEFAULT_TTL):
+        """Issue with the first (kid, secret) of keys, verify with any of them"""
+        self.kid = keys[0][0]
+        self.keys = dict(keys)
+        self.ttl = ttl
+
+    def _sign(self, key, message):
+        return _b64(hmac.new(key, message.encode(), hashlib.sha256).digest())
+
+    def issue(self, user_id, now=None):
+        """(token, expiry unix time) for user_id"""
+        expires = int(now if now is not None else time.time()) + self.ttl
+        message = f"{self.kid}.{int(user_id)}.{expires}"
+        return f"{message}.{self._sign(self.keys[self.kid], message)}", expires
+
+    def verify(self, token, now=None):
+        """(user_id, None) for a valid token, else (None, reason)"""
+        # compare_digest raises on non-ASCII str, and headers are client-controlled
+        if not token.isascii():
+            return None, "malformed"
+        parts = token.split('.')
+        if len(parts) != 4:
+            return None, "malformed"
+        kid, user_id, expires, signature = parts
+        key = self.keys.get(kid)
+        if key is None:
+            return None, "unknown_key"
+        if not hmac.compare_digest(signature, self._sign(key, f"{kid}.{user_id}.{expires}")):
+            return None, "bad_signature"
+        # Signed by us, so the fields are well formed
+        if int(expires) <= (now if now is not None else time.time()):
+            return None, "expired"
+        return int(user_id), None
+
+
+class Auth:
+    def __init__(self, signer, legacy=False, user_exists=None):
+        """Identify callers by signed token, and by unsigned ids when legacy is on.
+
+        user_exists(user_id) vets legacy ids; signed ids were vetted at login.
+        """
+        self.signer = signer
+        self.legacy = legacy
+        self.user_exists = user_exists
+        self.results = Counter()
+        self._lock = threading.Lock()
+
+    def issue(self, user_id):
+        return self.signer.issue(user_id)
+
+    def _count(self, result):
+        with self._lock:
+            self.results[result] += 1
+
+    def user_id(self, read_body=True):
+        """The current request's user id or None; resolved once per request.
+
+        read_body=False leaves the body unparsed (for before_request hooks
+        such as admission control) and skips legacy userId fields.
+        """
+        from flask import g
+
+        if '_auth_user_id' in g:
+            return g._auth_user_id
+        user_id, final = self._identify(read_body)
+        if final:
+            g._auth_user_id = user_id
+        return user_id
+
+    def _identify(self, read_body):
+        """(user id or None, final); not final when only the body is left to look at"""
+        from flask import request, session
+
+        header = request.headers.get('Authorization', '')
+        if header[:7].lower() == 'bearer ':
+            user_id, reason = self.signer.verify(header[7:].strip())
+            if user_id is not None:
+                self._count("token")
+                return user_id, True
+        else:
+            reason = None
+        if self.legacy:
+            value = session.get('user_id') or request.headers.get('User-ID')
+            if not value:
+                if not read_body:
+                    return None, False
+                value = self._legacy_body_id()
+            user_id = _int_or_none(value)
+            if user_id is not None:
+                if self.user_exists is None or self.user_exists(user_id):
+                    self._count("legacy")
+                    return user_id, True
+                reason = "unknown_user"
+        # Clients from before signed tokens send placeholders such as "offline_token"
+        if reason is not None:
+            self._count(reason)
+        return None, True
+
+    def _legacy_body_id(self):
+        from flask import request
+
+        if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+            return request.form.get('userId')
+        if request.is_json:
+            body = request.get_json(silent=True)
+            return body.get('userId') if isinstance(body, dict) else None
+        return None
+
+    def authenticated(self, optional=False):
+        """View decorator: sets g.user_id, answering 401 when there is no caller unless optional"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                from flask import g, jsonify
+
+                g.user_id = self.user_id()
+                if g.user_id is None and not optional:
+                    return jsonify({"success": False, "error": "Not authenticated"}), 401
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def collect(self):
+        """Samples for metrics.REGISTRY.add_collector"""
+        with self._lock:
+            results = list(self.results.items())
+        return [("kemetpass_auth_total", "counter", (("result", result),), count) for result, count in results]
+
+
+def from_env(user_exists=None):
+    keys = os.getenv("KEMETPASS_AUTH_KEYS")
+    if keys:
+        keys = parse_keys(keys)
+    elif os.getenv("KEMETPASS_ENV", "dev") != "dev":
+        raise RuntimeError("KEMETPASS_AUTH_KEYS is not set; generate one with `python auth.py new-key` "
+                           "(only KEMETPASS_ENV=dev may run without it)")
+    else:
+        # Shared by the workers through preload_app, but tokens die with the server
+        log.error("KEMETPASS_AUTH_KEYS not set; signing tokens with a random key, every login ends at restart. "
+                  "Development only")
+        keys = [("dev", secrets.token_bytes(32))]
+    signer = TokenSigner(keys, ttl=int(os.getenv("KEMETPASS_AUTH_TTL", str(DEFAULT_TTL))))
+    legacy = os.getenv("KEMETPASS_AUTH_LEGACY", "0") == "1"
+    if legacy:
+        log.warning("legacy auth on: unsigned User-ID headers, userId fields and session ids are accepted")
+    return Auth(signer, legacy=legacy, user_exists=user_exists)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Auth token keys")
+    sub = parser.add_subparsers(dest="command", required=True)
+    new_key = sub.add_parser("new-key", help="print a kid:secret pair for KEMETPASS_AUTH_KEYS")
+    new_key.add_argument("--kid", default=time.strftime("k%Y%m%d"))
+    args = parser.parse_args()
+
+    if args.command == "new-key":
+        print(f"{args.kid}:{secrets.token_urlsafe(32)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Per-request cost of identifying the caller.
+
+    python benchmarks/bench_auth.py
+    python benchmarks/bench_auth.py --requests 20000 --users 10000
+
+Times TokenSigner.verify() alone, then a minimal Flask view behind
+Auth.authenticated(), called through the test client: without a
+decorator (the floor), with a signed token, and with a legacy User-ID
+header vetted against the users table, both through the user cache and
+straight from SQLite (what create_post and friends used to do on every
+request). Reports microseconds per call.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, g, jsonify  # noqa: E402
+
+import auth  # noqa: E402
+from database import DatabaseHandler  # noqa: E402
+from user_cache import UserCache  # noqa: E402
+
+
+def per_call_us(fn, n):
+    for i in range(min(n, 1000)):
+        fn(i)
+    started = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def seed(db_path, users):
+    DatabaseHandler(db_path)
+    conn = sqlite3.connect(db_path)
+    # The hash is never checked here
+    conn.executemany('INSERT INTO users (email, password_hash, username) VALUES (?, ?, ?)',
+                     [(f"bench{i}@example.com", "x", f"bench{i}") for i in range(users)])
+    conn.commit()
+    conn.close()
+
+
+def make_app(identity):
+    app = Flask(__name__)
+    app.secret_key = "bench"
+
+    @app.route('/plain')
+    def plain():
+        return jsonify({"ok": True})
+
+    @app.route('/me')
+    @identity.authenticated()
+    def me():
+        return jsonify({"id": g.user_id})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    seed(db_path, args.users)
+    uncached = DatabaseHandler(db_path)
+    cached = DatabaseHandler(db_path, user_cache=UserCache(max_entries=args.users, ttl=600))
+
+    signer = auth.TokenSigner([("k1", os.urandom(32))])
+    tokens = [signer.issue(user_id)[0] for user_id in range(1, args.users + 1)]
+    print(f"{'TokenSigner.verify':<32} {per_call_us(lambda i: signer.verify(tokens[i % args.users]), args.requests * 10):8.2f} us")
+
+    # Spread requests over the users so the cache sees the same working set as the server
+    order = [random.randrange(args.users) for _ in range(args.requests)]
+    cases = [
+        ("no auth", "/plain", auth.Auth(signer), lambda u: {}),
+        ("signed token", "/me", auth.Auth(signer, legacy=False),
+         lambda u: {"Authorization": "Bearer " + tokens[u]}),
+        ("legacy User-ID, user cache", "/me", auth.Auth(signer, legacy=True, user_exists=lambda u: cached.get_user(u) is not None),
+         lambda u: {"User-ID": str(u + 1)}),
+        ("legacy User-ID, SQLite", "/me", auth.Auth(signer, legacy=True, user_exists=lambda u: uncached.get_user(u) is not None),
+         lambda u: {"User-ID": str(u + 1)}),
+    ]
+    for name, path, identity, headers in cases:
+        client = make_app(identity).test_client()
+
+        def call(i):
+            response = client.get(path, headers=headers(order[i % len(order)]))
+            assert response.status_code == 200, response.status_code
+
+        print(f"{name:<32} {per_call_us(call, args.requests):8.1f} us per request")
+
+
+if __name__ == "__main__":
+    main()
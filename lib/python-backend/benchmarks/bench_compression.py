@@ -0,0 +1,147 @@
+"""Bytes on the wire and server CPU for compressed and conditional JSON responses.
+
+    python benchmarks/bench_compression.py
+    python benchmarks/bench_compression.py --posts 200 --chats 50 --runs 200
+
+First table: size and compression CPU per encoding and level for payloads
+shaped like /posts, /chat_history, /get_saves and /plan_trip. Second table:
+a Flask route wrapped in compression.install and etags.conditional, served
+through the test client, comparing a plain 200, a gzip 200 and a 304
+revalidation (CPU per request includes the data_versions lookup).
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import compression  # noqa: E402
+import fake_llm  # noqa: E402
+from etags import DataVersions, conditional, user_scope  # noqa: E402
+
+
+def feed(count):
+    return {"success": True, "posts": [
+        {
+            "id": f"post_{i:032x}",
+            "userId": str(i % 50),
+            "username": f"traveller{i % 50}",
+            "userImage": f"http://192.168.1.4:8000/uploads/derived/{i % 50:02x}/{i % 50:064x}_thumb.webp",
+            "content": f"Day {i % 7 + 1} in Luxor: sunrise balloon over the West Bank, then Karnak before the crowds. #{i}",
+            "createdAt": f"2025-01-{i % 28 + 1:02d} 08:{i % 60:02d}:00",
+            "likes": i * 7 % 300,
+            "comments": i * 3 % 40,
+            "shares": 0,
+            "images": [f"http://192.168.1.4:8000/uploads/derived/{i % 256:02x}/{i:064x}_medium.webp"],
+            "imageSizes": [{size: f"http://192.168.1.4:8000/uploads/derived/{i % 256:02x}/{i:064x}_{size}.webp"
+                            for size in ("thumb", "medium", "large")}],
+        }
+        for i in range(count)
+    ]}
+
+
+def chat_history(count):
+    return {"success": True, "history": [
+        {"id": i, "message": "Who built the Great Pyramid?", "response": fake_llm.ANSWER * 3,
+         "created_at": f"2025-01-{i % 28 + 1:02d} 10:00:00"}
+        for i in range(count)
+    ]}
+
+
+def saves(count):
+    return {"success": True, "saves": [
+        {"id": i, "type": "place", "created_at": "2025-01-01 10:00:00",
+         "content": {"title": "Karnak Temple", "description": fake_llm.ANSWER, "image": f"uploads/blobs/ab/cd/{i:064x}.jpg"}}
+        for i in range(count)
+    ]}
+
+
+def cpu_per_call(fn, runs):
+    fn()
+    started = time.process_time()
+    for _ in range(runs):
+        fn()
+    return (time.process_time() - started) / runs
+
+
+def encoders():
+    yield "gzip-1", lambda data: compression.compress(data, "gzip", gzip_level=1)
+    yield "gzip-6", lambda data: compression.compress(data, "gzip", gzip_level=6)
+    yield "gzip-9", lambda data: compression.compress(data, "gzip", gzip_level=9)
+    if compression.brotli is not None:
+        for quality in (1, 4, 11):
+            yield f"br-{quality}", lambda data, q=quality: compression.compress(data, "br", brotli_quality=q)
+
+
+def encoding_table(payloads, runs):
+    for name, payload in payloads.items():
+        data = json.dumps(payload).encode()
+        print(f"{name:>14}  identity {len(data):9d} B")
+        for label, encode in encoders():
+            size = len(encode(data))
+            cpu = cpu_per_call(lambda: encode(data), runs)
+            print(f"{'':>14}  {label:>8} {size:9d} B  {size / len(data):6.1%}  {cpu * 1e6:9.1f} us CPU")
+
+
+def conditional_table(payload, runs):
+    from flask import Flask, jsonify
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    versions = DataVersions(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE user_saves (id INTEGER PRIMARY KEY, user_id INTEGER, content TEXT)')
+    conn.commit()
+    conn.close()
+    versions.track({'user_saves': ('user_saves', 'user_id')})
+
+    app = Flask(__name__)
+    compression.install(app)
+
+    @app.route('/get_saves')
+    @conditional(versions, lambda: (user_scope('user_saves', 1),))
+    def get_saves():
+        return jsonify(payload)
+
+    client = app.test_client()
+    headers = {"User-ID": "1"}
+    tag = client.get('/get_saves', headers=headers).headers['ETag']
+
+    cases = {
+        "200 identity": dict(headers, **{"Accept-Encoding": "identity"}),
+        "200 gzip": dict(headers, **{"Accept-Encoding": "gzip"}),
+        "304": dict(headers, **{"Accept-Encoding": "gzip", "If-None-Match": tag}),
+    }
+    for name, case in cases.items():
+        response = client.get('/get_saves', headers=case)
+        cpu = cpu_per_call(lambda: client.get('/get_saves', headers=case), runs)
+        print(f"{name:>14}  status {response.status_code}  body {len(response.get_data()):9d} B  "
+              f"{cpu * 1e6:9.1f} us CPU/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--saves", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=100)
+    args = parser.parse_args()
+
+    if compression.brotli is None:
+        print("brotli not installed; showing gzip only")
+    encoding_table({
+        "/posts": feed(args.posts),
+        "/chat_history": chat_history(args.chats),
+        "/get_saves": saves(args.saves),
+        "/plan_trip": {"success": True, "itinerary": fake_llm.itinerary(7)},
+    }, args.runs)
+    print()
+    conditional_table(saves(args.saves), args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""CPU latency and memory of the Keras models versus their quantised TFLite exports.
+
+    python benchmarks/bench_inference.py --modes dynamic float16 int8
+
+Each configuration runs in a fresh process so peak RSS is attributable to it.
+Run `python quantize.py export --mode <mode>` first.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def measure(name, mode, runs):
+    os.chdir(BACKEND_DIR)
+    import numpy as np
+    import quantize
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if mode == 'keras':
+        import tensorflow  # noqa: F401  (import cost is not model memory)
+        baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        model = quantize.load_keras_model(name)
+    else:
+        model = quantize.TFLiteModel(quantize.artefact_path(name, mode))
+
+    (height, width), _ = quantize.INPUTS[name]
+    batch = np.random.default_rng(0).uniform(-1, 1, (1, height, width, 3)).astype(np.float32)
+    model.predict(batch, verbose=0)  # warm up
+
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        model.predict(batch, verbose=0)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "median_ms": statistics.median(timings),
+        "p95_ms": sorted(timings)[int(len(timings) * 0.95) - 1],
+        "model_mb": (peak_kb - baseline_kb) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=['dynamic'])
+    parser.add_argument("--runs", type=int, default=30)
+    args = parser.parse_args()
+
+    import quantize
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        for name in (quantize.BACKBONE, quantize.HIEROGLYPH):
+            for mode in ['keras'] + args.modes:
+                try:
+                    result = pool.apply(measure, (name, mode, args.runs))
+                except Exception as e:
+                    print(f"{name:>15} {mode:>8}  skipped: {e}")
+                    continue
+                print(f"{name:>15} {mode:>8}  median {result['median_ms']:8.2f} ms  "
+                      f"p95 {result['p95_ms']:8.2f} ms  +{result['model_mb']:7.1f} MB RSS")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""JSON response cost: Flask's default provider versus fastjson.
+
+    python benchmarks/bench_json.py
+    python benchmarks/bench_json.py --saves 2000 --content-kb 4 --posts 500
+
+Times jsonify() of a feed payload with both providers, then /get_saves end
+to end from SQLite: the old path (json.loads of every stored content blob,
+then the default provider) against raw_json() fragments spliced by
+FastJSONProvider. Reports milliseconds per response and response size.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask, jsonify  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import fastjson  # noqa: E402
+from bench_compression import feed  # noqa: E402
+from database import DatabaseHandler  # noqa: E402
+
+
+def time_ms(fn, runs):
+    fn()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def make_app(provider):
+    app = Flask(__name__)
+    app.json = provider(app)
+    return app
+
+
+def saved_content(kb, i):
+    # A saved place or itinerary: nested dicts, lists and text, roughly kb kilobytes
+    entry = {"time": "08:00", "place_name": "Karnak Temple", "activity": "Guided tour of the hypostyle hall",
+             "notes": "Arrive early; tickets at the visitor centre", "coords": [25.7188, 32.6573]}
+    entries = max(1, kb * 1024 // len(json.dumps(entry)))
+    return {"title": f"Luxor trip {i}", "city": "Luxor", "budget": "medium", "plan": [entry] * entries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--saves", type=int, default=500)
+    parser.add_argument("--content-kb", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"orjson: {fastjson.orjson.__version__ if fastjson.orjson else 'not installed'}")
+    default_app = make_app(DefaultJSONProvider)
+    fast_app = make_app(fastjson.FastJSONProvider)
+
+    payload = feed(args.posts)
+    for name, app in (("default", default_app), ("fastjson", fast_app)):
+        with app.app_context():
+            size = len(jsonify(payload).get_data())
+            ms = time_ms(lambda: jsonify(payload).get_data(), args.runs)
+        print(f"feed {args.posts:5d} posts  {name:>9}  {ms:8.2f} ms  {size:9d} B")
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db = DatabaseHandler(db_path)
+    for i in range(args.saves):
+        db.save_item(1, "place", saved_content(args.content_kb, i))
+
+    def decoded_saves():
+        # What get_user_saves did before: decode every stored content blob
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute(
+            'SELECT id, type, content, created_at FROM user_saves WHERE user_id = ? ORDER BY created_at DESC', (1,)
+        ).fetchall()
+        conn.close()
+        return [{"id": row[0], "type": row[1], "content": json.loads(row[2]), "created_at": row[3]} for row in rows]
+
+    with default_app.app_context():
+        size = len(jsonify({"success": True, "saves": decoded_saves()}).get_data())
+        ms = time_ms(lambda: jsonify({"success": True, "saves": decoded_saves()}).get_data(), args.runs)
+    print(f"saves {args.saves:5d} x {args.content_kb} KB  {'decode':>9}  {ms:8.2f} ms  {size:9d} B")
+
+    def raw_saves():
+        # What get_saves does now: splice the stored text in with raw_json
+        return [dict(save, content=fastjson.raw_json(save["content"])) for save in db.get_user_saves(1)["saves"]]
+
+    with fast_app.app_context():
+        size = len(jsonify({"success": True, "saves": raw_saves()}).get_data())
+        ms = time_ms(lambda: jsonify({"success": True, "saves": raw_saves()}).get_data(), args.runs)
+    print(f"saves {args.saves:5d} x {args.content_kb} KB  {'raw':>9}  {ms:8.2f} ms  {size:9d} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Per-request logging cost: the old print() calls versus the queued logger.
+
+    python benchmarks/bench_logging.py --requests 20000 --threads 8
+    python benchmarks/bench_logging.py --sink /tmp/app.log --sample ping=0.01
+    python benchmarks/bench_logging.py --write-latency-us 50
+
+Each simulated request writes what the handlers used to print for one
+profile fetch (three lines), or one structured record through logs.py.
+Latencies are measured in the request threads, which is what callers wait
+for; req/s includes the time the listener needs to drain the queue.
+--write-latency-us stalls every write like a full stdout pipe or a slow
+log collector would.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logs  # noqa: E402
+
+USER = (42, "user@example.com", "pharaoh", "uploads/blobs/ab/cd/abcd.jpg", "Ramses", "II", "", "Egypt", "English")
+
+
+class SlowSink:
+    def __init__(self, out, latency):
+        self.out = out
+        self.latency = latency
+
+    def write(self, data):
+        time.sleep(self.latency)
+        return self.out.write(data)
+
+    def flush(self):
+        self.out.flush()
+
+
+def print_request(out, user_id):
+    print(f"Fetching profile for user_id: {user_id}, type: {type(user_id)}", file=out)
+    print(f"Original profile picture path: {USER[3]}", file=out)
+    print(f"Full profile picture URL: http://192.168.1.4:8000/{USER[3]}", file=out)
+
+
+def run(label, fn, requests, threads):
+    per_thread = requests // threads
+    timings = []
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        for i in range(per_thread):
+            started = time.perf_counter()
+            fn(i)
+            local.append(time.perf_counter() - started)
+        with lock:
+            timings.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    logs.flush()
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    print(f"{label:>18}  mean {statistics.mean(timings) * 1e6:7.2f} us  "
+          f"p99 {timings[int(len(timings) * 0.99)] * 1e6:8.2f} us  {len(timings) / elapsed:10.0f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sink", default=os.devnull, help="file the output goes to")
+    parser.add_argument("--sample", default="ping=0.01")
+    parser.add_argument("--write-latency-us", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with open(args.sink, "a", buffering=1) as f:
+        out = SlowSink(f, args.write_latency_us / 1e6) if args.write_latency_us else f
+        run("print", lambda i: print_request(out, USER[0]), args.requests, args.threads)
+
+        log = logs.configure(level="INFO", fmt="json", stream=out, sample=args.sample).getChild("bench")
+        run("json info", lambda i: log.info("profile fetched", extra={"user_id": USER[0]}), args.requests, args.threads)
+        run("debug (filtered)", lambda i: log.debug("profile fetched", extra={"user_id": USER[0]}), args.requests, args.threads)
+
+        route = args.sample.split("=", 1)[0]
+        run(f"sampled {route}", lambda i: log.info(route, extra={"user_id": USER[0], "sample": route}),
+            args.requests, args.threads)
+
+        started = time.perf_counter()
+        logs.shutdown()
+        print(f"listener drained in {(time.perf_counter() - started) * 1000:.1f} ms, {logs.dropped()} records dropped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Login throughput under concurrent load: hashing inline versus in the process pool.
+
+    python benchmarks/bench_login.py
+    python benchmarks/bench_login.py --threads 16 --seconds 10 --workers 0 2 4
+    python benchmarks/bench_login.py --method pbkdf2:sha256:600000 --seed-method scrypt:16384:8:1
+
+For each KEMETPASS_HASH_WORKERS value, --threads threads call
+DatabaseHandler.login_user for --seconds while one more thread keeps
+reading profiles, standing in for the rest of the traffic. Reports logins
+per second, login latency and the profile reads' latency next to it. With
+--seed-method the users start with other hash parameters, and the table
+also shows how many were rehashed on their first login.
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import passwords  # noqa: E402
+from database import DatabaseHandler  # noqa: E402
+
+PASSWORD = "benchmark"
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    return statistics.quantiles(samples, n=100)[q - 1] if len(samples) > 1 else samples[0]
+
+
+def seed(db_path, users, method):
+    db = DatabaseHandler(db_path)
+    db.register_user("bench0@example.com", PASSWORD, "bench0")
+    # Every user gets the same hash; hashing each one would dominate the setup
+    stored = passwords._hash(PASSWORD, passwords.normalize_method(method))
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE users SET password_hash = ?', (stored,))
+    conn.executemany(
+        'INSERT INTO users (email, password_hash, username) VALUES (?, ?, ?)',
+        [(f"bench{i}@example.com", stored, f"bench{i}") for i in range(1, users)]
+    )
+    conn.commit()
+    conn.close()
+    return db
+
+
+def run(db, users, threads, seconds):
+    deadline = time.perf_counter() + seconds
+    logins, reads = [], []
+    lock = threading.Lock()
+
+    def login_loop(offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            result = db.login_user(f"bench{i % users}@example.com", PASSWORD)
+            elapsed = (time.perf_counter() - started) * 1000
+            assert result["success"], result
+            with lock:
+                logins.append(elapsed)
+            i += threads
+
+    def read_loop():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            db.get_user(1)
+            reads.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.005)
+
+    workers = [threading.Thread(target=login_loop, args=(n,)) for n in range(threads)]
+    workers.append(threading.Thread(target=read_loop))
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return len(logins) / (time.perf_counter() - started), logins, reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--method", default=passwords.METHOD, help="hash parameters logins upgrade to")
+    parser.add_argument("--seed-method", default=None, help="hash parameters the users start with (default --method)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2])
+    args = parser.parse_args()
+
+    passwords.METHOD = passwords.normalize_method(args.method)
+    seed_method = passwords.normalize_method(args.seed_method or args.method)
+    print(f"{os.cpu_count()} CPUs, {args.threads} login threads, hash {passwords.METHOD}, users start with {seed_method}")
+    print(f"{'workers':>7} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'read p50':>9} {'read p95':>9} {'rehashed':>9}")
+    for workers in args.workers:
+        passwords.WORKERS = workers
+        db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        db = seed(db_path, args.users, seed_method)
+        # Start the pool (and the dummy hash) outside the measured window
+        passwords.verify_dummy(PASSWORD)
+
+        rate, logins, reads = run(db, args.users, args.threads, args.seconds)
+
+        conn = sqlite3.connect(db_path)
+        rehashed = conn.execute('SELECT COUNT(*) FROM users WHERE password_hash LIKE ?',
+                                (passwords.METHOD + '$%',)).fetchone()[0] if seed_method != passwords.METHOD else 0
+        conn.close()
+        print(f"{workers:7d} {rate:9.1f} {percentile(logins, 50):8.1f} {percentile(logins, 95):8.1f} "
+              f"{percentile(reads, 50):9.2f} {percentile(reads, 95):9.2f} {rehashed:9d}")
+        passwords.shutdown()
+
+
+if __name__ == "__main__":
+    main()
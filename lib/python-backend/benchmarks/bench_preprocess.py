@@ -0,0 +1,93 @@
+"""Per-image decode + resize time: keras image.load_img versus preprocessing.load_image.
+
+    python benchmarks/bench_preprocess.py [image.jpg ...]
+
+Without arguments a synthetic 12 MP phone-sized JPEG is generated.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import preprocessing  # noqa: E402
+
+
+def synthetic_photo(path, size=(4032, 3024)):
+    rng = np.random.default_rng(0)
+    # Smooth gradients plus noise compress like a real photo rather than pure noise
+    x = np.linspace(0, 255, size[0], dtype=np.float32)
+    y = np.linspace(0, 255, size[1], dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    noise = rng.normal(0, 12, base.shape).astype(np.float32)
+    Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(path, quality=92)
+
+
+def keras_load(img_path, target_size, mode):
+    from tensorflow.keras.applications.vgg16 import preprocess_input
+    from tensorflow.keras.preprocessing import image
+
+    img_array = image.img_to_array(image.load_img(img_path, target_size=target_size))
+    img_array = np.expand_dims(img_array, axis=0)
+    return preprocess_input(img_array) if mode == preprocessing.VGG16 else img_array / 255.0
+
+
+def full_decode(img_path, target_size, mode):
+    with Image.open(img_path) as img:
+        img = img.convert('RGB').resize((target_size[1], target_size[0]), Image.NEAREST)
+        img_array = np.asarray(img, dtype=np.float32)
+    return np.expand_dims(preprocessing.normalize(img_array, mode), axis=0)
+
+
+def time_per_image(fn, paths, target_size, mode, repeat):
+    timings = []
+    for _ in range(repeat):
+        for path in paths:
+            started = time.perf_counter()
+            fn(path, target_size, mode)
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    paths = args.images
+    if not paths:
+        tmp = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False)
+        tmp.close()
+        synthetic_photo(tmp.name)
+        paths = [tmp.name]
+
+    pool = preprocessing.PreprocessPool()
+    candidates = [
+        ("full decode", full_decode),
+        ("draft decode", preprocessing.load_image),
+        ("draft decode (pool)", pool.load),
+    ]
+    try:
+        import tensorflow  # noqa: F401
+        candidates.insert(0, ("keras load_img", keras_load))
+    except ImportError:
+        print("tensorflow not installed, skipping the keras baseline")
+
+    for target_size, mode in [((224, 224), preprocessing.VGG16), ((128, 128), preprocessing.UNIT_SCALE)]:
+        for name, fn in candidates:
+            fn(paths[0], target_size, mode)  # warm up
+            median_ms, max_ms = time_per_image(fn, paths, target_size, mode, args.repeat)
+            print(f"{name:>20} {target_size[0]}x{target_size[1]}  median {median_ms:7.2f} ms  max {max_ms:7.2f} ms")
+
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""FTS5 search over a large synthetic community/chat database.
+
+    python benchmarks/bench_search.py --rows 1000000
+    python benchmarks/bench_search.py --rows 100000 --db /tmp/search.db
+
+Fills community_posts and chat_history with Zipf-distributed text through
+the sync triggers, then times ranked search (first and a deep page) against
+the LIKE '%term%' scan clients would otherwise need, plus a full rebuild.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3  # noqa: E402
+
+from search import SearchIndex  # noqa: E402
+
+WORDS = ("pyramid temple pharaoh karnak luxor giza sphinx nile tomb valley kings queens hatshepsut "
+         "ramses tutankhamun museum cairo aswan abu simbel philae obelisk hieroglyph papyrus felucca "
+         "sunrise balloon desert oasis market bazaar mosque citadel dinner guide ticket sunset").split()
+
+
+def make_vocabulary(size, rng):
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    filler = {"".join(rng.choice(letters, rng.integers(3, 10))) for _ in range(size)}
+    return WORDS + sorted(filler - set(WORDS))
+
+
+def sentences(vocabulary, count, length, rng):
+    # Zipf ranks so a few words are very common and most are rare, like real text
+    ranks = np.minimum(rng.zipf(1.2, (count, length)) - 1, len(vocabulary) - 1)
+    vocab = np.array(vocabulary)
+    for row in ranks:
+        yield " ".join(vocab[row])
+
+
+def create_tables(conn):
+    conn.executescript('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, profile_picture TEXT, firstName TEXT, secondName TEXT
+    );
+    CREATE TABLE IF NOT EXISTS community_posts (
+        id TEXT PRIMARY KEY, user_id TEXT NOT NULL, content TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS chat_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, message TEXT NOT NULL,
+        response TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ''')
+
+
+def populate(db_path, rows, users, rng):
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO users (username) VALUES (?)', [(f"user{i}",) for i in range(users)])
+    vocabulary = make_vocabulary(20000, rng)
+    batch = 50000
+    started = time.perf_counter()
+    for start in range(0, rows, batch):
+        n = min(batch, rows - start)
+        user_ids = rng.integers(1, users + 1, n)
+        posts = sentences(vocabulary, n, 30, rng)
+        conn.executemany(
+            'INSERT INTO community_posts (id, user_id, content) VALUES (?, ?, ?)',
+            ((uuid.uuid4().hex, int(u), text) for u, text in zip(user_ids, posts))
+        )
+        messages = sentences(vocabulary, n, 12, rng)
+        responses = sentences(vocabulary, n, 40, rng)
+        conn.executemany(
+            'INSERT INTO chat_history (user_id, message, response) VALUES (?, ?, ?)',
+            ((int(u), m, r) for u, m, r in zip(user_ids, messages, responses))
+        )
+        conn.commit()
+    conn.close()
+    return time.perf_counter() - started
+
+
+def time_ms(fn, runs):
+    fn()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95)]
+
+
+def like_scan(db_path, term, limit):
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        'SELECT id, content FROM community_posts WHERE content LIKE ? ORDER BY created_at DESC LIMIT ?',
+        (f"%{term}%", limit)
+    ).fetchall()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000, help="posts and chat rows each")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--db", help="reuse or create this database instead of a temporary one")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "search.db")
+    conn = sqlite3.connect(db_path)
+    create_tables(conn)
+    empty = conn.execute('SELECT COUNT(*) FROM community_posts').fetchone()[0] == 0
+    conn.close()
+
+    index = SearchIndex(db_path)
+    if empty:
+        elapsed = populate(db_path, args.rows, args.users, np.random.default_rng(0))
+        print(f"inserted {args.rows} posts + {args.rows} chats through the triggers in {elapsed:.1f} s")
+
+    queries = ["pyramid", "karnak temple", "hatshepsut", "abu simbel sunrise", "felucca"]
+    for q in queries:
+        first = time_ms(lambda: index.search_posts(q, limit=20), args.runs)
+        deep = time_ms(lambda: index.search_posts(q, limit=20, offset=500), args.runs)
+        chat = time_ms(lambda: index.search_chat(1, q, limit=20), args.runs)
+        print(f"{q:>20}  posts p50 {first[0]:7.2f} ms p95 {first[1]:7.2f} ms  "
+              f"offset 500 p50 {deep[0]:7.2f} ms  chat p50 {chat[0]:7.2f} ms p95 {chat[1]:7.2f} ms")
+
+    for term in ("hatshepsut", "felucca"):
+        scan = time_ms(lambda: like_scan(db_path, term, 20), max(3, args.runs // 5))
+        print(f"{term:>20}  LIKE scan p50 {scan[0]:9.2f} ms")
+
+    started = time.perf_counter()
+    index.rebuild()
+    print(f"rebuild {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Batched multi-view inference versus one predict() call per view.
+
+    python benchmarks/bench_tta.py [image.jpg] --views 1 2 5 8
+
+Uses randomly initialised VGG16 weights unless --imagenet is given;
+latency does not depend on the weights.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import preprocessing  # noqa: E402
+
+
+def median_ms(fn, runs):
+    fn()  # warm up
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", nargs="?")
+    parser.add_argument("--views", type=int, nargs="+", default=[1, 2, 5, 8])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--imagenet", action="store_true")
+    args = parser.parse_args()
+
+    from tensorflow.keras.applications.vgg16 import VGG16
+    model = VGG16(weights='imagenet' if args.imagenet else None, include_top=False, input_shape=(224, 224, 3))
+
+    path = args.image
+    if not path:
+        tmp = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False)
+        tmp.close()
+        rng = np.random.default_rng(0)
+        Image.fromarray(rng.integers(0, 255, (1080, 1920, 3), dtype=np.uint8)).save(tmp.name)
+        path = tmp.name
+
+    for views in args.views:
+        batch = preprocessing.load_image(path, (224, 224), preprocessing.VGG16, views)
+        batched = median_ms(lambda: model.predict(batch, verbose=0), args.runs)
+        separate = median_ms(lambda: [model.predict(batch[i:i + 1], verbose=0) for i in range(views)], args.runs)
+        print(f"{views} views  batched {batched:8.1f} ms  separate {separate:8.1f} ms  "
+              f"speed-up {separate / batched:4.2f}x")
+
+
+if __name__ == "__main__":
+    main()
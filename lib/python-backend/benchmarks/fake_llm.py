@@ -0,0 +1,163 @@
+"""Local stand-in for the Groq and Gemini APIs.
+
+    python benchmarks/fake_llm.py --port 8090 --latency-ms 300 --chunk-delay-ms 20
+
+Point the backend at it with
+    GROQ_BASE_URL=http://127.0.0.1:8090
+    KEMETPASS_GEMINI_ENDPOINT=http://127.0.0.1:8090
+
+Groq chat completions (streamed or not) answer with a fixed sentence;
+Gemini generateContent / streamGenerateContent answer with a schema-valid
+itinerary. --latency-ms is the time to the first byte and --chunk-delay-ms
+the gap between streamed chunks, so load tests see realistic upstream waits
+without network access or API keys.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ("The Great Pyramid of Giza was built for the pharaoh Khufu around 2560 BC "
+          "and remained the tallest man-made structure for almost four thousand years.")
+
+_GEMINI_RE = re.compile(r'^/v1(?:beta)?/models/[^:]+:(generateContent|streamGenerateContent)')
+
+
+def itinerary(days=3):
+    return {
+        "city": "Luxor",
+        "days": days,
+        "plan": [
+            {
+                "day": day,
+                "date": f"2025-01-{day:02d}",
+                "entries": [
+                    {"time": "08:00", "place_name": "Karnak Temple", "activity": "Guided tour", "notes": "Arrive early"},
+                    {"time": "13:00", "place_name": "Luxor Museum", "activity": "Museum visit", "notes": "Closed 14-17"},
+                    {"time": "18:00", "place_name": "Luxor Temple", "activity": "Evening walk", "notes": "Lit at night"},
+                ],
+            }
+            for day in range(1, days + 1)
+        ],
+    }
+
+
+def split_text(text, size=48):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    chunk_delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        request = self._read_json()
+        time.sleep(self.latency)
+        path = self.path.split("?", 1)[0]
+
+        if path.endswith("/chat/completions"):
+            return self._groq(request)
+        match = _GEMINI_RE.match(path)
+        if match:
+            return self._gemini(stream=match.group(1) == "streamGenerateContent")
+        self._send_json({"error": {"message": f"unknown path {path}"}}, status=404)
+
+    def _groq(self, request):
+        model = request.get("model", "fake")
+        if not request.get("stream"):
+            return self._send_json({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": ANSWER}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        self._start_chunked("text/event-stream")
+        pieces = split_text(ANSWER, 16)
+        for i, piece in enumerate(pieces):
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece},
+                             "finish_reason": "stop" if i == len(pieces) - 1 else None}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            time.sleep(self.chunk_delay)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _gemini(self, stream):
+        text = json.dumps(itinerary())
+        if not stream:
+            return self._send_json({"candidates": [_candidate(text)]})
+
+        # The REST transport reads a streamed JSON array of GenerateContentResponse objects
+        self._start_chunked("application/json")
+        pieces = split_text(text)
+        for i, piece in enumerate(pieces):
+            prefix = "[" if i == 0 else ","
+            self._write_chunk((prefix + json.dumps({"candidates": [_candidate(piece)]})).encode())
+            time.sleep(self.chunk_delay)
+        self._write_chunk(b"]")
+        self._write_chunk(b"")
+
+
+def _candidate(text):
+    return {"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}
+
+
+def start(port=0, latency=0.0, chunk_delay=0.0):
+    """Serve the fake APIs from a background thread; returns (server, base_url)"""
+    handler = type("Handler", (FakeLLMHandler,), {"latency": latency, "chunk_delay": chunk_delay})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--chunk-delay-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    server, url = start(args.port, args.latency_ms / 1000, args.chunk_delay_ms / 1000)
+    print(f"fake Groq/Gemini listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Working directory with everything app.py loads at import, for benchmarks.
+
+    python benchmarks/fixtures.py /tmp/kemetpass-bench [--real]
+
+app.py resolves its model files, galleries, database and FAISS index
+relative to the current directory. prepare() fills a scratch directory with
+them: the real files from the backend directory when --real is given and
+they exist, otherwise dummy ones of the same shapes (random galleries, a
+small hieroglyph classifier, a word-embedding sentence encoder with the
+FAISS index's dimension). Latency depends on the shapes, not the weights.
+"""
+import argparse
+import os
+import pickle
+import sys
+
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import descriptors  # noqa: E402
+
+WHERE_IM_FEATURES = "WHERE_IM_image_features.pkl"
+WHO_AM_I_FEATURES = "who_im_image_features.pkl"
+LABEL_ENCODER = "Egyptian_hieroglyphic_label_encoder.joblib"
+TRANSLATE_MODEL = "Egyptian_hieroglyphic_Model_classification.h5"
+SHARED = ("historical_places.csv", "historical_places.index", "historical_places.json")
+
+# VGG16 without its top at 224x224 flattens to 7 * 7 * 512
+VGG16_FLAT_DIM = 7 * 7 * 512
+
+# Known key, so the load scenarios can sign their own tokens (see auth_headers)
+BENCH_AUTH_KEYS = "bench:benchmark-signing-key"
+
+QUERY_IMAGE = "images/query.jpg"
+GLYPH_IMAGE = "images/glyph.jpg"
+
+
+def _link(name, workdir):
+    target = os.path.join(workdir, name)
+    if not os.path.lexists(target):
+        os.symlink(os.path.join(BACKEND_DIR, name), target)
+
+
+def _use_real(name, workdir, real):
+    if real and os.path.exists(os.path.join(BACKEND_DIR, name)):
+        _link(name, workdir)
+        return True
+    return False
+
+
+def dummy_gallery(path, size, prefix, rng):
+    labels = [f"{prefix} {i % max(1, size // 5)}" for i in range(size)]
+    features = rng.random((size, VGG16_FLAT_DIM), dtype=np.float32)
+    threshold, calibration = descriptors.calibrate_threshold(features, labels)
+    with open(path, "wb") as f:
+        pickle.dump({"features": features, "labels": labels, "image_paths": [f"{prefix}/{i}.jpg" for i in range(size)],
+                     "threshold": threshold, "calibration": calibration}, f)
+
+
+def dummy_translator(workdir, classes):
+    import joblib
+    import tensorflow as tf
+    from sklearn.preprocessing import LabelEncoder
+
+    encoder = LabelEncoder().fit([f"glyph_{i}" for i in range(classes)])
+    joblib.dump(encoder, os.path.join(workdir, LABEL_ENCODER))
+
+    model = tf.keras.Sequential([
+        tf.keras.Input((128, 128, 3)),
+        tf.keras.layers.Conv2D(32, 3, activation="relu"),
+        tf.keras.layers.MaxPooling2D(),
+        tf.keras.layers.Conv2D(64, 3, activation="relu"),
+        tf.keras.layers.MaxPooling2D(),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(128, activation="relu"),
+        tf.keras.layers.Dense(classes, activation="softmax"),
+    ])
+    model.save(os.path.join(workdir, TRANSLATE_MODEL))
+
+
+def dummy_sentence_encoder(path, rng):
+    import faiss
+    import pandas as pd
+    from sentence_transformers import SentenceTransformer, models
+    from sentence_transformers.models.tokenizer import WhitespaceTokenizer
+
+    dim = faiss.read_index(os.path.join(BACKEND_DIR, "historical_places.index")).d
+    df = pd.read_csv(os.path.join(BACKEND_DIR, "historical_places.csv"))
+    vocab = sorted({word.lower() for value in df.astype(str).values.ravel() for word in value.split()})[:50000]
+
+    embeddings = models.WordEmbeddings(WhitespaceTokenizer(vocab), rng.standard_normal((len(vocab), dim)).astype(np.float32))
+    pooling = models.Pooling(dim, pooling_mode="mean")
+    SentenceTransformer(modules=[embeddings, pooling]).save(path)
+
+
+def write_images(workdir, rng):
+    os.makedirs(os.path.join(workdir, "images"), exist_ok=True)
+    Image.fromarray(rng.integers(0, 255, (1080, 1920, 3), dtype=np.uint8)).save(os.path.join(workdir, QUERY_IMAGE), quality=90)
+    Image.fromarray(rng.integers(0, 255, (300, 300, 3), dtype=np.uint8)).save(os.path.join(workdir, GLYPH_IMAGE), quality=90)
+
+
+def prepare(workdir, real=False, gallery_size=500, classes=20, seed=0, models=True):
+    """Populate workdir and return the environment the backend should run with there
+
+    models=False leaves out the hieroglyph classifier and the sentence encoder,
+    which need TensorFlow and sentence-transformers to build (tests of the
+    plain routes never load them).
+    """
+    os.makedirs(workdir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    # One client drives every load scenario, so admission control would only measure 429s
+    env = {"KEMETPASS_BASE_DIR": os.path.abspath(workdir), "KEMETPASS_RATE_LIMIT": "0",
+           "KEMETPASS_AUTH_KEYS": BENCH_AUTH_KEYS}
+
+    for name in SHARED:
+        if os.path.exists(os.path.join(BACKEND_DIR, name)):
+            _link(name, workdir)
+
+    for name, prefix in ((WHERE_IM_FEATURES, "place"), (WHO_AM_I_FEATURES, "person")):
+        path = os.path.join(workdir, name)
+        if not _use_real(name, workdir, real) and not os.path.exists(path):
+            dummy_gallery(path, gallery_size, prefix, rng)
+
+    have_translator = _use_real(LABEL_ENCODER, workdir, real) and _use_real(TRANSLATE_MODEL, workdir, real)
+    if models and not have_translator and not os.path.exists(os.path.join(workdir, TRANSLATE_MODEL)):
+        dummy_translator(workdir, classes)
+
+    if not real:
+        env["KEMETPASS_VGG16_WEIGHTS"] = "none"
+    if models and not real:
+        encoder_dir = os.path.join(os.path.abspath(workdir), "sentence_encoder")
+        if not os.path.exists(encoder_dir):
+            dummy_sentence_encoder(encoder_dir, rng)
+        env["KEMETPASS_SENTENCE_ENCODER"] = encoder_dir
+
+    if not os.path.exists(os.path.join(workdir, QUERY_IMAGE)):
+        write_images(workdir, rng)
+    return env
+
+
+def seed_users(db_path, count, password="benchmark"):
+    """Create `count` users and return their ids"""
+    from database import DatabaseHandler
+
+    db = DatabaseHandler(db_path)
+    ids = []
+    for i in range(count):
+        result = db.register_user(f"bench{i}@example.com", password, f"bench{i}", firstName="Bench", secondName=str(i))
+        if result["success"]:
+            ids.append(result["user_id"])
+        else:
+            ids.append(db.login_user(f"bench{i}@example.com", password)["user"]["id"])
+    return ids
+
+
+def auth_headers(user_id):
+    """Authorization header for user_id, signed with the key prepare() gives the server"""
+    import auth
+
+    token, _ = auth.TokenSigner(auth.parse_keys(BENCH_AUTH_KEYS)).issue(user_id)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workdir")
+    parser.add_argument("--real", action="store_true", help="link the real models and galleries when present")
+    parser.add_argument("--gallery-size", type=int, default=500)
+    args = parser.parse_args()
+
+    env = prepare(args.workdir, args.real, args.gallery_size)
+    for key, value in env.items():
+        print(f"export {key}={value}")
+
+
+if __name__ == "__main__":
+    main()
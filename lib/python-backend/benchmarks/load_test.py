@@ -0,0 +1,144 @@
+"""Closed-loop HTTP load generator for the KemetPass backend.
+
+    python benchmarks/load_test.py --url http://127.0.0.1:8000/ping --concurrency 32
+    python benchmarks/load_test.py --scale --path /ping
+    python benchmarks/load_test.py --url http://127.0.0.1:8000/uploads/derived/ab/<hash>_thumb.webp \
+        --concurrency 64 --header 'If-None-Match: "<etag>"'
+
+--scale starts serve.py with 1, 2, 4 ... cpu_count workers in turn and
+prints throughput for each, showing how the server scales with cores.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def run_load(url, concurrency=16, duration=10.0, method="GET", body=None, headers=None):
+    """Hammer url from `concurrency` threads for `duration` seconds"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        local_latencies = []
+        local_errors = 0
+        while time.perf_counter() < deadline:
+            req = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=60) as resp:
+                    resp.read()
+                local_latencies.append(time.perf_counter() - started)
+            except urllib.error.HTTPError as e:
+                # 304 Not Modified is a successful conditional GET
+                if e.code == 304:
+                    local_latencies.append(time.perf_counter() - started)
+                else:
+                    local_errors += 1
+            except (urllib.error.URLError, OSError):
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def wait_for_server(url, timeout=300.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5):
+                return True
+        except (urllib.error.URLError, OSError):
+            time.sleep(1)
+    return False
+
+
+def worker_counts():
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def format_result(label, result):
+    return (f"{label:>10}  {result['throughput']:9.1f} req/s  p50 {result['p50_ms']:7.1f} ms  "
+            f"p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  errors {result['errors']}")
+
+
+def scale(args, headers=None):
+    port = args.port
+    url = f"http://127.0.0.1:{port}{args.path}"
+    for workers in worker_counts():
+        proc = subprocess.Popen(
+            [sys.executable, "serve.py", "--bind", f"127.0.0.1:{port}", "--workers", str(workers)],
+            # A throwaway server: it may sign tokens with a random key (serve.py defaults to production), and
+            # one client driving it would only measure 429s from admission control
+            cwd=BACKEND_DIR, env={**os.environ, "KEMETPASS_ENV": "dev", "KEMETPASS_RATE_LIMIT": "0"},
+        )
+        try:
+            if not wait_for_server(url):
+                print(f"server with {workers} workers did not come up")
+                continue
+            result = run_load(url, args.concurrency, args.duration, headers=headers)
+            print(format_result(f"{workers} workers", result))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000/ping")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--scale", action="store_true", help="sweep serve.py worker counts")
+    parser.add_argument("--path", default="/ping", help="route to load in --scale mode")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--header", action="append", default=[], help="extra 'Name: value' request header")
+    args = parser.parse_args()
+    headers = dict(h.split(":", 1) for h in args.header)
+    headers = {name.strip(): value.strip() for name, value in headers.items()}
+
+    if args.scale:
+        scale(args, headers)
+    else:
+        print(format_result("load", run_load(args.url, args.concurrency, args.duration, headers=headers)))
+
+
+if __name__ == "__main__":
+    main()
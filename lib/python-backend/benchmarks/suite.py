@@ -0,0 +1,246 @@
+"""Reproducible benchmark suite for the KemetPass backend.
+
+    python benchmarks/suite.py --save results.json
+    python benchmarks/suite.py --baseline benchmarks/baseline.json
+    python benchmarks/suite.py --save benchmarks/baseline.json --only load
+
+Micro-benchmarks time find_most_similar_*, predict_translate_class,
+search_places and every DatabaseHandler method in-process; load scenarios
+drive /posts, /chat, /plan_trip and the vision routes through serve.py.
+Groq and Gemini are replaced by benchmarks/fake_llm.py and missing models by
+the dummies from benchmarks/fixtures.py, so runs need no network or keys.
+
+Every benchmark reports p50/p95/p99 and throughput. With --baseline the run
+is compared against a stored result file and the exit status is 1 when any
+latency grows, or throughput drops, by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import fake_llm  # noqa: E402
+import fixtures  # noqa: E402
+from load_test import percentile, run_load, wait_for_server  # noqa: E402
+
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def summarize(samples, elapsed):
+    return {
+        "requests": len(samples),
+        "throughput": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+def measure(fn, runs, warmup=2):
+    """Call fn(i) `runs` times on this thread after `warmup` untimed calls"""
+    for i in range(warmup):
+        fn(-1 - i)
+    samples = []
+    started = time.perf_counter()
+    for i in range(runs):
+        call_started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - call_started)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def database_benchmarks(db_path, runs):
+    from database import DatabaseHandler
+
+    db = DatabaseHandler(db_path)
+    run_id = uuid.uuid4().hex[:8]
+    user_id = fixtures.seed_users(db_path, 1)[0]
+    content = {"title": "Karnak", "image": "uploads/blobs/ab/cd/abcd.jpg"}
+
+    for _ in range(200):
+        db.save_item(user_id, "place", content)
+        db.save_chat(user_id, "Who built Karnak?", fake_llm.ANSWER)
+    doomed = [db.save_item(user_id, "place", content)["save_id"] for _ in range(runs + 2)]
+
+    return {
+        "db.register_user": measure(lambda i: db.register_user(f"{run_id}-{i}@example.com", "benchmark", f"u{run_id}{i}"), runs),
+        "db.login_user": measure(lambda i: db.login_user("bench0@example.com", "benchmark"), runs),
+        "db.update_user_profile": measure(lambda i: db.update_user_profile(user_id, firstName=f"Bench{i}"), runs),
+        "db.save_item": measure(lambda i: db.save_item(user_id, "place", content), runs),
+        "db.get_user_saves": measure(lambda i: db.get_user_saves(user_id), runs),
+        "db.delete_saved_item": measure(lambda i: db.delete_saved_item(doomed[i], user_id), runs),
+        "db.save_chat": measure(lambda i: db.save_chat(user_id, "Who built Karnak?", fake_llm.ANSWER), runs),
+        "db.get_chat_history": measure(lambda i: db.get_chat_history(user_id), runs),
+    }
+
+
+def micro_benchmarks(workdir, runs):
+    # app.py loads everything relative to the working directory at import time
+    os.chdir(workdir)
+    import app
+
+    results = {
+        "find_most_similar_place_where_im": measure(lambda i: app.find_most_similar_place_where_im(fixtures.QUERY_IMAGE), runs),
+        "find_most_similar_person_who_am_i": measure(lambda i: app.find_most_similar_person_who_am_i(fixtures.QUERY_IMAGE), runs),
+        "predict_translate_class": measure(lambda i: app.predict_translate_class(fixtures.GLYPH_IMAGE), runs),
+        "search_places": measure(lambda i: app.search_places("ancient temples near Luxor", 6), runs),
+    }
+    results.update(database_benchmarks(os.path.join(workdir, "micro.db"), runs))
+    return results
+
+
+def multipart(files):
+    """Encode [(field, path)] as multipart/form-data; returns (body, content type)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, path in files:
+        with open(path, "rb") as f:
+            data = f.read()
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{os.path.basename(path)}"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b"\r\n"
+        )
+    return b"".join(parts) + f"--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+def load_scenarios(workdir, user_ids):
+    query = os.path.join(workdir, fixtures.QUERY_IMAGE)
+    glyph = os.path.join(workdir, fixtures.GLYPH_IMAGE)
+    image_body, image_type = multipart([("file", query)])
+    glyph_body, glyph_type = multipart([("files", glyph), ("files", glyph)])
+    user = fixtures.auth_headers(user_ids[0])
+    json_headers = {"Content-Type": "application/json"}
+    trip = {"query": "temples in Luxor", "start": "2025-01-01", "days": 3, "budget": "medium"}
+
+    # name: (path, method, body, headers, concurrency)
+    return {
+        "GET /posts": ("/posts", "GET", None, user, 16),
+        "POST /chat": ("/chat", "POST", json.dumps({"question": "Who built Karnak?"}).encode(), json_headers, 8),
+        "POST /plan_trip": ("/plan_trip", "POST", json.dumps(trip).encode(), json_headers, 8),
+        "POST /predict_where_im": ("/predict_where_im", "POST", image_body, {"Content-Type": image_type}, 4),
+        "POST /who_am_i": ("/who_am_i", "POST", image_body, {"Content-Type": image_type}, 4),
+        "POST /translate_hieroglyphic": ("/translate_hieroglyphic", "POST", glyph_body, {"Content-Type": glyph_type}, 4),
+    }
+
+
+def seed_posts(base_url, user_ids, count):
+    import urllib.parse
+    import urllib.request
+
+    for i in range(count):
+        body = urllib.parse.urlencode({"content": f"Benchmark post {i} from the Valley of the Kings"}).encode()
+        req = urllib.request.Request(f"{base_url}/posts", data=body, method="POST",
+                                     headers=fixtures.auth_headers(user_ids[i % len(user_ids)]))
+        urllib.request.urlopen(req, timeout=30).read()
+
+
+def load_benchmarks(workdir, env, args):
+    user_ids = fixtures.seed_users(os.path.join(workdir, "kemetpass.db"), 20)
+    base_url = f"http://127.0.0.1:{args.port}"
+    server_env = dict(os.environ, **env)
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "serve.py"), "--bind", f"127.0.0.1:{args.port}",
+         "--workers", str(args.workers)],
+        cwd=workdir, env=server_env,
+    )
+    try:
+        if not wait_for_server(f"{base_url}/ping"):
+            raise RuntimeError("serve.py did not come up")
+        seed_posts(base_url, user_ids, args.posts)
+
+        results = {}
+        for name, (path, method, body, headers, concurrency) in load_scenarios(workdir, user_ids).items():
+            results[name] = run_load(base_url + path, concurrency, args.duration, method, body, headers)
+        return results
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def compare(results, baseline, tolerance):
+    """Human-readable regressions of results against baseline"""
+    regressions = []
+    for section in ("micro", "load"):
+        for name, current in results.get(section, {}).items():
+            before = baseline.get(section, {}).get(name)
+            if not before:
+                continue
+            for metric in LATENCY_METRICS:
+                if before[metric] and current[metric] > before[metric] * (1 + tolerance):
+                    regressions.append(f"{name}: {metric} {before[metric]:.2f} -> {current[metric]:.2f}")
+            if before["throughput"] and current["throughput"] < before["throughput"] * (1 - tolerance):
+                regressions.append(f"{name}: throughput {before['throughput']:.1f} -> {current['throughput']:.1f}")
+    return regressions
+
+
+def print_table(results):
+    for section in ("micro", "load"):
+        for name, r in results.get(section, {}).items():
+            errors = f"  errors {r['errors']}" if r.get("errors") else ""
+            print(f"{name:>36}  p50 {r['p50_ms']:8.2f} ms  p95 {r['p95_ms']:8.2f} ms  p99 {r['p99_ms']:8.2f} ms  "
+                  f"{r['throughput']:9.1f} /s{errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workdir", help="fixture directory (default: a fresh temporary one)")
+    parser.add_argument("--real", action="store_true", help="use the real models and galleries when present")
+    parser.add_argument("--only", choices=("micro", "load"))
+    parser.add_argument("--runs", type=int, default=50, help="calls per micro-benchmark")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per load scenario")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--posts", type=int, default=200, help="community posts to seed")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-chunk-delay-ms", type=float, default=20)
+    parser.add_argument("--save", help="write results JSON here")
+    parser.add_argument("--baseline", help="compare against this results JSON")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown")
+    args = parser.parse_args()
+    # micro_benchmarks() changes directory
+    save = os.path.abspath(args.save) if args.save else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="kemetpass-bench-"))
+    env = fixtures.prepare(workdir, real=args.real)
+    server, llm_url = fake_llm.start(latency=args.llm_latency_ms / 1000, chunk_delay=args.llm_chunk_delay_ms / 1000)
+    env.update({"GROQ_BASE_URL": llm_url, "KEMETPASS_GEMINI_ENDPOINT": llm_url})
+    os.environ.update(env)
+
+    results = {"meta": {"python": platform.python_version(), "machine": platform.machine(),
+                        "cpus": os.cpu_count(), "real_models": args.real, "started": time.time()}}
+    try:
+        if args.only in (None, "load"):
+            results["load"] = load_benchmarks(workdir, env, args)
+        if args.only in (None, "micro"):
+            results["micro"] = micro_benchmarks(workdir, args.runs)
+    finally:
+        server.shutdown()
+
+    print_table(results)
+    if save:
+        with open(save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""Content-addressed, deduplicating storage for uploaded files.
+
+    python blobstore.py gc [--grace-hours 24]
+    python blobstore.py stats
+
+Uploads are stored once per SHA-256 under uploads/blobs/<aa>/<bb>/<digest>;
+the key depends on the bytes only, and the content type sniffed from them
+is kept in the blobs table. The table also keeps a reference count from
+users.profile_picture, community_post_images and user_saves; gc recounts
+those references and removes blobs nobody has pointed at for the grace
+period, counted from when their count last dropped to zero, together with
+their resized derivatives.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import unquote, urlsplit
+
+import metrics
+from derivatives import SIZES, DerivativeStore
+from uploads import MAX_HEADER_BYTES, image_size
+
+BLOBS_DIR = 'uploads/blobs'
+
+UNKNOWN_TYPE = 'application/octet-stream'
+
+
+def sniff_content_type(head):
+    """MIME type of an upload from its first bytes; uploads.py has already rejected non-images on upload routes"""
+    try:
+        found = image_size(bytes(head))
+    except ValueError:
+        return UNKNOWN_TYPE
+    return f"image/{found[0]}" if found else UNKNOWN_TYPE
+
+
+def normalize_key(path, hosts=None):
+    """Blob key for a stored path or a URL to one; URLs on hosts outside `hosts` come back unchanged"""
+    if not path:
+        return path
+    parts = urlsplit(path)
+    if parts.scheme in ('http', 'https'):
+        if hosts is not None and parts.netloc.lower() not in hosts:
+            return path
+        path = unquote(parts.path)
+    return path.lstrip('/')
+
+
+class BlobStore:
+    def __init__(self, db_path='kemetpass.db', base_dir='.', hosts=None):
+        """Store uploads by content hash with reference counting
+
+        hosts are the host:port names this server's image URLs use; URLs on
+        them map back to blob keys. None accepts any host.
+        """
+        self.db_path = db_path
+        self.base_dir = base_dir
+        self.hosts = {host.lower() for host in hosts} if hosts is not None else None
+        self.root = os.path.join(base_dir, BLOBS_DIR)
+        os.makedirs(self.root, exist_ok=True)
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Create the blobs table if it doesn't exist"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            key TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_put_at REAL NOT NULL
+        )
+        ''')
+        # Added after the table first shipped: when refcount last reached zero, NULL while referenced
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(blobs)')}
+        if 'zero_since' not in columns:
+            cursor.execute('ALTER TABLE blobs ADD COLUMN zero_since REAL')
+        # Sniffed from the bytes; NULL for blobs stored under <digest>.<client extension> before it
+        if 'content_type' not in columns:
+            cursor.execute('ALTER TABLE blobs ADD COLUMN content_type TEXT')
+
+        conn.commit()
+        conn.close()
+
+    def key_for(self, digest):
+        return f"{BLOBS_DIR}/{digest[:2]}/{digest[2:4]}/{digest}"
+
+    def key(self, path):
+        """Blob key for a stored path or a URL on one of our hosts"""
+        return normalize_key(path, self.hosts)
+
+    def path(self, key):
+        """Filesystem path of a stored blob"""
+        return os.path.join(self.base_dir, self.key(key))
+
+    def is_blob(self, key):
+        key = self.key(key)
+        return bool(key) and key.startswith(BLOBS_DIR + '/') and '..' not in key.split('/')
+
+    def exists(self, key):
+        """Whether the blob is in the blobs table"""
+        if not self.is_blob(key):
+            return False
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute('SELECT 1 FROM blobs WHERE key = ?', (self.key(key),)).fetchone()
+        conn.close()
+        return row is not None
+
+    def content_type(self, key):
+        """Sniffed MIME type of a stored blob, None if unknown (guess from the name then)"""
+        if not self.is_blob(key):
+            return None
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute('SELECT content_type FROM blobs WHERE key = ?', (self.key(key),)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    @metrics.timed("upload.save")
+    def put(self, file):
+        """Store an uploaded file (werkzeug FileStorage or binary stream) and return its key"""
+        stream = getattr(file, 'stream', file)
+
+        digest = hashlib.sha256()
+        size = 0
+        head = bytearray()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.incoming-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in iter(lambda: stream.read(1 << 20), b""):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+                    if len(head) < MAX_HEADER_BYTES:
+                        head += chunk[:MAX_HEADER_BYTES - len(head)]
+
+            key = self.key_for(digest.hexdigest())
+            target = self.path(key)
+            if os.path.exists(target):
+                # Duplicate content: keep the existing copy, drop the upload
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        # Restart the grace period of an unreferenced blob so a concurrent gc doesn't collect
+        # one that was just uploaded again
+        now = time.time()
+        cursor.execute(
+            '''INSERT INTO blobs (key, digest, size, content_type, last_put_at, zero_since) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(key) DO UPDATE SET last_put_at = excluded.last_put_at,
+                   zero_since = CASE WHEN refcount = 0 THEN excluded.zero_since END''',
+            (key, digest.hexdigest(), size, sniff_content_type(head), now, now)
+        )
+        conn.commit()
+        conn.close()
+        return key
+
+    def _adjust(self, keys, delta):
+        keys = [self.key(k) for k in keys if self.is_blob(k)]
+        if not keys:
+            return
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        # SET expressions see the old row, so zero_since starts when this update takes the count to zero
+        cursor.executemany(
+            '''UPDATE blobs SET refcount = MAX(0, refcount + ?),
+                   zero_since = CASE WHEN refcount + ? > 0 THEN NULL ELSE COALESCE(zero_since, ?) END
+               WHERE key = ?''',
+            [(delta, delta, now, k) for k in keys]
+        )
+        conn.commit()
+        conn.close()
+
+    def incref(self, *keys):
+        self._adjust(keys, 1)
+
+    def decref(self, *keys):
+        """Drop references; unreferenced blobs are removed by gc after the grace period"""
+        self._adjust(keys, -1)
+
+    def count_references(self, conn):
+        """Recount blob references from every table that stores upload paths"""
+        refs = Counter()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT profile_picture FROM users WHERE profile_picture IS NOT NULL')
+        refs.update(self.key(row[0]) for row in cursor.fetchall())
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'community_post_images'")
+        if cursor.fetchone():
+            cursor.execute('SELECT image_path FROM community_post_images')
+            refs.update(self.key(row[0]) for row in cursor.fetchall())
+
+        cursor.execute('SELECT content FROM user_saves')
+        for (content,) in cursor.fetchall():
+            refs.update(self.key(p) for p in saved_image_paths(content))
+
+        return Counter({k: n for k, n in refs.items() if self.is_blob(k)})
+
+    def gc(self, grace_seconds=24 * 3600):
+        """Reconcile refcounts and delete blobs that stayed unreferenced for grace_seconds"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        refs = self.count_references(conn)
+
+        now = time.time()
+        cursor.execute('UPDATE blobs SET refcount = 0')
+        cursor.executemany('UPDATE blobs SET refcount = ? WHERE key = ?', [(n, k) for k, n in refs.items()])
+        # Blobs the recount found unreferenced start their grace period now, unless decref started it
+        cursor.execute('UPDATE blobs SET zero_since = NULL WHERE refcount > 0')
+        cursor.execute('UPDATE blobs SET zero_since = ? WHERE refcount = 0 AND zero_since IS NULL', (now,))
+
+        cutoff = now - grace_seconds
+        cursor.execute('SELECT key, size FROM blobs WHERE refcount = 0 AND zero_since < ?', (cutoff,))
+        garbage = cursor.fetchall()
+        freed = 0
+        for key, size in garbage:
+            try:
+                os.remove(self.path(key))
+                freed += size
+            except FileNotFoundError:
+                pass
+        cursor.executemany('DELETE FROM blobs WHERE key = ?', [(key,) for key, _ in garbage])
+        derived = self._delete_derivatives(cursor, [key for key, _ in garbage])
+        conn.commit()
+        conn.close()
+
+        for path in derived:
+            try:
+                os.remove(os.path.join(self.base_dir, path))
+            except FileNotFoundError:
+                pass
+
+        # Leftovers from interrupted uploads
+        for name in os.listdir(self.root):
+            tmp_path = os.path.join(self.root, name)
+            if name.startswith('.incoming-') and os.path.getmtime(tmp_path) < cutoff:
+                os.remove(tmp_path)
+
+        return {"deleted": len(garbage), "freed_bytes": freed, "derivatives_deleted": len(derived)}
+
+    def _delete_derivatives(self, cursor, keys):
+        """Drop the image_derivatives rows of collected blobs; returns the derived files nothing else uses"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'image_derivatives'")
+        if not keys or not cursor.fetchone():
+            return []
+        doomed = set()
+        for key in keys:
+            cursor.execute('DELETE FROM image_derivatives WHERE source_path = ? RETURNING digest, ext', (key,))
+            doomed.update(cursor.fetchall())
+        # Derivatives are named by content, so a copy of the same bytes under another key shares them
+        paths = []
+        for digest, ext in doomed:
+            cursor.execute('SELECT 1 FROM image_derivatives WHERE digest = ? AND ext = ?', (digest, ext))
+            if cursor.fetchone() is None:
+                paths.extend(DerivativeStore.derived_path(digest, size, ext) for size in SIZES)
+        return paths
+
+    def stats(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size * MAX(refcount, 1)), 0) FROM blobs')
+        count, stored, logical = cursor.fetchone()
+        conn.close()
+        return {"blobs": count, "stored_bytes": stored, "logical_bytes": logical}
+
+
+def saved_image_paths(content):
+    """Image paths referenced by a user_saves content blob ('image' or 'images')"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(data, dict):
+        return []
+    paths = data.get("images") or []
+    if data.get("image"):
+        paths = [data["image"]] + list(paths)
+    return [p for p in paths if isinstance(p, str)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="kemetpass.db")
+    parser.add_argument("--base-dir", default=os.path.dirname(os.path.abspath(__file__)))
+    sub = parser.add_subparsers(dest="command", required=True)
+    gc_parser = sub.add_parser("gc")
+    gc_parser.add_argument("--grace-hours", type=float, default=24)
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    store = BlobStore(args.db, args.base_dir)
+    if args.command == "gc":
+        print(store.gc(int(args.grace_hours * 3600)))
+    else:
+        print(store.stats())
+
+
+if __name__ == "__main__":
+    main()
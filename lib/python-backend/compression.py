@@ -0,0 +1,67 @@
+"""gzip/brotli compression of JSON and text responses, negotiated per request.
+
+Brotli is used when the brotli (or brotlicffi) package is installed and the
+client accepts it; otherwise gzip. Responses below KEMETPASS_COMPRESS_MIN_BYTES,
+streamed responses and file downloads are sent as they are.
+
+    KEMETPASS_COMPRESSION=0          disable
+    KEMETPASS_COMPRESS_MIN_BYTES     threshold (default 1024)
+    KEMETPASS_GZIP_LEVEL             1-9 (default 6)
+    KEMETPASS_BROTLI_QUALITY         0-11 (default 4; higher costs far more CPU for little gain on JSON)
+"""
+import gzip
+import os
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+ENABLED = os.getenv("KEMETPASS_COMPRESSION", "1") != "0"
+MIN_SIZE = int(os.getenv("KEMETPASS_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("KEMETPASS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("KEMETPASS_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE = {'application/json', 'application/x-ndjson', 'text/plain', 'text/html'}
+
+# Server preference when the client weighs encodings equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data, encoding, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    # mtime=0 keeps the output deterministic for identical bodies
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+def install(app, min_size=MIN_SIZE):
+    """Compress eligible responses of a Flask app; install after metrics.install so timings include it"""
+    if not ENABLED:
+        return
+
+    from flask import request
+
+    @app.after_request
+    def _compress(response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        with metrics.span("compress"):
+            response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -1,17 +1,28 @@
+import argparse
 import sqlite3
 import os
 import json
-from werkzeug.security import generate_password_hash, check_password_hash
+import logs
+import passwords
+from metrics import TimedConnection
+
+log = logs.get_logger("database")
+
+# Tables clients can page through and delta-sync with `since`
+SYNCED_TABLES = ('user_saves', 'chat_history')
+MAX_PAGE = 200
 
 class DatabaseHandler:
-    def __init__(self, db_path='kemetpass.db'):
+    def __init__(self, db_path='kemetpass.db', user_cache=None):
         """Initialize database connection"""
         self.db_path = db_path
+        # Optional user_cache.UserCache in front of get_user
+        self.user_cache = user_cache
         self._initialize_db()
     
     def _initialize_db(self):
         """Create database tables if they don't exist"""
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
         cursor = conn.cursor()
         
         # Users table
@@ -55,6 +66,52 @@ class DatabaseHandler:
         )
         ''')
         
+        # Latest change per synced row: one entry per live row, plus tombstones for deleted ones
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sync_changes'")
+        backfill = cursor.fetchone() is None
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (kind, row_id)
+        )
+        ''')
+        
+        # Highest seq whose tombstones were pruned; older `since` values need a full resync
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        ''')
+        
+        cursor.executescript('''
+        CREATE INDEX IF NOT EXISTS idx_user_saves_user ON user_saves (user_id, id);
+        CREATE INDEX IF NOT EXISTS idx_chat_history_user ON chat_history (user_id, id);
+        CREATE INDEX IF NOT EXISTS idx_sync_changes_user ON sync_changes (user_id, kind, seq);
+        ''')
+        
+        # REPLACE drops the row's previous entry, so the new one moves to the end of the sequence
+        for table in SYNCED_TABLES:
+            cursor.executescript(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table} BEGIN
+                INSERT OR REPLACE INTO sync_changes (kind, row_id, user_id, deleted) VALUES ('{table}', new.id, new.user_id, 0);
+            END;
+            CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE ON {table} BEGIN
+                INSERT OR REPLACE INTO sync_changes (kind, row_id, user_id, deleted) VALUES ('{table}', new.id, new.user_id, 0);
+            END;
+            CREATE TRIGGER IF NOT EXISTS {table}_sync_delete AFTER DELETE ON {table} BEGIN
+                INSERT OR REPLACE INTO sync_changes (kind, row_id, user_id, deleted) VALUES ('{table}', old.id, old.user_id, 1);
+            END;
+            ''')
+            if backfill:
+                cursor.execute(f"INSERT INTO sync_changes (kind, row_id, user_id) SELECT '{table}', id, user_id FROM {table} ORDER BY id")
+        
         conn.commit()
         conn.close()
     
@@ -62,16 +119,10 @@ class DatabaseHandler:
     def register_user(self, email, password, username=None, profile_picture=None, firstName=None, secondName=None):
         """Register a new user"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = sqlite3.connect(self.db_path, factory=TimedConnection)
             cursor = conn.cursor()
             
-            password_hash = generate_password_hash(password)
-            
-            # Print registration data for debugging
-            print(f"Python: Registering user with username: {username}, firstName: {firstName}, secondName: {secondName}")
-            
-            # تسجيل قيم الإدخال للأغراض التشخيصية
-            print(f"Python: Inserting user: email={email}, username={username}, firstName={firstName}, secondName={secondName}")
+            password_hash = passwords.hash_password(password)
             
             cursor.execute(
                 'INSERT INTO users (email, password_hash, username, profile_picture, firstName, secondName) VALUES (?, ?, ?, ?, ?, ?)',
@@ -80,31 +131,32 @@ class DatabaseHandler:
             
             user_id = cursor.lastrowid
             
-            # التحقق من البيانات المدخلة
-            cursor.execute('SELECT id, email, username, firstName, secondName FROM users WHERE id = ?', (user_id,))
-            inserted_user = cursor.fetchone()
-            print(f"Python: Inserted user record: {inserted_user}")
-            
             conn.commit()
             conn.close()
+            # Drop any cached "no such user" for the new id
+            if self.user_cache is not None:
+                self.user_cache.invalidate(user_id)
             return {"success": True, "user_id": user_id}
         except sqlite3.IntegrityError:
             return {"success": False, "error": "Email already exists"}
         except Exception as e:
-            print(f"Python Error in register_user: {str(e)}")
+            log.exception("register_user failed")
             return {"success": False, "error": str(e)}
     
     def login_user(self, email, password):
         """Authenticate a user"""
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
         cursor = conn.cursor()
         
         cursor.execute('SELECT id, email, password_hash, username, profile_picture, firstName, secondName, phone, country, language FROM users WHERE email = ?', (email,))
         user = cursor.fetchone()
-        print(f"Python: Login attempt for {email}, found user: {user}")
         conn.close()
         
-        if user and check_password_hash(user[2], password):
+        if user is None:
+            passwords.verify_dummy(password)
+        if user and passwords.verify_password(user[2], password):
+            if passwords.needs_rehash(user[2]):
+                self._rehash_password(user[0], user[2], password)
             response = {
                 "success": True,
                 "user": {
@@ -119,14 +171,46 @@ class DatabaseHandler:
                     "language": user[9] or "English"
                 }
             }
-            print(f"Python: Login successful, returning user data: {response['user']}")
+            log.info("login succeeded", extra={"user_id": user[0]})
             return response
-        print(f"Python: Login failed for {email}")
+        log.info("login failed", extra={"known_email": user is not None})
         return {"success": False, "error": "Invalid email or password"}
     
+    def _rehash_password(self, user_id, old_hash, password):
+        """Store a hash with the current parameters; skipped if the password changed meanwhile"""
+        try:
+            conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+            conn.execute(
+                'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                (passwords.hash_password(password), user_id, old_hash)
+            )
+            conn.commit()
+            conn.close()
+            log.info("password rehashed", extra={"user_id": user_id, "method": passwords.normalize_method(passwords.METHOD)})
+        except Exception:
+            # The old hash still verifies; try again at the next login
+            log.exception("password rehash failed")
+
+    def get_user(self, user_id):
+        """Public profile fields of a user as a dict, or None; served from user_cache when set"""
+        if self.user_cache is None:
+            return self._load_user(user_id)
+        return self.user_cache.get(user_id, self._load_user)
+    
+    def _load_user(self, user_id):
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT id, email, username, profile_picture, firstName, secondName, phone, country, language FROM users WHERE id = ?', (user_id,))
+        user = cursor.fetchone()
+        conn.close()
+        
+        return dict(user) if user else None
+    
     def update_user_profile(self, user_id, firstName=None, secondName=None, username=None, email=None, phone=None, country=None, language=None, profile_picture=None):
         """Update user profile information"""
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
         cursor = conn.cursor()
         
         update_fields = []
@@ -175,15 +259,18 @@ class DatabaseHandler:
         conn.commit()
         conn.close()
         
+        if self.user_cache is not None:
+            self.user_cache.invalidate(user_id)
         return {"success": True}
     
     # User Saves Methods
     def save_item(self, user_id, item_type, content):
         """Save an item for a user"""
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
         cursor = conn.cursor()
         
-        content_json = json.dumps(content)
+        # Compact, so get_user_saves can pass it through to responses unchanged
+        content_json = json.dumps(content, separators=(",", ":"), ensure_ascii=False)
         cursor.execute(
             'INSERT INTO user_saves (user_id, type, content) VALUES (?, ?, ?)',
             (user_id, item_type, content_json)
@@ -195,42 +282,51 @@ class DatabaseHandler:
         
         return {"success": True, "save_id": save_id}
     
-    def get_user_saves(self, user_id, item_type=None):
-        """Get all saved items for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_user_saves(self, user_id, item_type=None, limit=None, cursor=None):
+        """Saved items for a user, newest first; content stays the stored JSON text for views to splice in.
         
+        With `limit`, returns one page and a next_cursor to pass back as `cursor`.
+        """
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        db_cursor = conn.cursor()
+        
+        query = 'SELECT id, type, content, created_at FROM user_saves WHERE user_id = ?'
+        params = [user_id]
         if item_type:
-            cursor.execute(
-                'SELECT id, type, content, created_at FROM user_saves WHERE user_id = ? AND type = ? ORDER BY created_at DESC',
-                (user_id, item_type)
-            )
-        else:
-            cursor.execute(
-                'SELECT id, type, content, created_at FROM user_saves WHERE user_id = ? ORDER BY created_at DESC',
-                (user_id,)
-            )
+            query += ' AND type = ?'
+            params.append(item_type)
+        if cursor is not None:
+            query += ' AND id < ?'
+            params.append(cursor)
+        query += ' ORDER BY id DESC'
+        if limit is not None:
+            limit = max(1, min(limit, MAX_PAGE))
+            query += ' LIMIT ?'
+            params.append(limit + 1)
         
-        rows = cursor.fetchall()
+        db_cursor.execute(query, params)
+        rows = db_cursor.fetchall()
         conn.close()
         
-        saves = []
-        for row in rows:
-            content = json.loads(row[2])
-            saves.append({
-                "id": row[0],
-                "type": row[1],
-                "content": content,
-                "created_at": row[3]
-            })
-        
-        return {"success": True, "saves": saves}
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+        
+        saves = [save_dict(row) for row in rows]
+        return {"success": True, "saves": saves, "next_cursor": next_cursor}
     
     def delete_saved_item(self, save_id, user_id):
-        """Delete a saved item"""
-        conn = sqlite3.connect(self.db_path)
+        """Delete a saved item, returning its content so referenced uploads can be released"""
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
         cursor = conn.cursor()
         
+        cursor.execute(
+            'SELECT content FROM user_saves WHERE id = ? AND user_id = ?',
+            (save_id, user_id)
+        )
+        row = cursor.fetchone()
+        
         cursor.execute(
             'DELETE FROM user_saves WHERE id = ? AND user_id = ?',
             (save_id, user_id)
@@ -240,12 +336,12 @@ class DatabaseHandler:
         conn.commit()
         conn.close()
         
-        return {"success": success}
+        return {"success": success, "content": row[0] if row else None}
     
     # Chat History Methods
     def save_chat(self, user_id, message, response):
         """Save a chat message and response"""
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
         cursor = conn.cursor()
         
         cursor.execute(
@@ -259,26 +355,143 @@ class DatabaseHandler:
         
         return {"success": True, "chat_id": chat_id}
     
-    def get_chat_history(self, user_id, limit=50):
-        """Get chat history for a user"""
-        conn = sqlite3.connect(self.db_path)
+    def get_chat_history(self, user_id, limit=50, cursor=None):
+        """Chat history for a user, newest first, one page of `limit` before `cursor`
+        
+        `limit` is not capped at MAX_PAGE: clients that ask for their whole history get it, as before paging.
+        """
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        db_cursor = conn.cursor()
+        
+        limit = max(1, limit)
+        if cursor is not None:
+            db_cursor.execute(
+                'SELECT id, message, response, created_at FROM chat_history WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+                (user_id, cursor, limit + 1)
+            )
+        else:
+            db_cursor.execute(
+                'SELECT id, message, response, created_at FROM chat_history WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+                (user_id, limit + 1)
+            )
+        
+        rows = db_cursor.fetchall()
+        conn.close()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+        
+        history = [chat_dict(row) for row in rows]
+        return {"success": True, "history": history, "next_cursor": next_cursor}
+    
+    # Delta Sync Methods
+    def sync_position(self, table, user_id):
+        """Last change of a user's rows in a synced table; read it before a full fetch and sync from there"""
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
         cursor = conn.cursor()
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM sync_changes WHERE user_id = ? AND kind = ?', (user_id, table))
+        position = cursor.fetchone()[0]
+        conn.close()
+        return position
+    
+    def get_changes(self, table, user_id, since, limit=MAX_PAGE, item_type=None):
+        """Rows of a synced table changed after `since`, in change order, with ids deleted since then.
         
-        cursor.execute(
-            'SELECT id, message, response, created_at FROM chat_history WHERE user_id = ? ORDER BY created_at DESC LIMIT ?',
-            (user_id, limit)
-        )
+        `reset` is True when tombstones older than `since` were pruned; the client then refetches
+        everything. Pass next_since back until has_more is False.
+        """
+        if table not in SYNCED_TABLES:
+            raise ValueError(f"{table} is not synced")
+        limit = max(1, min(limit, MAX_PAGE))
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT value FROM sync_state WHERE name = 'horizon'")
+        row = cursor.fetchone()
+        if since > 0 and row and since < row[0]:
+            conn.close()
+            return {"success": True, "reset": True, "rows": [], "deleted": [], "next_since": 0, "has_more": False}
+        
+        if table == 'user_saves':
+            columns, build = 't.id, t.type, t.content, t.created_at', save_dict
+        else:
+            columns, build = 't.id, t.message, t.response, t.created_at', chat_dict
+        query = f'''
+        SELECT c.seq, c.row_id, c.deleted, {columns}
+        FROM sync_changes c
+        LEFT JOIN {table} t ON t.id = c.row_id AND c.deleted = 0
+        WHERE c.user_id = ? AND c.kind = ? AND c.seq > ?
+        '''
+        params = [user_id, table, since]
+        if item_type:
+            query += ' AND (c.deleted = 1 OR t.type = ?)'
+            params.append(item_type)
+        query += ' ORDER BY c.seq LIMIT ?'
+        params.append(limit + 1)
         
-        rows = cursor.fetchall()
+        cursor.execute(query, params)
+        changes = cursor.fetchall()
         conn.close()
         
-        history = []
-        for row in rows:
-            history.append({
-                "id": row[0],
-                "message": row[1],
-                "response": row[2],
-                "created_at": row[3]
-            })
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        rows = [build(change[3:]) for change in changes if not change[2]]
+        deleted = [change[1] for change in changes if change[2]]
+        next_since = changes[-1][0] if changes else since
+        return {"success": True, "reset": False, "rows": rows, "deleted": deleted, "next_since": next_since, "has_more": has_more}
+    
+    def prune_tombstones(self, max_age_days=30):
+        """Forget deletions older than max_age_days; clients that last synced before them must resync"""
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "DELETE FROM sync_changes WHERE deleted = 1 AND changed_at < datetime('now', ?) RETURNING seq",
+            (f"-{max_age_days} days",)
+        )
+        pruned = [row[0] for row in cursor.fetchall()]
+        if pruned:
+            cursor.execute(
+                "INSERT INTO sync_state (name, value) VALUES ('horizon', ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)",
+                (max(pruned),)
+            )
+        conn.commit()
+        conn.close()
         
-        return {"success": True, "history": history} 
\ No newline at end of file
+        return {"success": True, "pruned": len(pruned)}
+
+
+def save_dict(row):
+    return {
+        "id": row[0],
+        "type": row[1],
+        "content": row[2],
+        "created_at": row[3]
+    }
+
+
+def chat_dict(row):
+    return {
+        "id": row[0],
+        "message": row[1],
+        "response": row[2],
+        "created_at": row[3]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance for the KemetPass database")
+    parser.add_argument("--db", default="kemetpass.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+    prune = sub.add_parser("prune-tombstones", help="forget sync deletions older than --days")
+    prune.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    print(DatabaseHandler(args.db).prune_tombstones(args.days))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+import logs
+
+log = logs.get_logger("derivatives")
+
+# Longest edge in pixels for each derivative size
+SIZES = {
+    'thumb': 160,
+    'medium': 720,
+}
+
+DERIVED_DIR = 'uploads/derived'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_image_path(image_path):
+    """Stored paths mix '/uploads/...' and 'uploads/...'; key derivatives on the latter"""
+    return image_path.lstrip('/')
+
+
+class DerivativeStore:
+    def __init__(self, db_path='kemetpass.db', base_dir='.', max_workers=2):
+        """Generate resized derivatives of uploaded images in a background thread pool"""
+        self.db_path = db_path
+        self.base_dir = base_dir
+        self.max_workers = max_workers
+        self.format, self.ext = ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Create the derivatives table if it doesn't exist"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_derivatives (
+            source_path TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            ext TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def derived_path(digest, size, ext):
+        """Content-addressed relative path of one derivative"""
+        return f"{DERIVED_DIR}/{digest[:2]}/{digest}_{size}.{ext}"
+
+    def schedule(self, image_path):
+        """Queue derivative generation for an uploaded image; returns immediately"""
+        with self._executor_lock:
+            if self._executor is None:
+                # Created lazily so each gunicorn worker starts its own threads after fork
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="derivatives")
+            executor = self._executor
+        return executor.submit(self._generate, normalize_image_path(image_path))
+
+    def shutdown(self):
+        """Finish queued generations and stop the threads; the next schedule() starts new ones"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def _generate(self, image_path):
+        source = os.path.join(self.base_dir, image_path)
+        try:
+            digest = file_digest(source)
+            with Image.open(source) as img:
+                img.draft('RGB', (max(SIZES.values()),) * 2)
+                img = ImageOps.exif_transpose(img).convert('RGB')
+                for size, edge in SIZES.items():
+                    target = os.path.join(self.base_dir, self.derived_path(digest, size, self.ext))
+                    if os.path.exists(target):
+                        # Same bytes were uploaded before; the derivative is already on disk
+                        continue
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    resized = img.copy()
+                    resized.thumbnail((edge, edge), Image.LANCZOS)
+                    tmp = f"{target}.tmp{os.getpid()}"
+                    resized.save(tmp, self.format, quality=80)
+                    os.replace(tmp, target)
+        except Exception:
+            log.exception("derivative generation failed", extra={"path": image_path})
+            return None
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT OR REPLACE INTO image_derivatives (source_path, digest, ext) VALUES (?, ?, ?)',
+            (image_path, digest, self.ext)
+        )
+        conn.commit()
+        conn.close()
+        return digest
+
+    def lookup(self, image_paths):
+        """Map each image path that has derivatives to {size: relative path}"""
+        keys = list({normalize_image_path(p) for p in image_paths if p})
+        if not keys:
+            return {}
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        rows = []
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            cursor.execute(
+                f'SELECT source_path, digest, ext FROM image_derivatives WHERE source_path IN ({placeholders})',
+                batch
+            )
+            rows.extend(cursor.fetchall())
+        conn.close()
+
+        return {
+            source_path: {size: self.derived_path(digest, size, ext) for size in SIZES}
+            for source_path, digest, ext in rows
+        }
@@ -0,0 +1,246 @@
+"""Compact image descriptors from the VGG16 7x7x512 feature maps.
+
+    python descriptors.py reindex --features WHERE_IM_image_features.pkl --pooling gem --pca-dim 256 \\
+        --out WHERE_IM_image_features_gem256.pkl
+    python descriptors.py calibrate --features WHERE_IM_image_features.pkl
+    python descriptors.py evaluate --features WHERE_IM_image_features.pkl
+
+reindex re-pools an existing (flattened) gallery without re-running VGG16
+and stores the descriptor head next to the features, so app.py describes
+queries the same way the gallery was built. calibrate picks the open-set
+rejection threshold from held-out genuine and impostor matches and stores
+it in the gallery file, where app.py reads it at load; reindex does this
+too. evaluate reports held-out top-1 accuracy, gallery memory and search
+latency for each head.
+"""
+import argparse
+import pickle
+import time
+
+import numpy as np
+
+FEATURE_MAP_SHAPE = (7, 7, 512)
+POOLINGS = ('flatten', 'avg', 'max', 'gem')
+
+
+class DescriptorHead:
+    def __init__(self, pooling='flatten', gem_p=3.0, pca_mean=None, pca_components=None, pca_scale=None):
+        """Turn VGG16 feature maps into descriptors: pooling, then optional PCA whitening"""
+        if pooling not in POOLINGS:
+            raise ValueError(f"Unknown pooling: {pooling}")
+        self.pooling = pooling
+        self.gem_p = gem_p
+        self.pca_mean = pca_mean
+        self.pca_components = pca_components
+        self.pca_scale = pca_scale
+
+    @property
+    def dim(self):
+        if self.pca_components is not None:
+            return self.pca_components.shape[0]
+        return int(np.prod(FEATURE_MAP_SHAPE)) if self.pooling == 'flatten' else FEATURE_MAP_SHAPE[-1]
+
+    def pool(self, feature_maps):
+        maps = np.asarray(feature_maps, dtype=np.float32).reshape((-1,) + FEATURE_MAP_SHAPE)
+        if self.pooling == 'flatten':
+            return maps.reshape(len(maps), -1)
+        if self.pooling == 'avg':
+            return maps.mean(axis=(1, 2))
+        if self.pooling == 'max':
+            return maps.max(axis=(1, 2))
+        clamped = np.maximum(maps, 1e-6)
+        return np.power(np.power(clamped, self.gem_p).mean(axis=(1, 2)), 1.0 / self.gem_p)
+
+    def __call__(self, feature_maps):
+        """Return an (N, dim) float32 descriptor matrix"""
+        descriptors = self.pool(feature_maps)
+        if self.pca_components is not None:
+            descriptors = _l2_normalize(descriptors)
+            descriptors = (descriptors - self.pca_mean) @ self.pca_components.T
+            descriptors *= self.pca_scale
+        return descriptors.astype(np.float32)
+
+    def fit_pca(self, feature_maps, dim, whiten=True):
+        """Fit PCA (whitening) on pooled gallery descriptors"""
+        pooled = _l2_normalize(self.pool(feature_maps))
+        dim = min(dim, pooled.shape[0], pooled.shape[1])
+        self.pca_mean = pooled.mean(axis=0)
+        _, singular_values, vt = np.linalg.svd(pooled - self.pca_mean, full_matrices=False)
+        self.pca_components = vt[:dim].astype(np.float32)
+        eigenvalues = singular_values[:dim] ** 2 / max(1, len(pooled) - 1)
+        self.pca_scale = (1.0 / np.sqrt(eigenvalues + 1e-6) if whiten else np.ones(dim)).astype(np.float32)
+        return self
+
+    def to_dict(self):
+        return {
+            "pooling": self.pooling,
+            "gem_p": self.gem_p,
+            "pca_mean": self.pca_mean,
+            "pca_components": self.pca_components,
+            "pca_scale": self.pca_scale,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data) if data else cls()
+
+
+def _l2_normalize(x):
+    return x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-12)
+
+
+def load_gallery(feature_file):
+    with open(feature_file, "rb") as f:
+        return pickle.load(f)
+
+
+def reindex(feature_file, out_file, pooling, gem_p=3.0, pca_dim=0, whiten=True):
+    """Re-pool a flattened gallery into compact descriptors and save it with its head"""
+    data = load_gallery(feature_file)
+    if data.get("descriptor", {}).get("pooling", "flatten") != "flatten":
+        raise ValueError(f"{feature_file} is already pooled; reindex from the original flattened gallery")
+
+    head = DescriptorHead(pooling, gem_p)
+    if pca_dim:
+        head.fit_pca(data["features"], pca_dim, whiten)
+
+    out = dict(data)
+    out["features"] = head(data["features"])
+    out["descriptor"] = head.to_dict()
+    # A threshold calibrated on the old descriptors doesn't carry over
+    out["threshold"], out["calibration"] = calibrate_threshold(out["features"], out["labels"])
+    with open(out_file, "wb") as f:
+        pickle.dump(out, f)
+
+    before = np.asarray(data["features"]).nbytes
+    print(f"Wrote {out_file}: {len(out['features'])} x {head.dim} "
+          f"({out['features'].nbytes / 1e6:.1f} MB, was {before / 1e6:.1f} MB)")
+
+
+def _split(labels, holdout, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    query_idx = []
+    for label in np.unique(labels):
+        members = np.flatnonzero(labels == label)
+        # Keep at least one image of every label in the gallery
+        n_query = int(len(members) * holdout) if len(members) > 1 else 0
+        query_idx.extend(rng.choice(members, n_query, replace=False))
+    query_mask = np.zeros(len(labels), dtype=bool)
+    query_mask[query_idx] = True
+    return ~query_mask, query_mask
+
+
+def calibrate_threshold(features, labels, holdout=0.2, max_false_accept=0.05, seed=0, chunk=1024):
+    """Similarity threshold from held-out queries: (threshold, stats)
+
+    Each held-out image is matched against the rest of the gallery. Its best
+    same-label score is a genuine match; its best other-label score is what
+    a landmark missing from the gallery would score (an impostor). The
+    threshold accepts at most max_false_accept of the impostors.
+    """
+    features = _l2_normalize(np.asarray(features, dtype=np.float32))
+    labels = np.asarray(labels)
+    gallery_mask, query_mask = _split(labels, holdout, seed)
+    if not query_mask.any():
+        raise ValueError("Not enough images per label for a held-out split")
+
+    gallery, gallery_labels = features[gallery_mask], labels[gallery_mask]
+    queries, query_labels = features[query_mask], labels[query_mask]
+    genuine, impostor = [], []
+    for start in range(0, len(queries), chunk):
+        scores = queries[start:start + chunk] @ gallery.T
+        same_label = query_labels[start:start + chunk, None] == gallery_labels[None, :]
+        genuine.append(np.where(same_label, scores, -np.inf).max(axis=1))
+        impostor.append(np.where(same_label, -np.inf, scores).max(axis=1))
+    genuine = np.concatenate(genuine)
+    impostor = np.concatenate(impostor)
+    impostor = impostor[np.isfinite(impostor)]
+    if len(impostor) == 0:
+        raise ValueError("Calibration needs at least two labels")
+
+    threshold = float(np.quantile(impostor, 1.0 - max_false_accept))
+    stats = {
+        "queries": int(len(queries)),
+        "genuine_accept": float(np.mean(genuine >= threshold)),
+        "impostor_accept": float(np.mean(impostor >= threshold)),
+    }
+    return threshold, stats
+
+
+def calibrate(feature_file, out_file=None, holdout=0.2, max_false_accept=0.05):
+    """Store a calibrated rejection threshold in a gallery file"""
+    data = load_gallery(feature_file)
+    data["threshold"], data["calibration"] = calibrate_threshold(
+        data["features"], data["labels"], holdout, max_false_accept
+    )
+    out_file = out_file or feature_file
+    with open(out_file, "wb") as f:
+        pickle.dump(data, f)
+
+    stats = data["calibration"]
+    print(f"Wrote {out_file}: threshold {data['threshold']:.4f} over {stats['queries']} held-out queries, "
+          f"genuine accept {stats['genuine_accept']:.3f}, impostor accept {stats['impostor_accept']:.3f}")
+
+
+def evaluate(feature_file, holdout=0.2, pca_dims=(512, 256, 128)):
+    data = load_gallery(feature_file)
+    features = np.asarray(data["features"], dtype=np.float32)
+    labels = np.asarray(data["labels"])
+    gallery_mask, query_mask = _split(labels, holdout)
+    if not query_mask.any():
+        raise ValueError("Not enough images per label for a held-out split")
+
+    configs = [(p, 0) for p in POOLINGS] + [('gem', d) for d in pca_dims]
+    print(f"{query_mask.sum()} held-out queries against {gallery_mask.sum()} gallery images")
+    for pooling, pca_dim in configs:
+        head = DescriptorHead(pooling)
+        if pca_dim:
+            head.fit_pca(features[gallery_mask], pca_dim)
+        gallery = _l2_normalize(head(features[gallery_mask]))
+        queries = head(features[query_mask])
+
+        started = time.perf_counter()
+        scores = _l2_normalize(queries) @ gallery.T
+        latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        predicted = labels[gallery_mask][np.argmax(scores, axis=1)]
+        accuracy = float(np.mean(predicted == labels[query_mask]))
+
+        name = f"{pooling}+pca{pca_dim}" if pca_dim else pooling
+        print(f"{name:>12}  dim {gallery.shape[1]:6d}  top-1 {accuracy:.3f}  "
+              f"{gallery.nbytes / 1e6:8.2f} MB  {latency_ms:.3f} ms/query")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    reindex_parser = sub.add_parser("reindex")
+    reindex_parser.add_argument("--features", required=True)
+    reindex_parser.add_argument("--out", required=True)
+    reindex_parser.add_argument("--pooling", choices=POOLINGS, default='gem')
+    reindex_parser.add_argument("--gem-p", type=float, default=3.0)
+    reindex_parser.add_argument("--pca-dim", type=int, default=0)
+    reindex_parser.add_argument("--no-whiten", action="store_true")
+
+    calibrate_parser = sub.add_parser("calibrate")
+    calibrate_parser.add_argument("--features", required=True)
+    calibrate_parser.add_argument("--out", help="defaults to rewriting --features in place")
+    calibrate_parser.add_argument("--holdout", type=float, default=0.2)
+    calibrate_parser.add_argument("--max-false-accept", type=float, default=0.05)
+
+    evaluate_parser = sub.add_parser("evaluate")
+    evaluate_parser.add_argument("--features", required=True)
+    evaluate_parser.add_argument("--holdout", type=float, default=0.2)
+
+    args = parser.parse_args()
+    if args.command == "reindex":
+        reindex(args.features, args.out, args.pooling, args.gem_p, args.pca_dim, not args.no_whiten)
+    elif args.command == "calibrate":
+        calibrate(args.features, args.out, args.holdout, args.max_false_accept)
+    else:
+        evaluate(args.features, args.holdout)
+
+
+if __name__ == "__main__":
+    main()
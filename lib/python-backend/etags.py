@@ -0,0 +1,125 @@
+"""ETags from data version counters, for cheap conditional GETs.
+
+Triggers bump a counter in data_versions whenever a tracked table changes,
+in the same transaction as the change. A response's ETag hashes the
+counters of the scopes it is built from plus the request path and caller,
+so checking If-None-Match is one indexed read: a 304 never builds, encodes
+or hashes the body.
+
+Per-user tables (user_saves, chat_history) are counted per user so one
+user's writes don't invalidate everyone else's cached lists.
+"""
+import hashlib
+import sqlite3
+from functools import wraps
+
+from metrics import TimedConnection
+
+# table -> (scope, column that splits the scope per user or None)
+TRACKED = {
+    'users': ('users', None),
+    'user_saves': ('user_saves', 'user_id'),
+    'chat_history': ('chat_history', 'user_id'),
+    'community_posts': ('community', None),
+    'community_post_images': ('community', None),
+    'community_likes': ('community', None),
+    'community_comments': ('community', None),
+    'community_bookmarks': ('community', None),
+    'image_derivatives': ('image_derivatives', None),
+}
+
+# Bump when a response format changes so clients don't keep serving the old shape
+FORMAT_VERSION = 1
+
+
+def user_scope(scope, user_id):
+    return f"{scope}:{user_id}"
+
+
+class DataVersions:
+    def __init__(self, db_path='kemetpass.db'):
+        """Change counters per scope; call track() once the tracked tables exist"""
+        self.db_path = db_path
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Create the counter table if it doesn't exist"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def track(self, tables=TRACKED):
+        """Create a bump trigger per tracked table and event"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        for table, (scope, column) in tables.items():
+            for event, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old')):
+                key = f"'{scope}:' || {row}.{column}" if column else f"'{scope}'"
+                cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                    INSERT INTO data_versions (scope, version) VALUES ({key}, 1)
+                    ON CONFLICT (scope) DO UPDATE SET version = version + 1;
+                END
+                ''')
+
+        conn.commit()
+        conn.close()
+
+    def current(self, scopes):
+        """Counter of each scope, 0 for scopes that never changed"""
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        cursor = conn.cursor()
+        placeholders = ", ".join("?" for _ in scopes)
+        cursor.execute(f'SELECT scope, version FROM data_versions WHERE scope IN ({placeholders})', list(scopes))
+        found = dict(cursor.fetchall())
+        conn.close()
+        return tuple(found.get(scope, 0) for scope in scopes)
+
+    def etag(self, scopes, *vary):
+        """Opaque tag that changes whenever any scope changes or `vary` differs"""
+        parts = [str(FORMAT_VERSION), *map(str, vary)]
+        parts += [f"{scope}={version}" for scope, version in zip(scopes, self.current(scopes))]
+        return hashlib.blake2b("\n".join(parts).encode(), digest_size=12).hexdigest()
+
+
+def conditional(versions, scopes):
+    """Route decorator: tag 200 responses and answer If-None-Match with 304 before running the view.
+
+    scopes() runs inside the request and returns the scopes the response is
+    built from, or None to skip conditional handling (e.g. unauthenticated).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import current_app, g, request
+
+            names = scopes()
+            if names is None:
+                return view(*args, **kwargs)
+
+            # Read before the view runs: a write during the build only makes the tag older than the body
+            # Set by auth.Auth.authenticated(), which must wrap this decorator
+            caller = g.get('user_id') or ''
+            tag = versions.etag(names, request.full_path, caller)
+            if request.if_none_match.contains_weak(tag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # Weak: the compressed and identity encodings share one tag
+            response.set_etag(tag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
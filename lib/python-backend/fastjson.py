@@ -0,0 +1,98 @@
+"""Fast JSON for Flask responses, with pre-serialised fragments spliced in as-is.
+
+orjson is used when installed, the stdlib json module otherwise. Output is
+compact UTF-8 without key sorting, sent as application/json; charset=utf-8
+(the Flutter client decodes response.body, which assumes latin-1 when no
+charset is given).
+
+Values wrapped with raw_json() -- e.g. saved content already stored as JSON
+text -- are written into the output without being decoded and re-encoded.
+
+    KEMETPASS_JSON=stdlib    keep Flask's default provider
+"""
+import json
+import os
+import re
+import secrets
+
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENABLED = os.getenv("KEMETPASS_JSON", "fast") != "stdlib"
+
+MIMETYPE = "application/json; charset=utf-8"
+
+
+class RawJSON:
+    """JSON text to emit verbatim; the caller guarantees it is valid"""
+    __slots__ = ("json",)
+
+    def __init__(self, text):
+        self.json = text
+
+
+def raw_json(text):
+    if not ENABLED:
+        # Flask's default provider can't splice fragments
+        return json.loads(text)
+    # orjson >= 3.9 splices fragments natively
+    if orjson is not None and hasattr(orjson, "Fragment"):
+        return orjson.Fragment(text)
+    return RawJSON(text)
+
+
+def dumps(obj, indent=False):
+    """Serialise obj to UTF-8 bytes"""
+    fragments = []
+    token = []
+
+    def default(value):
+        if isinstance(value, RawJSON):
+            # Emitted as a uniquely tagged string and swapped for the fragment afterwards
+            if not token:
+                token.append(secrets.token_hex(8))
+            fragments.append(value.json)
+            return f"{token[0]}:{len(fragments) - 1}"
+        return _default(value)
+
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        data = orjson.dumps(obj, default=default, option=option)
+    else:
+        data = json.dumps(obj, default=default, ensure_ascii=False, indent=2 if indent else None,
+                          separators=None if indent else (",", ":")).encode()
+
+    if fragments:
+        pattern = re.compile(b'"' + token[0].encode() + rb':(\d+)"')
+        data = pattern.sub(lambda m: fragments[int(m.group(1))].encode(), data)
+    return data
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Callers asking for stdlib options (sort_keys, cls, ...) get the stdlib behaviour
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(dumps(obj, indent=indent) + b"\n", content_type=MIMETYPE)
+
+
+def install(app):
+    """Use FastJSONProvider for jsonify and request.json"""
+    if ENABLED:
+        app.json = FastJSONProvider(app)
@@ -0,0 +1,96 @@
+import json
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+}
+
+
+def validate(instance, schema, path="$"):
+    """Validate an instance against the subset of JSON schema used by SCHEMA"""
+    expected = schema.get("type")
+    if expected:
+        py_type = _TYPES[expected]
+        if not isinstance(instance, py_type) or (expected in ("integer", "number") and isinstance(instance, bool)):
+            raise ValueError(f"{path}: expected {expected}, got {type(instance).__name__}")
+
+    if expected == "object":
+        for key in schema.get("required", []):
+            if key not in instance:
+                raise ValueError(f"{path}: missing required field '{key}'")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in instance:
+                validate(instance[key], sub_schema, f"{path}.{key}")
+    elif expected == "array" and "items" in schema:
+        for i, item in enumerate(instance):
+            validate(item, schema["items"], f"{path}[{i}]")
+
+    return instance
+
+
+class PlanDayParser:
+    """Incrementally scan a streamed itinerary and yield each day of `plan` once it is complete"""
+
+    def __init__(self, schema, array_key="plan"):
+        self.day_schema = schema["properties"][array_key]["items"]
+        self.array_key = array_key
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None
+        self._array_depth = None
+        self._item_start = None
+
+    def feed(self, chunk):
+        """Consume a text chunk and return the list of newly completed, validated days"""
+        self.buffer += chunk
+        days = []
+        buf = self.buffer
+
+        for pos in range(self._pos, len(buf)):
+            ch = buf[pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = buf[self._string_start + 1:pos]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "[" and self._depth == 2 and self._last_key == self.array_key:
+                    self._array_depth = self._depth
+                elif ch == "{" and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._item_start = pos
+            elif ch in "}]":
+                if ch == "}" and self._item_start is not None and self._depth == self._array_depth + 1:
+                    day = json.loads(buf[self._item_start:pos + 1])
+                    days.append(validate(day, self.day_schema, f"$.{self.array_key}[]"))
+                    self._item_start = None
+                elif ch == "]" and self._depth == self._array_depth:
+                    self._array_depth = None
+                self._depth -= 1
+            elif ch == "," and self._depth == 1:
+                self._last_key = None
+
+        self._pos = len(buf)
+        return days
+
+    def close(self, schema):
+        """Parse and validate the complete document once the stream has ended"""
+        return validate(json.loads(self.buffer), schema)
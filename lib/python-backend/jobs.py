@@ -0,0 +1,289 @@
+"""Background jobs in a SQLite table, run by worker threads in every server process.
+
+Workers claim the next queued job straight from the table, so any process
+sharing the database can run any job, whatever process accepted it. A
+claimed job holds a lease that its process renews while the handler runs.
+Jobs whose lease ran out (their process died or was recycled mid-job) are
+queued again, at most MAX_ATTEMPTS times in all.
+
+Within a priority, the next job goes to the user with the fewest jobs
+running, so one user's burst doesn't hold up everyone else.
+
+    KEMETPASS_JOB_LEASE=60     seconds a claim lasts without a heartbeat
+"""
+import sqlite3
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import logs
+import metrics
+
+log = logs.get_logger("jobs")
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+LEASE_SECONDS = float(os.getenv("KEMETPASS_JOB_LEASE", "60"))
+# Workers look for jobs submitted by other processes this often
+POLL_SECONDS = 0.5
+MAX_ATTEMPTS = 3
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, db_path='kemetpass.db', max_workers=2, max_pending=200, lease_seconds=LEASE_SECONDS):
+        """Job queue backed by a SQLite table and a bounded pool of worker threads"""
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self._handlers = {}
+        self._priorities = {}
+        # Lease tokens of the jobs this process is running, renewed by the heartbeat thread
+        self._leases = set()
+        self._cond = threading.Condition()
+        self._workers = []
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Create the jobs table if it doesn't exist"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            user_key TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''')
+        # Added after the table first shipped
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(jobs)')}
+        for column, definition in (('lease_owner', 'TEXT'), ('lease_until', 'REAL'),
+                                   ('attempts', 'INTEGER NOT NULL DEFAULT 0')):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs (user_key, status)')
+
+        conn.commit()
+        conn.close()
+
+    def register(self, kind, handler, priority=1):
+        """Register a handler for a job kind; lower priority numbers run first"""
+        self._handlers[kind] = handler
+        self._priorities[kind] = priority
+
+    def start(self):
+        """Start the worker threads and the lease heartbeat"""
+        if self._workers:
+            return
+
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._workers.append(heartbeat)
+
+    def submit(self, kind, payload, user_key):
+        """Persist a new job and schedule it, returning the job id"""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self.queue_depth() >= self.max_pending:
+            raise QueueFull("Too many pending jobs, try again later")
+
+        job_id = uuid.uuid4().hex
+        priority = self._priorities[kind]
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT INTO jobs (id, kind, user_key, priority, status, payload) VALUES (?, ?, ?, ?, ?, ?)',
+            (job_id, kind, str(user_key), priority, QUEUED, json.dumps(payload))
+        )
+        conn.commit()
+        conn.close()
+
+        # Wake a local worker now; other processes find the job on their next poll
+        with self._cond:
+            self._cond.notify()
+
+        return job_id
+
+    def get(self, job_id, user_key=None):
+        """Return a job as a dict, or None if it doesn't exist (or belongs to another user)"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT id, kind, user_key, status, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?',
+            (job_id,)
+        )
+        row = cursor.fetchone()
+        conn.close()
+
+        if not row or (user_key is not None and row[2] != str(user_key)):
+            return None
+
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[3],
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "created_at": row[6],
+            "started_at": row[7],
+            "finished_at": row[8]
+        }
+
+    def events(self, job_id, user_key=None, interval=POLL_SECONDS):
+        """Yield the job each time its status changes; stops once it is done, failed or gone"""
+        last_status = None
+        while True:
+            job = self.get(job_id, user_key)
+            if job is None:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield job
+            if last_status in (DONE, FAILED):
+                return
+            time.sleep(interval)
+
+    def queue_depth(self):
+        """Jobs waiting to run, across every process sharing the database"""
+        conn = sqlite3.connect(self.db_path)
+        depth = conn.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (QUEUED,)).fetchone()[0]
+        conn.close()
+        return depth
+
+    def requeue_expired(self, now=None):
+        """Queue again the running jobs whose lease ran out; fail those out of attempts"""
+        now = now if now is not None else time.time()
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        cursor = conn.cursor()
+        # Rows from before leases existed have none and count as expired
+        expired = 'status = ? AND (lease_until IS NULL OR lease_until < ?)'
+        cursor.execute(
+            f'UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_owner = NULL, lease_until = NULL '
+            f'WHERE {expired} AND attempts >= ?',
+            (FAILED, "Worker stopped while running the job", datetime.now().isoformat(), RUNNING, now, MAX_ATTEMPTS)
+        )
+        failed = cursor.rowcount
+        cursor.execute(
+            f'UPDATE jobs SET status = ?, started_at = NULL, lease_owner = NULL, lease_until = NULL WHERE {expired}',
+            (QUEUED, RUNNING, now)
+        )
+        requeued = cursor.rowcount
+        conn.commit()
+        conn.close()
+        if failed or requeued:
+            log.warning("expired job leases", extra={"requeued": requeued, "failed": failed})
+        return requeued
+
+    def _claim(self):
+        """Claim the next queued job: (id, kind, payload, lease token), or None"""
+        token = uuid.uuid4().hex
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        cursor = conn.cursor()
+        # One statement, so two processes can't claim the same row
+        cursor.execute(
+            '''
+            UPDATE jobs SET status = ?, started_at = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT j.id FROM jobs j
+                WHERE j.status = ?
+                ORDER BY j.priority,
+                         (SELECT COUNT(*) FROM jobs r WHERE r.user_key = j.user_key AND r.status = ?),
+                         j.created_at
+                LIMIT 1
+            ) AND status = ?
+            RETURNING id, kind, payload
+            ''',
+            (RUNNING, datetime.now().isoformat(), token, time.time() + self.lease_seconds,
+             QUEUED, RUNNING, QUEUED)
+        )
+        row = cursor.fetchone()
+        conn.commit()
+        conn.close()
+        return (row[0], row[1], json.loads(row[2]), token) if row else None
+
+    def _finish(self, job_id, token, status, result=None, error=None):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        cursor = conn.cursor()
+        # Only while we still hold the lease; an expired one may have been claimed again
+        cursor.execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_owner = NULL, lease_until = NULL '
+            'WHERE id = ? AND lease_owner = ?',
+            (status, json.dumps(result) if result is not None else None, error, datetime.now().isoformat(),
+             job_id, token)
+        )
+        finished = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        if not finished:
+            log.warning("job lease lost before finishing", extra={"job_id": job_id})
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._cond:
+                tokens = list(self._leases)
+            try:
+                if tokens:
+                    conn = sqlite3.connect(self.db_path, timeout=10)
+                    conn.execute(
+                        f'UPDATE jobs SET lease_until = ? WHERE lease_owner IN ({", ".join("?" for _ in tokens)})',
+                        (time.time() + self.lease_seconds, *tokens)
+                    )
+                    conn.commit()
+                    conn.close()
+                self.requeue_expired()
+            except sqlite3.Error:
+                log.exception("job heartbeat failed")
+
+    def _worker_loop(self):
+        while True:
+            try:
+                claimed = self._claim()
+            except sqlite3.Error:
+                log.exception("job claim failed")
+                claimed = None
+            if claimed is None:
+                with self._cond:
+                    self._cond.wait(POLL_SECONDS)
+                continue
+
+            job_id, kind, payload, token = claimed
+            with self._cond:
+                self._leases.add(token)
+            route = metrics.bind_route(f"job:{kind}")
+            try:
+                handler = self._handlers[kind]
+                result = handler(payload)
+                self._finish(job_id, token, DONE, result=result)
+            except Exception as e:
+                log.exception("job failed", extra={"job_id": job_id, "kind": kind})
+                self._finish(job_id, token, FAILED, error=str(e))
+            finally:
+                with self._cond:
+                    self._leases.discard(token)
+                metrics.unbind_route(route)
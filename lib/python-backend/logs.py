@@ -0,0 +1,173 @@
+"""Structured, leveled logging for the backend.
+
+Request threads only put records on an in-memory queue; a QueueListener
+thread formats them (one JSON object per line by default) and writes them
+out. When the queue is full records are dropped and counted rather than
+blocking the request.
+
+    KEMETPASS_LOG_LEVEL    DEBUG / INFO / WARNING ... (default INFO)
+    KEMETPASS_LOG_FORMAT   json or text (default json)
+    KEMETPASS_LOG_SAMPLE   per-route sampling rates, e.g. "ping=0.01,uploads=0.05"
+    KEMETPASS_LOG_QUEUE    queue capacity in records (default 10000)
+
+Call sites tag high-volume records with extra={"sample": "<route>"}; those are
+kept with the configured probability. WARNING and above are never sampled out.
+"""
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+ROOT = "kemetpass"
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+
+def parse_sample_rates(spec):
+    rates = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            route, rate = item.split("=", 1)
+            rates[route.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        """Keep records tagged with extra={"sample": route} with probability rates[route]"""
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        route = getattr(record, "sample", None)
+        if route is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(route, 1.0)
+        if rate < 1.0:
+            # Lets whoever reads the logs scale sampled counts back up
+            record.sample_rate = rate
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q):
+        """Enqueue records without ever waiting; drops (and counts) them when the queue is full"""
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Only merge the arguments here; JSON encoding happens on the listener thread
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_lock = threading.Lock()
+_handler = None
+_listener = None
+
+
+def configure(level=None, fmt=None, stream=None, sample=None, capacity=None):
+    """Install the queue handler on the 'kemetpass' logger and start the listener thread"""
+    global _handler, _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+
+        level = level or os.getenv("KEMETPASS_LOG_LEVEL", "INFO")
+        fmt = fmt or os.getenv("KEMETPASS_LOG_FORMAT", "json")
+        rates = parse_sample_rates(os.getenv("KEMETPASS_LOG_SAMPLE", "") if sample is None else sample)
+        capacity = capacity or int(os.getenv("KEMETPASS_LOG_QUEUE", "10000"))
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        if fmt == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+        logger = logging.getLogger(ROOT)
+        if _handler is not None:
+            logger.removeHandler(_handler)
+        _handler = NonBlockingQueueHandler(queue.Queue(capacity))
+        _handler.addFilter(SamplingFilter(rates))
+        logger.addHandler(_handler)
+        logger.setLevel(level.upper() if isinstance(level, str) else level)
+        logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+    return logger
+
+
+def _restart_after_fork():
+    # The listener thread does not survive fork; give the child a fresh queue and thread
+    global _listener, _lock
+    _lock = threading.Lock()
+    if _listener is None:
+        return
+    _handler.queue = queue.Queue(_handler.queue.maxsize)
+    _listener = logging.handlers.QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def shutdown():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown)
+
+
+def flush():
+    """Block until the listener has written every queued record"""
+    if _listener is not None:
+        _handler.queue.join()
+
+
+def dropped():
+    return _handler.dropped if _handler is not None else 0
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT}.{name}")
@@ -0,0 +1,202 @@
+"""In-process latency histograms per route and stage, exported in Prometheus text format.
+
+    with metrics.span("predict"):
+        model.predict(batch)
+
+Enabled with KEMETPASS_METRICS=1. When disabled span() hands back one shared
+no-op context manager and nothing is recorded, so instrumented code pays a
+function call and an attribute check.
+
+Histograms live in each process; under gunicorn every worker exports its own
+series, so scrape the workers individually or aggregate by instance.
+"""
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from functools import wraps
+
+ENABLED = os.getenv("KEMETPASS_METRICS") == "1"
+
+# Upper bounds in seconds; SQLite commits sit at the bottom, Gemini plans at the top
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NOOP = nullcontext()
+
+# Route of the request (or job) the current thread is working on
+_route = contextvars.ContextVar("kemetpass_route", default="none")
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        """Histograms keyed by (metric name, label tuple)"""
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._collectors = []
+
+    def add_collector(self, collect):
+        """collect() -> iterable of (name, type, labels, value) samples, read at render time"""
+        self._collectors.append(collect)
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: (list(h.counts), h.total, h.count) for key, h in self._histograms.items()}
+
+    def render(self):
+        """Prometheus text exposition (version 0.0.4)"""
+        lines = []
+        seen = set()
+        for (name, labels), (counts, total, count) in sorted(self.snapshot().items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{label_text}}} {total}")
+            lines.append(f"{name}_count{{{label_text}}} {count}")
+        for collect in self._collectors:
+            for name, kind, labels, value in collect():
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+HELP = {
+    "kemetpass_request_seconds": "Request latency by route, method and status",
+    "kemetpass_stage_seconds": "Latency of one processing stage inside a route",
+    "kemetpass_user_cache_lookups_total": "User cache lookups by result",
+    "kemetpass_user_cache_evictions_total": "Users evicted from the cache to stay under its size bound",
+    "kemetpass_user_cache_entries": "Users currently cached",
+}
+
+REGISTRY = Registry()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+def span(stage):
+    """Time the enclosed block as `stage` of the current route"""
+    if not ENABLED:
+        return _NOOP
+    return _Span(stage)
+
+
+def observe(stage, seconds):
+    """Record a duration measured elsewhere, e.g. time to first streamed chunk"""
+    if ENABLED:
+        REGISTRY.observe("kemetpass_stage_seconds", (("route", _route.get()), ("stage", stage)), seconds)
+
+
+def timed(stage):
+    """Decorator form of span()"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _Span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind_route(route):
+    """Attribute the stages recorded on this thread to `route`; returns a token for unbind_route"""
+    return _route.set(route)
+
+
+def unbind_route(token):
+    _route.reset(token)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection whose commit() is recorded as the 'sqlite.commit' stage"""
+
+    def commit(self):
+        if not ENABLED:
+            return super().commit()
+        with _Span("sqlite.commit"):
+            return super().commit()
+
+
+def install(app):
+    """Record request latency per route for a Flask app"""
+    if not ENABLED:
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g._metrics_started = time.perf_counter()
+        g._metrics_route = bind_route(request.url_rule.rule if request.url_rule else "unmatched")
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop("_metrics_started", None)
+        if started is not None:
+            labels = (("route", _route.get()), ("method", request.method), ("status", str(response.status_code)))
+            REGISTRY.observe("kemetpass_request_seconds", labels, time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def _unbind_route(exc):
+        token = g.pop("_metrics_route", None)
+        if token is not None:
+            unbind_route(token)
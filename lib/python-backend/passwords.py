@@ -0,0 +1,181 @@
+"""Password hashing with a configurable algorithm and cost, run off the request threads.
+
+    KEMETPASS_PASSWORD_HASH=scrypt:32768:8:1     werkzeug method string (scrypt:n:r:p, pbkdf2:sha256:iterations)
+    KEMETPASS_PASSWORD_HASH=argon2:3:65536:4     argon2id time:memory KiB:parallelism (needs argon2-cffi)
+    KEMETPASS_HASH_WORKERS=2                     processes per server worker; 0 hashes inline
+
+Hashes made with other parameters still verify; needs_rehash() tells the
+login path to store a fresh hash, so raising the cost upgrades users as
+they sign in. Hashing and verifying run in a small process pool per
+gunicorn worker. That caps the cores a login storm can take, and other
+requests keep their threads and the GIL. start() forks the pool before the
+worker builds its TensorFlow models; otherwise it is forked on first use.
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:
+    PasswordHasher = None
+
+METHOD = os.getenv("KEMETPASS_PASSWORD_HASH", "scrypt:32768:8:1")
+WORKERS = int(os.getenv("KEMETPASS_HASH_WORKERS", "2"))
+
+# Parameters left out of a method string, in order
+SCRYPT_DEFAULTS = ('32768', '8', '1')
+ARGON2_DEFAULTS = ('3', '65536', '4')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _fill(params, defaults):
+    if len(params) > len(defaults):
+        raise ValueError(f"Expected at most {len(defaults)} parameters, got {':'.join(params)}")
+    return [str(int(p)) for p in params] + list(defaults[len(params):])
+
+
+def normalize_method(method):
+    """Spell out the defaults of a partial method (scrypt:65536) so it matches the prefix stored in hashes"""
+    name, *params = method.split(':')
+    if name == 'scrypt':
+        return 'scrypt:' + ':'.join(_fill(params, SCRYPT_DEFAULTS))
+    if name == 'pbkdf2':
+        hash_name = params[0] if params else 'sha256'
+        iterations = int(params[1]) if len(params) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    if name == 'argon2':
+        if PasswordHasher is None:
+            raise RuntimeError("argon2 hashing needs the argon2-cffi package")
+        return 'argon2:' + ':'.join(_fill(params, ARGON2_DEFAULTS))
+    return method
+
+
+def _argon2(method):
+    time_cost, memory_cost, parallelism = (int(p) for p in method.split(':')[1:])
+    return PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+
+def _hash(password, method):
+    if method.startswith('argon2:'):
+        return _argon2(method).hash(password)
+    return generate_password_hash(password, method=method)
+
+
+def _verify(stored, password):
+    if stored.startswith('$argon2'):
+        if PasswordHasher is None:
+            raise RuntimeError("argon2 hash found but argon2-cffi is not installed")
+        try:
+            return PasswordHasher().verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return check_password_hash(stored, password)
+
+
+def needs_rehash(stored, method=None):
+    """True when stored was made with other parameters than `method` (default: the configured one)"""
+    method = normalize_method(method or METHOD)
+    if method.startswith('argon2:'):
+        return not stored.startswith('$argon2') or _argon2(method).check_needs_rehash(stored)
+    return stored.split('$', 1)[0] != method
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # fork, not spawn: spawned children re-import __main__, which is app.py under `python app.py`
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('fork'))
+        return _pool
+
+
+def start():
+    """Fork the pool's processes now, while the worker is still small"""
+    if WORKERS > 0:
+        # A fork-context pool starts all its processes on the first task
+        _get_pool().submit(int).result()
+
+
+def _run(fn, *args):
+    global _pool
+    if WORKERS <= 0:
+        return fn(*args)
+    pool = _get_pool()
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        return fn(*args)
+
+
+def shutdown():
+    """Stop the pool's processes; the next hash starts a new pool"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def _reset_after_fork():
+    # A pool inherited from the parent belongs to the parent
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def hash_password(password, method=None):
+    return _run(_hash, password, normalize_method(method or METHOD))
+
+
+def verify_password(stored, password):
+    return _run(_verify, stored, password)
+
+
+# Verified against when the email is unknown, so failed logins take as long either way
+_DUMMY = None
+
+
+def verify_dummy(password):
+    global _DUMMY
+    if _DUMMY is None:
+        _DUMMY = hash_password("kemetpass-dummy-password")
+    verify_password(_DUMMY, password)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time password hashing for the configured or given method")
+    parser.add_argument("--method", default=METHOD)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    method = normalize_method(args.method)
+    started = time.perf_counter()
+    for _ in range(args.runs):
+        stored = _hash("benchmark-password", method)
+    hash_ms = (time.perf_counter() - started) / args.runs * 1000
+    started = time.perf_counter()
+    for _ in range(args.runs):
+        _verify(stored, "benchmark-password")
+    verify_ms = (time.perf_counter() - started) / args.runs * 1000
+    print(f"{method}: hash {hash_ms:.1f} ms, verify {verify_ms:.1f} ms per call on one core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from PIL import Image
+
+import logs
+
+log = logs.get_logger("preprocessing")
+
+# Keep this module free of TensorFlow imports; the pool workers only need PIL and numpy.
+
+VGG16_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+VGG16 = 'vgg16'
+UNIT_SCALE = 'unit'
+
+MAX_VIEWS = 8
+
+
+def decode_image(img_path, target_size):
+    """Decode an image straight to target_size (height, width) as float32 RGB"""
+    height, width = target_size
+    with Image.open(img_path) as img:
+        # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the target size
+        img.draft('RGB', (width, height))
+        img = img.convert('RGB')
+        if img.size != (width, height):
+            # Nearest matches keras' image.load_img, which built the gallery features
+            img = img.resize((width, height), Image.NEAREST)
+        return np.asarray(img, dtype=np.float32)
+
+
+def _resize(img, target_size):
+    height, width = target_size
+    if img.size != (width, height):
+        img = img.resize((width, height), Image.NEAREST)
+    return img
+
+
+def _crop_boxes(size):
+    """Centre square plus the two ends of the long side, as (left, upper, right, lower) boxes"""
+    width, height = size
+    side = min(width, height)
+    if width >= height:
+        offsets = [((width - side) // 2, 0), (0, 0), (width - side, 0)]
+    else:
+        offsets = [(0, (height - side) // 2), (0, 0), (0, height - side)]
+    return [(x, y, x + side, y + side) for x, y in offsets]
+
+
+def decode_views(img_path, target_size, views):
+    """Decode once and return `views` float32 RGB views: full frame, flip, crops, flipped crops"""
+    height, width = target_size
+    with Image.open(img_path) as img:
+        # Crops are resized up from part of the frame, so decode with some headroom
+        img.draft('RGB', (width * 2, height * 2))
+        img = img.convert('RGB')
+        full = _resize(img, target_size)
+        crops = [_resize(img.crop(box), target_size) for box in _crop_boxes(img.size)]
+
+    flip = Image.FLIP_LEFT_RIGHT
+    ordered = [full, full.transpose(flip)] + crops + [crop.transpose(flip) for crop in crops]
+    return np.stack([np.asarray(view, dtype=np.float32) for view in ordered[:views]])
+
+
+def normalize(img_array, mode):
+    """Apply the model-specific normalisation in place"""
+    if mode == VGG16:
+        # Same as keras vgg16.preprocess_input ('caffe' mode): RGB -> BGR, zero-centre on ImageNet
+        img_array = img_array[..., ::-1]
+        img_array -= VGG16_MEAN_BGR
+    elif mode == UNIT_SCALE:
+        img_array /= 255.0
+    else:
+        raise ValueError(f"Unknown preprocessing mode: {mode}")
+    return img_array
+
+
+def load_image(img_path, target_size, mode, views=1):
+    """Decode and normalise an image into a (views, height, width, 3) float32 batch"""
+    if views == 1:
+        return np.expand_dims(normalize(decode_image(img_path, target_size), mode), axis=0)
+    return normalize(decode_views(img_path, target_size, views), mode)
+
+
+def _load_into_shared_memory(img_path, target_size, mode, views, shm_name):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray((views, target_size[0], target_size[1], 3), dtype=np.float32, buffer=shm.buf)
+        out[...] = load_image(img_path, target_size, mode, views)
+    finally:
+        shm.close()
+
+
+class PreprocessPool:
+    def __init__(self, max_workers=None):
+        """Decode and resize uploads in worker processes, off the request thread's GIL"""
+        self.max_workers = max_workers if max_workers is not None else min(4, os.cpu_count() or 1)
+        self._executor = None
+        self._lock = threading.Lock()
+        # A pool inherited from the parent belongs to the parent
+        os.register_at_fork(after_in_child=self._forget_executor)
+
+    def _forget_executor(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # fork, not spawn: spawned children re-import __main__, which is app.py under `python app.py`
+        with self._lock:
+            if self._executor is None:
+                # Children attaching to our shared memory must report to our resource tracker, not start their own
+                resource_tracker.ensure_running()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('fork'),
+                )
+            return self._executor
+
+    def start(self):
+        """Fork the pool's processes now, before TensorFlow starts its threads (init_worker)"""
+        if self.max_workers:
+            # A fork-context pool starts all its processes on the first task
+            self._get_executor().submit(int).result()
+
+    def load(self, img_path, target_size, mode, views=1):
+        """Return the preprocessed (views, height, width, 3) float32 batch for an image"""
+        if self.max_workers == 0:
+            return load_image(img_path, target_size, mode, views)
+
+        shape = (views, target_size[0], target_size[1], 3)
+        nbytes = int(np.prod(shape)) * np.dtype(np.float32).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        executor = self._get_executor()
+        try:
+            future = executor.submit(
+                _load_into_shared_memory, img_path, tuple(target_size), mode, views, shm.name
+            )
+            future.result()
+            return np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        except BrokenProcessPool:
+            # A worker died (OOM kill, crash in a decoder); the next load starts a fresh pool
+            log.warning("preprocess pool broken; decoding inline", extra={"image": img_path})
+            self._discard(executor)
+            return load_image(img_path, target_size, mode, views)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
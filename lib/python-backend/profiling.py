@@ -0,0 +1,269 @@
+"""Opt-in request profiling that can be switched on while the server runs.
+
+    python profiling.py enable --rate 0.05 [--minutes 10]
+    python profiling.py enable --route /who_am_i --mode cprofile --tf
+    python profiling.py disable
+    python profiling.py status
+
+`enable` writes a small JSON control file (KEMETPASS_PROFILE_CONTROL,
+default profiles/control.json) that every worker re-reads at most once a
+second, so no restart is needed. Sampled requests are profiled with either
+a stack sampler, written as collapsed stacks ("a;b;c 12") that flamegraph.pl
+and speedscope read directly, or cProfile (.prof, for snakeviz/flameprof).
+With --tf the vision routes also record a TensorFlow profiler trace with
+per-op timings for TensorBoard. Only the newest KEMETPASS_PROFILE_KEEP
+outputs are kept on disk.
+"""
+import argparse
+import cProfile
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_DIR = os.getenv("KEMETPASS_PROFILE_DIR", "profiles")
+CONTROL_FILE = os.getenv("KEMETPASS_PROFILE_CONTROL", os.path.join(PROFILE_DIR, "control.json"))
+KEEP = int(os.getenv("KEMETPASS_PROFILE_KEEP", "50"))
+
+MODES = ("stack", "cprofile")
+
+_SLUG_RE = re.compile(r'[^A-Za-z0-9]+')
+
+
+class Controller:
+    def __init__(self, path=CONTROL_FILE, check_interval=1.0):
+        """Current profiling settings, reloaded from the control file when it changes"""
+        self.path = path
+        self.check_interval = check_interval
+        self._next_check = 0.0
+        self._mtime = None
+        self._config = None
+
+    def current(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self._config = self._read() if mtime is not None else None
+        config = self._config
+        if config and config.get("expires") and time.time() > config["expires"]:
+            return None
+        return config
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def should_profile(self, route):
+        config = self.current()
+        if not config:
+            return None
+        routes = config.get("routes")
+        if routes and route not in routes:
+            return None
+        if random.random() >= config.get("rate", 1.0):
+            return None
+        return config
+
+
+class StackSampler:
+    def __init__(self, thread_id, interval=0.005):
+        """Sample one thread's Python stack every `interval` seconds from a helper thread"""
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Ring:
+    def __init__(self, directory=PROFILE_DIR, keep=KEEP):
+        """Profiles on disk, oldest removed once more than `keep` exist"""
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def path(self, route, suffix):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = _SLUG_RE.sub('_', route).strip('_') or 'root'
+        return os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{slug}-{random.getrandbits(24):06x}{suffix}")
+
+    def prune(self):
+        with self._lock:
+            control = os.path.basename(CONTROL_FILE)
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.startswith(control):
+                    continue
+                path = os.path.join(self.directory, name)
+                # Other workers prune the same directory; skip what they removed under us
+                try:
+                    entries.append((os.stat(path).st_mtime, path))
+                except FileNotFoundError:
+                    continue
+            entries.sort()
+            for _, old in entries[:max(0, len(entries) - self.keep)]:
+                if os.path.isdir(old):
+                    shutil.rmtree(old, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(old)
+                    except FileNotFoundError:
+                        pass
+
+
+class _TFTrace:
+    # The TensorFlow profiler is process-wide; a trace that finds it busy is skipped
+    lock = threading.Lock()
+
+    def __init__(self, logdir):
+        self.logdir = logdir
+        self.active = False
+
+    def start(self):
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            import tensorflow as tf
+            tf.profiler.experimental.start(self.logdir)
+            self.active = True
+        except Exception:
+            self.lock.release()
+
+    def stop(self):
+        if not self.active:
+            return
+        try:
+            import tensorflow as tf
+            tf.profiler.experimental.stop()
+        finally:
+            self.active = False
+            self.lock.release()
+
+
+class _Capture:
+    def __init__(self, route, config, ring, tf_trace):
+        self.route = route
+        self.mode = config.get("mode", "stack")
+        self.ring = ring
+        self.profiler = None
+        self.sampler = None
+        self.tf_trace = _TFTrace(ring.path(route, ".tf")) if tf_trace else None
+
+    def start(self):
+        if self.tf_trace is not None:
+            self.tf_trace.start()
+        if self.mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.sampler = StackSampler(threading.get_ident())
+            self.sampler.start()
+
+    def finish(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.ring.path(self.route, ".prof"))
+        if self.sampler is not None:
+            self.sampler.stop()
+            with open(self.ring.path(self.route, ".folded"), "w") as f:
+                f.write(self.sampler.collapsed())
+        if self.tf_trace is not None:
+            self.tf_trace.stop()
+        self.ring.prune()
+
+
+def install(app, tf_routes=(), controller=None, ring=None):
+    """Profile the requests the control file selects; tf_routes also get a TensorFlow trace"""
+    from flask import g, request
+
+    controller = controller or Controller()
+    ring = ring or Ring()
+
+    @app.before_request
+    def _start_profile():
+        route = request.url_rule.rule if request.url_rule else request.path
+        config = controller.should_profile(route)
+        if config is None:
+            return
+        capture = _Capture(route, config, ring, config.get("tf") and route in tf_routes)
+        capture.start()
+        g._profile_capture = capture
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        capture = g.pop("_profile_capture", None)
+        if capture is not None:
+            capture.finish()
+
+    return controller
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    enable = sub.add_parser("enable")
+    enable.add_argument("--rate", type=float, default=1.0, help="fraction of matching requests to profile")
+    enable.add_argument("--route", action="append", default=[], help="only profile this route rule (repeatable)")
+    enable.add_argument("--mode", choices=MODES, default="stack")
+    enable.add_argument("--tf", action="store_true", help="also trace TensorFlow ops on the vision routes")
+    enable.add_argument("--minutes", type=float, default=10, help="switch off again after this long (0 = never)")
+    sub.add_parser("disable")
+    sub.add_parser("status")
+    args = parser.parse_args()
+
+    if args.command == "enable":
+        config = {"rate": args.rate, "routes": args.route, "mode": args.mode, "tf": args.tf,
+                  "expires": time.time() + args.minutes * 60 if args.minutes else None}
+        os.makedirs(os.path.dirname(CONTROL_FILE) or ".", exist_ok=True)
+        tmp = CONTROL_FILE + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(config, f)
+        os.replace(tmp, CONTROL_FILE)
+        print(f"profiling enabled: {config}")
+    elif args.command == "disable":
+        if os.path.exists(CONTROL_FILE):
+            os.remove(CONTROL_FILE)
+        print("profiling disabled")
+    else:
+        config = Controller().current()
+        print(f"profiling: {config}" if config else "profiling disabled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Export the vision models to quantised TFLite and check them against Keras.
+
+    python quantize.py export --mode dynamic
+    python quantize.py export --mode int8 --calibration-dir uploads/where_im
+    python quantize.py check --mode int8 --images-dir uploads/translate
+
+export writes models/vgg16_backbone_<mode>.tflite (shared by Where-Am-I
+and Who-Am-I, which use the same ImageNet VGG16) and
+models/hieroglyph_<mode>.tflite. app.py serves them when
+KEMETPASS_INFERENCE_BACKEND=tflite. check fails if the quantised models
+drift too far from the .h5 / Keras originals.
+"""
+import argparse
+import glob
+import os
+import sys
+import threading
+
+import numpy as np
+
+import preprocessing
+
+MODELS_DIR = 'models'
+TRANSLATE_H5 = "Egyptian_hieroglyphic_Model_classification.h5"
+MODES = ('dynamic', 'float16', 'int8')
+
+BACKBONE = 'vgg16_backbone'
+HIEROGLYPH = 'hieroglyph'
+INPUTS = {
+    BACKBONE: ((224, 224), preprocessing.VGG16),
+    HIEROGLYPH: ((128, 128), preprocessing.UNIT_SCALE),
+}
+
+
+def artefact_path(name, mode):
+    return os.path.join(MODELS_DIR, f"{name}_{mode}.tflite")
+
+
+def _interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    def __init__(self, model_path, num_threads=None):
+        """Drop-in replacement for a Keras model's predict() backed by a TFLite interpreter"""
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"TFLite model not found: {model_path} (run quantize.py export)")
+        self.model_path = model_path
+        self.num_threads = num_threads
+        # Interpreters are not thread-safe, so every request thread gets its own
+        self._local = threading.local()
+
+    def _interpreter(self):
+        interpreter = getattr(self._local, "interpreter", None)
+        if interpreter is None:
+            interpreter = _interpreter_class()(model_path=self.model_path, num_threads=self.num_threads)
+            interpreter.allocate_tensors()
+            self._local.interpreter = interpreter
+        return interpreter
+
+    def predict(self, batch, verbose=0):
+        interpreter = self._interpreter()
+        input_details = interpreter.get_input_details()[0]
+
+        batch = np.asarray(batch)
+        if tuple(input_details["shape"]) != batch.shape:
+            # The models are exported with a dynamic batch dimension; resize once per new batch size
+            interpreter.resize_tensor_input(input_details["index"], batch.shape)
+            interpreter.allocate_tensors()
+            input_details = interpreter.get_input_details()[0]
+        output_details = interpreter.get_output_details()[0]
+
+        if input_details["dtype"] != np.float32:
+            scale, zero_point = input_details["quantization"]
+            batch = np.round(batch / scale + zero_point).astype(input_details["dtype"])
+        else:
+            batch = batch.astype(np.float32, copy=False)
+        interpreter.set_tensor(input_details["index"], batch)
+        interpreter.invoke()
+        output = interpreter.get_tensor(output_details["index"])
+        if output_details["dtype"] != np.float32:
+            scale, zero_point = output_details["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def load_keras_model(name):
+    if name == BACKBONE:
+        from tensorflow.keras.applications.vgg16 import VGG16
+        return VGG16(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
+    from tensorflow.keras.models import load_model
+    return load_model(TRANSLATE_H5)
+
+
+def image_paths(directory, limit=None):
+    paths = []
+    for pattern in ("*.jpg", "*.jpeg", "*.png", "*.webp"):
+        paths.extend(glob.glob(os.path.join(directory, "**", pattern), recursive=True))
+    return sorted(paths)[:limit]
+
+
+def export(name, mode, calibration_dir=None, calibration_samples=200):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(load_keras_model(name))
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        if not calibration_dir:
+            raise ValueError("int8 export needs --calibration-dir with representative images")
+        target_size, norm = INPUTS[name]
+        paths = image_paths(calibration_dir, calibration_samples)
+        if not paths:
+            raise ValueError(f"No calibration images found in {calibration_dir}")
+
+        def representative_dataset():
+            for path in paths:
+                yield [preprocessing.load_image(path, target_size, norm)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    path = artefact_path(name, mode)
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+    print(f"Wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    return path
+
+
+def check(mode, images_dir, limit=100, min_top1_agreement=0.98, min_cosine=0.98):
+    """Compare the quantised models with Keras on real images; return True when within tolerance"""
+    paths = image_paths(images_dir, limit)
+    if not paths:
+        raise ValueError(f"No images found in {images_dir}")
+
+    ok = True
+    for name in (BACKBONE, HIEROGLYPH):
+        keras_model = load_keras_model(name)
+        lite_model = TFLiteModel(artefact_path(name, mode))
+        target_size, norm = INPUTS[name]
+
+        agreements, cosines = [], []
+        for path in paths:
+            batch = preprocessing.load_image(path, target_size, norm)
+            expected = keras_model.predict(batch, verbose=0).reshape(1, -1)
+            actual = lite_model.predict(batch).reshape(1, -1)
+            agreements.append(np.argmax(expected) == np.argmax(actual))
+            cosines.append(float(np.dot(expected[0], actual[0]) /
+                                 (np.linalg.norm(expected) * np.linalg.norm(actual) + 1e-12)))
+
+        if name == HIEROGLYPH:
+            agreement = float(np.mean(agreements))
+            passed = agreement >= min_top1_agreement
+            print(f"{name} [{mode}]: top-1 agreement {agreement:.3f} over {len(paths)} images "
+                  f"({'ok' if passed else 'FAIL'})")
+        else:
+            worst = float(np.min(cosines))
+            passed = worst >= min_cosine
+            print(f"{name} [{mode}]: embedding cosine mean {np.mean(cosines):.4f}, min {worst:.4f} "
+                  f"({'ok' if passed else 'FAIL'})")
+        ok = ok and passed
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export")
+    export_parser.add_argument("--mode", choices=MODES, default='dynamic')
+    export_parser.add_argument("--model", choices=(BACKBONE, HIEROGLYPH), action="append")
+    export_parser.add_argument("--calibration-dir")
+    export_parser.add_argument("--calibration-samples", type=int, default=200)
+
+    check_parser = sub.add_parser("check")
+    check_parser.add_argument("--mode", choices=MODES, default='dynamic')
+    check_parser.add_argument("--images-dir", required=True)
+    check_parser.add_argument("--limit", type=int, default=100)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        for name in args.model or (BACKBONE, HIEROGLYPH):
+            export(name, args.mode, args.calibration_dir, args.calibration_samples)
+    else:
+        sys.exit(0 if check(args.mode, args.images_dir, args.limit) else 1)
+
+
+if __name__ == "__main__":
+    main()
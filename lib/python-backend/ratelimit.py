@@ -0,0 +1,296 @@
+"""Admission control: token buckets per user and per IP, plus concurrency caps for the models.
+
+Every request takes `cost` tokens (by route; model and LLM routes cost more)
+from two buckets, one keyed on the caller's user id (see auth.py) and one
+on the client IP. Either bucket running dry answers 429 with
+Retry-After at once, before the view runs. Routes in a concurrency group
+(the VGG16/CNN routes, the LLM routes) also need a free slot in that group,
+so a burst of uploads can't occupy every request thread.
+
+Buckets live in memory per process by default. With KEMETPASS_RATE_STORE=sqlite
+they are kept in a small SQLite file shared by all gunicorn workers and
+surviving restarts, at the cost of a write transaction per request.
+Concurrency caps are always per process.
+
+Behind a reverse proxy or load balancer every request arrives from the
+proxy's address. Set KEMETPASS_TRUSTED_PROXIES to the number of proxies in
+front of the app and the client IP is taken from X-Forwarded-For instead
+(werkzeug's ProxyFix). Leave it at 0 when clients connect directly, or they
+can pick their own IP bucket with a forged header.
+
+    KEMETPASS_RATE_LIMIT=0               disable
+    KEMETPASS_RATE_USER=120/60           tokens per minute / burst, per user
+    KEMETPASS_RATE_IP=600/200            tokens per minute / burst, per IP
+    KEMETPASS_RATE_STORE=memory|sqlite   (sqlite file: KEMETPASS_RATE_DB, default ratelimit.db)
+    KEMETPASS_CONCURRENCY_VISION=2       model requests in flight per worker
+    KEMETPASS_CONCURRENCY_LLM=8          LLM requests in flight per worker
+    KEMETPASS_TRUSTED_PROXIES=0          proxies whose X-Forwarded-For/-Proto to trust
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import logs
+
+log = logs.get_logger("ratelimit")
+
+ENABLED = os.getenv("KEMETPASS_RATE_LIMIT", "1") != "0"
+TRUSTED_PROXIES = int(os.getenv("KEMETPASS_TRUSTED_PROXIES", "0"))
+
+# Tokens per request by URL rule; anything else costs DEFAULT_COST
+COSTS = {
+    '/plan_trip': 10,
+    '/plan_trip/stream': 10,
+    '/jobs/plan_trip': 10,
+    '/predict_where_im': 8,
+    '/who_am_i': 8,
+    '/translate_hieroglyphic': 8,
+    '/jobs/translate_hieroglyphic': 8,
+    '/chat': 5,
+    '/jobs/chat': 5,
+    '/register': 5,
+    '/login': 5,
+    '/uploads/<path:filename>': 0,
+    '/metrics': 0,
+}
+DEFAULT_COST = 1
+
+# SQLite store: drop idle buckets after this many requests per process
+PRUNE_EVERY = 10000
+
+# URL rule -> concurrency group; queued /jobs routes are bounded by the job workers instead
+GROUPS = {
+    '/predict_where_im': 'vision',
+    '/who_am_i': 'vision',
+    '/translate_hieroglyphic': 'vision',
+    '/chat': 'llm',
+    '/plan_trip': 'llm',
+    '/plan_trip/stream': 'llm',
+}
+
+
+def parse_rate(text):
+    """'120/60' -> (tokens per second, burst)"""
+    per_minute, burst = text.split('/')
+    return float(per_minute) / 60, float(burst)
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryStore:
+    def __init__(self, max_keys=100000):
+        """Bucket levels in a dict; idle buckets are dropped once they would be full again"""
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets, cost, now):
+        """Take cost from every (key, rate, burst) bucket or from none; returns seconds to wait, 0 if admitted"""
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for key, rate, burst in buckets:
+                tokens, updated = self._buckets.get(key, (burst, now))
+                level = refill(tokens, updated, now, rate, burst)
+                levels.append(level)
+                if level < cost:
+                    wait = max(wait, (cost - level) / rate)
+            if wait:
+                return wait
+            for (key, _, _), level in zip(buckets, levels):
+                self._buckets[key] = (level - cost, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now, max(burst / rate for _, rate, burst in buckets))
+            return 0.0
+
+    def _prune(self, now, refill_time):
+        for key, (_, updated) in list(self._buckets.items()):
+            if now - updated >= refill_time:
+                del self._buckets[key]
+
+
+class SQLiteStore:
+    def __init__(self, db_path='ratelimit.db'):
+        """Bucket levels in SQLite, shared by every process using the same file"""
+        self.db_path = db_path
+        self._takes = 0
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Create the bucket table if it doesn't exist"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rate_buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL
+        )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def take(self, buckets, cost, now):
+        conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        cursor = conn.cursor()
+        try:
+            # Losing the last few updates in a crash is harmless here
+            cursor.execute('PRAGMA synchronous=OFF')
+            cursor.execute('BEGIN IMMEDIATE')
+            keys = [key for key, _, _ in buckets]
+            cursor.execute(f'SELECT key, tokens, updated FROM rate_buckets WHERE key IN ({", ".join("?" for _ in keys)})', keys)
+            stored = {key: (tokens, updated) for key, tokens, updated in cursor.fetchall()}
+
+            levels = []
+            wait = 0.0
+            for key, rate, burst in buckets:
+                tokens, updated = stored.get(key, (burst, now))
+                level = refill(tokens, updated, now, rate, burst)
+                levels.append(level)
+                if level < cost:
+                    wait = max(wait, (cost - level) / rate)
+            if not wait:
+                cursor.executemany(
+                    'INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                    [(key, level - cost, now) for (key, _, _), level in zip(buckets, levels)]
+                )
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        self._takes += 1
+        if self._takes % PRUNE_EVERY == 0:
+            self.prune(max(burst / rate for _, rate, burst in buckets))
+        return wait
+
+    def prune(self, older_than):
+        """Drop buckets untouched for `older_than` seconds (they are full again by then)"""
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.execute('DELETE FROM rate_buckets WHERE updated < ?', (time.time() - older_than,))
+        conn.commit()
+        conn.close()
+
+
+class Admission:
+    def __init__(self, store, user_rate, ip_rate, concurrency, costs=COSTS, groups=GROUPS):
+        """Token buckets per user and IP and per-group concurrency slots"""
+        self.store = store
+        self.user_rate = user_rate
+        self.ip_rate = ip_rate
+        self.costs = costs
+        self.groups = groups
+        self.slots = {group: threading.BoundedSemaphore(limit) for group, limit in concurrency.items()}
+        self.rejected = Counter()
+        self._lock = threading.Lock()
+        # admit() caps these to the burst; a route that costs more is a misconfiguration, so say so
+        for route, cost in costs.items():
+            burst = min(user_rate[1], ip_rate[1])
+            if cost > burst:
+                log.warning("route cost exceeds a bucket's burst and is capped to it",
+                            extra={"route": route, "cost": cost, "burst": burst})
+
+    def admit(self, route, user_id, ip):
+        """(None, 0) when admitted, else (reason, seconds to wait); takes a slot that release() returns"""
+        # Slot first, so a request turned away for concurrency doesn't spend tokens
+        slot = self.slots.get(self.groups.get(route))
+        if slot is not None and not slot.acquire(blocking=False):
+            return self._reject("concurrency", route), 1.0
+
+        cost = self.costs.get(route, DEFAULT_COST)
+        if cost:
+            buckets = [("ip:" + str(ip), *self.ip_rate)]
+            if user_id:
+                buckets.append(("user:" + str(user_id), *self.user_rate))
+            # A cost above a burst could never be admitted
+            cost = min(cost, *(burst for _, _, burst in buckets))
+            wait = self.store.take(buckets, cost, time.time())
+            if wait:
+                if slot is not None:
+                    slot.release()
+                return self._reject("rate", route), wait
+        return None, 0.0
+
+    def release(self, route):
+        slot = self.slots.get(self.groups.get(route))
+        if slot is not None:
+            slot.release()
+
+    def _reject(self, reason, route):
+        with self._lock:
+            self.rejected[(reason, route)] += 1
+        return reason
+
+    def collect(self):
+        """Samples for metrics.REGISTRY.add_collector"""
+        with self._lock:
+            rejected = list(self.rejected.items())
+        return [
+            ("kemetpass_rejected_requests_total", "counter", (("reason", reason), ("route", route)), count)
+            for (reason, route), count in rejected
+        ]
+
+
+def from_env():
+    if os.getenv("KEMETPASS_RATE_STORE", "memory") == "sqlite":
+        store = SQLiteStore(os.getenv("KEMETPASS_RATE_DB", "ratelimit.db"))
+    else:
+        store = MemoryStore()
+    return Admission(
+        store,
+        user_rate=parse_rate(os.getenv("KEMETPASS_RATE_USER", "120/60")),
+        ip_rate=parse_rate(os.getenv("KEMETPASS_RATE_IP", "600/200")),
+        concurrency={
+            'vision': int(os.getenv("KEMETPASS_CONCURRENCY_VISION", "2")),
+            'llm': int(os.getenv("KEMETPASS_CONCURRENCY_LLM", "8")),
+        },
+    )
+
+
+def install(app, admission, identify):
+    """Check admission before every request of a Flask app; identify() returns the caller's user id or None"""
+    if TRUSTED_PROXIES:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        # Before anything reads request.remote_addr: the IP bucket, job ownership, logs
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
+    if not ENABLED:
+        return
+
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _admit():
+        route = request.url_rule.rule if request.url_rule else None
+        if route is None or request.method == 'OPTIONS':
+            return None
+        user_id = identify()
+        reason, wait = admission.admit(route, user_id, request.remote_addr)
+        if reason is None:
+            g._admitted_route = route
+            return None
+
+        retry_after = max(1, math.ceil(wait))
+        log.info("request rejected", extra={"reason": reason, "route": route, "user_id": user_id,
+                                            "retry_after": retry_after, "sample": "ratelimit"})
+        message = "Too many requests" if reason == "rate" else "Server busy, try again shortly"
+        response = jsonify({"success": False, "error": message, "retryAfter": retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    @app.teardown_request
+    def _release(exc):
+        route = g.pop("_admitted_route", None)
+        if route is not None:
+            admission.release(route)
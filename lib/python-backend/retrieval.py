@@ -0,0 +1,72 @@
+import numpy as np
+
+
+def l2_normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / (np.linalg.norm(x, axis=-1, keepdims=True) + 1e-12)
+
+
+class Gallery:
+    def __init__(self, features, labels, threshold=None, neighbours=10, temperature=0.05):
+        """Normalised gallery supporting top-k label search with open-set rejection"""
+        self.features = l2_normalize(features) if len(features) else np.zeros((0, 1), dtype=np.float32)
+        self.label_names, self.label_ids = np.unique(np.asarray(labels), return_inverse=True)
+        self.neighbours = neighbours
+        self.temperature = temperature
+        self.threshold = threshold if threshold is not None else self.calibrate()
+
+    def __len__(self):
+        return len(self.features)
+
+    def search(self, query, k=3):
+        """Return up to k labels ranked by similarity-weighted votes of the nearest gallery images"""
+        if len(self) == 0:
+            return []
+
+        scores = self.features @ l2_normalize(query).ravel()
+        m = min(self.neighbours, len(scores))
+        nearest = np.argpartition(-scores, m - 1)[:m]
+        nearest_scores = scores[nearest]
+        nearest_labels = self.label_ids[nearest]
+
+        weights = np.exp((nearest_scores - nearest_scores.max()) / self.temperature)
+        votes = np.bincount(nearest_labels, weights=weights, minlength=len(self.label_names))
+        votes /= weights.sum()
+        best = np.full(len(self.label_names), -np.inf, dtype=np.float32)
+        np.maximum.at(best, nearest_labels, nearest_scores)
+
+        ranked = [i for i in np.argsort(-votes)[:k] if votes[i] > 0]
+        return [
+            {"label": str(self.label_names[i]), "score": round(float(best[i]), 4), "votes": round(float(votes[i]), 4)}
+            for i in ranked
+        ]
+
+    def identify(self, query, k=3, unknown="Unknown"):
+        """Return (label, candidates, confident); label is `unknown` when the best match is below threshold"""
+        candidates = self.search(query, k)
+        if not candidates:
+            return unknown, [], False
+        confident = candidates[0]["score"] >= self.threshold
+        return (candidates[0]["label"] if confident else unknown), candidates, confident
+
+    def calibrate(self, target_recall=0.95, chunk=1024):
+        """Pick the similarity threshold that accepts target_recall of leave-one-out genuine matches
+
+        Only for galleries saved without a threshold: it ignores impostors and
+        costs a pass over every pair. descriptors.calibrate_threshold is the
+        offline replacement.
+        """
+        genuine = []
+        for start in range(0, len(self), chunk):
+            block = self.features[start:start + chunk] @ self.features.T
+            rows = np.arange(len(block))
+            block[rows, start + rows] = -np.inf
+            same_label = self.label_ids[start:start + chunk, None] == self.label_ids[None, :]
+            block[~same_label] = -np.inf
+            genuine.append(block.max(axis=1))
+
+        genuine = np.concatenate(genuine) if genuine else np.array([])
+        genuine = genuine[np.isfinite(genuine)]
+        if len(genuine) == 0:
+            return 0.0
+        return float(np.quantile(genuine, 1.0 - target_recall))
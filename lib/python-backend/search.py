@@ -0,0 +1,245 @@
+"""Full-text search over community posts and chat history with SQLite FTS5.
+
+    python search.py rebuild [--db kemetpass.db]
+    python search.py optimize
+
+community_posts_fts and chat_history_fts are external-content FTS5 tables:
+they index the text in place and triggers keep them in step with every
+INSERT, UPDATE and DELETE. `rebuild` re-indexes everything from the source
+tables; run it after bulk imports done with triggers disabled, or after a
+VACUUM (community_posts has a TEXT primary key, so its rowids may change).
+"""
+import argparse
+import html
+import re
+import sqlite3
+
+from metrics import TimedConnection
+
+# Markup put around matched terms in snippets
+HIGHLIGHT = ('<b>', '</b>')
+# What FTS5 marks them with (Unicode noncharacters); snippets are HTML-escaped, then these become HIGHLIGHT
+_MARKERS = ('\ufdd0', '\ufdd1')
+ELLIPSIS = '…'
+SNIPPET_TOKENS = 16
+
+MAX_LIMIT = 50
+MAX_TERMS = 8
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def match_query(text, prefix=True):
+    """Turn free text into a safe FTS5 query: every word must match, the last one as a prefix"""
+    tokens = _TOKEN_RE.findall(text or "")[:MAX_TERMS]
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    if prefix:
+        terms[-1] += '*'
+    return " ".join(terms)
+
+
+def highlight(snippet):
+    """HTML-escape a snippet of user text, then turn the FTS5 match markers into HIGHLIGHT tags"""
+    if snippet is None:
+        return None
+    escaped = html.escape(snippet, quote=True)
+    return escaped.replace(_MARKERS[0], HIGHLIGHT[0]).replace(_MARKERS[1], HIGHLIGHT[1])
+
+
+class SearchIndex:
+    def __init__(self, db_path='kemetpass.db'):
+        """FTS5 indexes over community_posts.content and chat_history.message/response"""
+        self.db_path = db_path
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Create the FTS tables and sync triggers, indexing existing rows the first time"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE name IN ('community_posts_fts', 'chat_history_fts')")
+        existing = {row[0] for row in cursor.fetchall()}
+
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS community_posts_fts USING fts5(
+            content,
+            content='community_posts',
+            content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5(
+            message,
+            response,
+            user_id,
+            content='chat_history',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''')
+
+        cursor.executescript('''
+        CREATE TRIGGER IF NOT EXISTS community_posts_fts_insert AFTER INSERT ON community_posts BEGIN
+            INSERT INTO community_posts_fts (rowid, content) VALUES (new.rowid, new.content);
+        END;
+        CREATE TRIGGER IF NOT EXISTS community_posts_fts_delete AFTER DELETE ON community_posts BEGIN
+            INSERT INTO community_posts_fts (community_posts_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+        END;
+        CREATE TRIGGER IF NOT EXISTS community_posts_fts_update AFTER UPDATE OF content ON community_posts BEGIN
+            INSERT INTO community_posts_fts (community_posts_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+            INSERT INTO community_posts_fts (rowid, content) VALUES (new.rowid, new.content);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS chat_history_fts_insert AFTER INSERT ON chat_history BEGIN
+            INSERT INTO chat_history_fts (rowid, message, response, user_id)
+            VALUES (new.id, new.message, new.response, new.user_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS chat_history_fts_delete AFTER DELETE ON chat_history BEGIN
+            INSERT INTO chat_history_fts (chat_history_fts, rowid, message, response, user_id)
+            VALUES ('delete', old.id, old.message, old.response, old.user_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS chat_history_fts_update AFTER UPDATE ON chat_history BEGIN
+            INSERT INTO chat_history_fts (chat_history_fts, rowid, message, response, user_id)
+            VALUES ('delete', old.id, old.message, old.response, old.user_id);
+            INSERT INTO chat_history_fts (rowid, message, response, user_id)
+            VALUES (new.id, new.message, new.response, new.user_id);
+        END;
+        ''')
+
+        for table in ('community_posts_fts', 'chat_history_fts'):
+            if table not in existing:
+                cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+
+        conn.commit()
+        conn.close()
+
+    def rebuild(self):
+        """Re-index both tables from their source rows"""
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO community_posts_fts (community_posts_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO chat_history_fts (chat_history_fts) VALUES ('rebuild')")
+        conn.commit()
+        conn.close()
+        return {"success": True}
+
+    def optimize(self):
+        """Merge index segments; worth running after large imports"""
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO community_posts_fts (community_posts_fts) VALUES ('optimize')")
+        cursor.execute("INSERT INTO chat_history_fts (chat_history_fts) VALUES ('optimize')")
+        conn.commit()
+        conn.close()
+        return {"success": True}
+
+    def search_posts(self, text, limit=20, offset=0):
+        """Posts matching text, best match first, with a highlighted snippet"""
+        query = match_query(text)
+        if query is None:
+            return {"success": False, "error": "Query has no searchable words"}
+        limit = max(1, min(limit, MAX_LIMIT))
+        offset = max(0, offset)
+
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+            SELECT cp.id, cp.user_id, cp.content, cp.created_at,
+                   u.username, u.profile_picture as userImage,
+                   u.firstName, u.secondName,
+                   hits.snippet
+            FROM (
+                -- Rank and page inside FTS5 so snippets and joins are only computed for one page
+                SELECT rowid, rank, snippet(community_posts_fts, 0, ?, ?, ?, ?) AS snippet
+                FROM community_posts_fts
+                WHERE community_posts_fts MATCH ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            ) AS hits
+            JOIN community_posts cp ON cp.rowid = hits.rowid
+            JOIN users u ON cp.user_id = u.id
+            ORDER BY hits.rank
+            ''', (*_MARKERS, ELLIPSIS, SNIPPET_TOKENS, query, limit + 1, offset))
+            rows = [dict(row, snippet=highlight(row['snippet'])) for row in cursor.fetchall()]
+        except sqlite3.OperationalError as e:
+            return {"success": False, "error": str(e)}
+        finally:
+            conn.close()
+
+        return {
+            "success": True,
+            "results": rows[:limit],
+            "next_offset": offset + limit if len(rows) > limit else None,
+        }
+
+    def search_chat(self, user_id, text, limit=20, offset=0):
+        """One user's chat messages and responses matching text, best match first"""
+        query = match_query(text)
+        if query is None:
+            return {"success": False, "error": "Query has no searchable words"}
+        limit = max(1, min(limit, MAX_LIMIT))
+        offset = max(0, offset)
+        # The user_id column lets FTS5 intersect the user's doclist with the terms' doclists
+        query = f'user_id : "{int(user_id)}" AND {{message response}} : ({query})'
+
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+            SELECT ch.id, ch.message, ch.response, ch.created_at, hits.message_snippet, hits.response_snippet
+            FROM (
+                SELECT rowid, bm25(chat_history_fts, 1.0, 1.0, 0.0) AS score,
+                       snippet(chat_history_fts, 0, ?, ?, ?, ?) AS message_snippet,
+                       snippet(chat_history_fts, 1, ?, ?, ?, ?) AS response_snippet
+                FROM chat_history_fts
+                WHERE chat_history_fts MATCH ?
+                ORDER BY score
+                LIMIT ? OFFSET ?
+            ) AS hits
+            JOIN chat_history ch ON ch.id = hits.rowid
+            ORDER BY hits.score
+            ''', (*_MARKERS, ELLIPSIS, SNIPPET_TOKENS, *_MARKERS, ELLIPSIS, SNIPPET_TOKENS, query, limit + 1, offset))
+            rows = cursor.fetchall()
+        except sqlite3.OperationalError as e:
+            return {"success": False, "error": str(e)}
+        finally:
+            conn.close()
+
+        results = [
+            {
+                "id": row[0],
+                "message": row[1],
+                "response": row[2],
+                "created_at": row[3],
+                "messageSnippet": highlight(row[4]),
+                "responseSnippet": highlight(row[5]),
+            }
+            for row in rows[:limit]
+        ]
+        return {
+            "success": True,
+            "results": results,
+            "next_offset": offset + limit if len(rows) > limit else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="kemetpass.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild")
+    sub.add_parser("optimize")
+    args = parser.parse_args()
+
+    index = SearchIndex(args.db)
+    print(index.rebuild() if args.command == "rebuild" else index.optimize())
+
+
+if __name__ == "__main__":
+    main()
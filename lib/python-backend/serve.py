@@ -0,0 +1,101 @@
+"""Production launcher for the KemetPass backend.
+
+Runs app.py under gunicorn with several worker processes. The app is
+imported once in the master (feature galleries, FAISS index, sentence
+encoder) and shared copy-on-write with the workers.
+
+The TensorFlow models are the exception. TensorFlow's runtime does not
+survive fork(), so the master never imports it and each worker builds its
+own models (and loads the hieroglyph label encoder) after fork, with a share of
+the CPU cores as its intra-op thread pool. Memory therefore grows with
+--workers: each worker holds a TensorFlow runtime, one VGG16 backbone
+(14.7M float32 weights, about 59 MB, shared by Where-Am-I and Who-Am-I)
+and the hieroglyph classifier. Check a worker's RSS after its first
+request before raising --workers. More workers add request concurrency,
+not inference throughput, because the cores are already split between
+them. The default is 2.
+
+    python serve.py --workers 2 --bind 0.0.0.0:8000
+
+Send SIGHUP to the master for a graceful reload, or SIGTERM to drain
+in-flight requests and exit. --max-requests N recycles workers after N
+requests to bound memory growth. It is off by default, because each new
+worker builds its models again before it serves.
+"""
+import argparse
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+class KemetPassApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        return app
+
+
+def post_fork(server, worker):
+    import app as app_module
+    app_module.init_worker()
+    server.log.info(f"Worker {worker.pid} loaded models")
+
+
+def parse_args():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Run the KemetPass backend with gunicorn")
+    parser.add_argument("--bind", default=os.getenv("KEMETPASS_BIND", "0.0.0.0:8000"))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("KEMETPASS_WORKERS", min(cores, 2))),
+                        help="worker processes, each with its own TensorFlow models")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("KEMETPASS_THREADS", "4")),
+                        help="request threads per worker")
+    parser.add_argument("--tf-intra-op-threads", type=int, default=0,
+                        help="TensorFlow intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--tf-inter-op-threads", type=int, default=1)
+    parser.add_argument("--timeout", type=int, default=120,
+                        help="seconds before a silent worker is killed")
+    parser.add_argument("--graceful-timeout", type=int, default=60)
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("KEMETPASS_MAX_REQUESTS", "0")),
+                        help="recycle a worker after this many requests; 0 never")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cores = os.cpu_count() or 1
+    intra_op_threads = args.tf_intra_op_threads or max(1, cores // args.workers)
+
+    # auth.from_env() refuses to start without signing keys outside dev
+    os.environ.setdefault("KEMETPASS_ENV", "production")
+    # Read by app.load_models() in each worker
+    os.environ["KEMETPASS_PREFORK"] = "1"
+    # Read by user_cache.from_env(), which shares invalidations between the workers
+    os.environ["KEMETPASS_WORKERS"] = str(args.workers)
+    os.environ["KEMETPASS_TF_INTRA_OP_THREADS"] = str(intra_op_threads)
+    os.environ["KEMETPASS_TF_INTER_OP_THREADS"] = str(args.tf_inter_op_threads)
+
+    options = {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": "gthread",
+        "threads": args.threads,
+        "preload_app": True,
+        "post_fork": post_fork,
+        "timeout": args.timeout,
+        "graceful_timeout": args.graceful_timeout,
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests // 10,
+        "keepalive": 5,
+    }
+    KemetPassApplication(options).run()
+
+
+if __name__ == "__main__":
+    main()
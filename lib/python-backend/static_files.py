@@ -0,0 +1,61 @@
+import os
+
+from flask import Response, abort, send_file
+from werkzeug.security import safe_join
+
+# Directories (relative to uploads/) whose file names are content hashes and never change
+IMMUTABLE_PREFIXES = ('derived/', 'blobs/')
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MUTABLE_MAX_AGE = 300
+
+# 'none': stream from Python (gunicorn uses sendfile for it), 'x-sendfile': Apache/lighttpd,
+# 'x-accel': nginx, which must map KEMETPASS_ACCEL_PREFIX as an internal location onto uploads/
+HANDOFF = os.getenv("KEMETPASS_UPLOADS_HANDOFF", "none")
+ACCEL_PREFIX = os.getenv("KEMETPASS_ACCEL_PREFIX", "/internal_uploads/")
+
+
+def is_immutable(filename):
+    return filename.startswith(IMMUTABLE_PREFIXES)
+
+
+def cache_control(filename):
+    if is_immutable(filename):
+        return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return f"public, max-age={MUTABLE_MAX_AGE}"
+
+
+def send_upload(uploads_dir, filename, mimetype=None):
+    """Serve a file under uploads_dir with validators, long-lived caching for hashed names and range support
+
+    mimetype is for files whose name doesn't tell it, such as blobs (see blobstore.py).
+    """
+    path = safe_join(uploads_dir, filename)
+    if path is None:
+        abort(404)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+
+    if HANDOFF == "x-accel":
+        response = Response(status=200)
+        response.headers["X-Accel-Redirect"] = ACCEL_PREFIX + filename
+        if mimetype:
+            response.headers["Content-Type"] = mimetype
+        response.headers["Cache-Control"] = cache_control(filename)
+        return response
+
+    # conditional=True answers If-None-Match / If-Modified-Since with 304 and Range with 206
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=True,
+        last_modified=stat.st_mtime,
+        max_age=IMMUTABLE_MAX_AGE if is_immutable(filename) else MUTABLE_MAX_AGE,
+    )
+    response.headers["Cache-Control"] = cache_control(filename)
+    return response
@@ -0,0 +1,95 @@
+import importlib.util
+import os
+import sys
+import types
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The backend is a flat set of modules next to app.py
+sys.path.insert(0, BACKEND_DIR)
+
+# What app.py builds at import, besides TensorFlow (which only load_models() imports)
+MODEL_MODULES = ("tensorflow", "sentence_transformers", "faiss", "pandas")
+
+
+class _Client:
+    """Stands in for an LLM or search client; tests monkeypatch the calls they make"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        raise RuntimeError(f"{type(self).__name__}.{name} is not available in tests")
+
+
+def _installed(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+def _fake_module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules.get(parent) or _fake_module(parent), child, module)
+    return module
+
+
+def _install_fakes(models):
+    """Fake the third-party clients app.py creates at import when they aren't installed"""
+    fakes = {
+        "groq": dict(Groq=_Client),
+        "google.generativeai": dict(configure=lambda **kwargs: None, GenerativeModel=_Client),
+        "nltk": dict(download=lambda *args, **kwargs: True),
+        "dotenv": dict(load_dotenv=lambda *args, **kwargs: False),
+        "pandas": dict(read_csv=_Client),
+        "faiss": dict(read_index=_Client),
+        "sentence_transformers": dict(SentenceTransformer=_Client),
+    }
+    for name, attrs in fakes.items():
+        # Without the dummy encoder from fixtures.prepare the real class would download a model
+        if not _installed(name) or (name == "sentence_transformers" and not models):
+            _fake_module(name, **attrs)
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """app.py imported in a scratch directory of dummy galleries (see benchmarks/fixtures.py)
+
+    Models and job workers stay unloaded, so TensorFlow isn't needed; neither
+    are the LLM and semantic-search clients, which are faked when missing.
+    """
+    sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+    import fixtures
+
+    models = all(_installed(name) for name in MODEL_MODULES)
+    _install_fakes(models)
+    workdir = tmp_path_factory.mktemp("backend")
+    os.environ.update(fixtures.prepare(str(workdir), models=models))
+    os.environ["KEMETPASS_PREFORK"] = "1"
+    os.chdir(workdir)
+    import app
+    yield app
+    # Derivatives of uploaded test images are written relative to workdir
+    app.DERIVATIVES.shutdown()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def register(client):
+    """register(email) -> Authorization headers for a new user"""
+    def register(email, password="secret-password", **fields):
+        response = client.post('/register', json=dict(fields, email=email, password=password))
+        assert response.status_code == 200, response.get_json()
+        return {"Authorization": "Bearer " + response.get_json()["token"]}
+    return register
@@ -0,0 +1,48 @@
+import io
+import sqlite3
+
+from PIL import Image
+
+
+def png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'blue').save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def test_feed_page_details_come_from_batched_queries(app_module, client, register, monkeypatch):
+    headers = register("feed@example.com")
+    plain = client.post('/posts', headers=headers, data={"content": "plain"}).get_json()["postId"]
+    pictured = client.post('/posts', headers=headers,
+                           data={"content": "pictured", "image": (png(), 'p.png')}).get_json()["postId"]
+    client.post(f'/posts/{plain}/like', headers=headers)
+    conn = sqlite3.connect(app_module.db.db_path)
+    conn.executemany('INSERT INTO community_comments (user_id, post_id, content) VALUES (?, ?, ?)',
+                     [("someone", pictured, "nice"), ("someone", pictured, "great")])
+    conn.commit()
+    conn.close()
+
+    statements = []
+    connect = sqlite3.connect
+
+    def traced(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(app_module.sqlite3, "connect", traced)
+    images, likes, comments = app_module.get_page_details([plain, pictured])
+    assert len([s for s in statements if s.lstrip().startswith("SELECT")]) == 3
+    assert images[plain] == [] and len(images[pictured]) == 1
+    assert (likes, comments) == ({plain: 1}, {pictured: 2})
+    monkeypatch.undo()
+
+    posts = {post["id"]: post for post in client.get('/posts').get_json()["posts"]}
+    assert (posts[plain]["likes"], posts[plain]["comments"], posts[plain]["images"]) == (1, 0, None)
+    assert (posts[pictured]["likes"], posts[pictured]["comments"]) == (0, 2)
+    assert len(posts[pictured]["images"]) == 1
+
+
+def test_empty_page_needs_no_queries(app_module):
+    assert app_module.get_page_details([]) == ({}, {}, {})
@@ -0,0 +1,8 @@
+def test_events_for_unknown_job_is_404(client):
+    response = client.get('/jobs/no-such-job/events')
+    assert response.status_code == 404
+    assert response.get_json()["success"] is False
+
+
+def test_unknown_job_is_404(client):
+    assert client.get('/jobs/no-such-job').status_code == 404
@@ -0,0 +1,53 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+PREFS = {"query": "temples", "start": "2026-11-01", "days": 2, "budget": "mid"}
+
+ITINERARY = {
+    "city": "Luxor",
+    "days": 2,
+    "plan": [
+        {"day": 1, "date": "2026-11-01", "entries": [{"time": "09:00", "place_name": "Karnak", "activity": "Visit"}]},
+        {"day": 2, "date": "2026-11-02", "entries": []},
+    ],
+}
+
+
+class FakeGemini:
+    def generate_content(self, contents, generation_config, stream=False):
+        text = json.dumps(ITINERARY)
+        if stream:
+            return [SimpleNamespace(text=text[i:i + 5]) for i in range(0, len(text), 5)]
+        return SimpleNamespace(text=text)
+
+
+@pytest.fixture
+def gemini(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "model", FakeGemini())
+    monkeypatch.setattr(app_module, "search_places", lambda query, k=5: [{"name": "Karnak"}])
+    monkeypatch.setattr(app_module, "PLAN_TRIP_FIRST_DAY_SECONDS", app_module.deque(maxlen=1000))
+
+
+@pytest.mark.parametrize("route", ['/plan_trip', '/plan_trip/stream', '/jobs/plan_trip'])
+@pytest.mark.parametrize("days, error", [("three", "days must be an integer"), ([2], "days must be an integer"),
+                                         (None, "Missing required fields")])
+def test_bad_preferences_are_400(client, gemini, route, days, error):
+    response = client.post(route, json=dict(PREFS, days=days))
+    assert response.status_code == 400
+    assert response.get_json()["error"] == error
+
+
+def test_both_routes_record_time_to_first_day(app_module, client, gemini):
+    response = client.post('/plan_trip', json=PREFS)
+    assert response.get_json() == {"success": True, "itinerary": ITINERARY}
+
+    response = client.post('/plan_trip/stream', json=dict(PREFS, days="2"))
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [event["event"] for event in events] == ["day", "day", "done"]
+    assert [event["day"] for event in events[:2]] == ITINERARY["plan"]
+    assert events[2]["itinerary"] == ITINERARY
+
+    stats = client.get('/plan_trip/stats').get_json()["time_to_first_day"]
+    assert stats["count"] == 2
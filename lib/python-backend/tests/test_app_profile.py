@@ -0,0 +1,61 @@
+import io
+import sqlite3
+
+from PIL import Image
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def refcount(app_module, key):
+    conn = sqlite3.connect(app_module.BLOBS.db_path)
+    row = conn.execute('SELECT refcount FROM blobs WHERE key = ?', (key,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def register(client, email):
+    response = client.post('/register', json={"email": email, "password": "secret-password"})
+    return {"Authorization": "Bearer " + response.get_json()["token"]}
+
+
+def test_saving_profile_with_avatar_url_keeps_the_avatar(app_module, client):
+    headers = register(client, "avatar@example.com")
+    response = client.post('/upload_profile_image', headers=headers,
+                           data={"profile_picture": (png('red'), 'me.png')})
+    url = response.get_json()["profileImageUrl"]
+    key = app_module.BLOBS.key(url)
+    assert refcount(app_module, key) == 1
+
+    # What the app sends when the user edits their name: the avatar URL it was given
+    response = client.post('/update_profile', headers=headers, json={"firstName": "Ada", "profileImageUrl": url})
+    assert response.status_code == 200
+    assert refcount(app_module, key) == 1
+    conn = sqlite3.connect(app_module.BLOBS.db_path)
+    stored = conn.execute("SELECT profile_picture FROM users WHERE email = 'avatar@example.com'").fetchone()[0]
+    conn.close()
+    assert stored == key
+
+
+def test_profile_image_url_must_be_a_stored_blob(app_module, client):
+    headers = register(client, "foreign@example.com")
+    response = client.post('/update_profile', headers=headers,
+                           json={"firstName": "Bo", "profileImageUrl": "https://elsewhere.example/cat.jpg"})
+    assert response.status_code == 200
+    assert "profileImageUrl" not in response.get_json()
+
+
+def test_avatar_is_served_with_its_sniffed_type(app_module, client):
+    headers = register(client, "served@example.com")
+    response = client.post('/upload_profile_image', headers=headers,
+                           data={"profile_picture": (png('blue'), 'me.jpg')})
+    key = app_module.BLOBS.key(response.get_json()["profileImageUrl"])
+
+    response = client.get('/' + key)
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert "immutable" in response.headers["Cache-Control"]
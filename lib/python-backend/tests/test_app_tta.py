@@ -0,0 +1,40 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+
+class RecordingModel:
+    """Stands in for VGG16: records each batch and returns random feature maps for it"""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, batch, **kwargs):
+        self.batches.append(batch.shape)
+        return np.random.default_rng(len(self.batches)).random((len(batch), 7, 7, 512), dtype=np.float32)
+
+
+def jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), 'green').save(buffer, format='JPEG')
+    buffer.seek(0)
+    return buffer
+
+
+def test_views_are_embedded_in_one_batch(app_module, client, monkeypatch):
+    model = RecordingModel()
+    monkeypatch.setattr(app_module, "WHERE_IM_MODEL", model)
+
+    response = client.post('/predict_where_im', data={"file": (jpeg(), 'q.jpg'), "views": "5"})
+    assert response.status_code == 200, response.get_json()
+    assert model.batches == [(5, 224, 224, 3)]
+
+    client.post('/predict_where_im', data={"file": (jpeg(), 'q.jpg')})
+    client.post('/predict_where_im', data={"file": (jpeg(), 'q.jpg'), "views": "100"})
+    assert model.batches[1:] == [(1, 224, 224, 3), (8, 224, 224, 3)]
+
+
+def test_fused_query_is_the_mean_of_unit_descriptors(app_module):
+    embeddings = np.array([[3.0, 0.0], [0.0, 2.0]], dtype=np.float32)
+    np.testing.assert_allclose(app_module.fuse_view_embeddings(embeddings), [0.5, 0.5])
@@ -0,0 +1,91 @@
+import pytest
+from flask import Flask, g, jsonify
+
+import auth
+
+KEYS = [("k2", b"new-secret"), ("k1", b"old-secret")]
+
+
+def make_client(identity):
+    app = Flask(__name__)
+    app.secret_key = "test"
+
+    @app.route('/me')
+    @identity.authenticated()
+    def me():
+        return jsonify({"id": g.user_id})
+
+    return app.test_client()
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_token_verifies_until_it_expires():
+    signer = auth.TokenSigner(KEYS, ttl=60)
+    token, expires = signer.issue(7, now=1000)
+
+    assert expires == 1060
+    assert signer.verify(token, now=1059) == (7, None)
+    assert signer.verify(token, now=1060) == (None, "expired")
+
+
+def test_tampered_and_retired_tokens_are_rejected():
+    signer = auth.TokenSigner(KEYS)
+    token, _ = signer.issue(7)
+    kid, user_id, expires, signature = token.split('.')
+
+    assert signer.verify(f"{kid}.8.{expires}.{signature}") == (None, "bad_signature")
+    assert signer.verify(f"{kid}.{user_id}.{int(expires) + 1}.{signature}") == (None, "bad_signature")
+    assert signer.verify("offline_token") == (None, "malformed")
+    # Rotation: k1 tokens verify while k1 is listed, and fail once it is dropped
+    old_token, _ = auth.TokenSigner(KEYS[1:]).issue(7)
+    assert signer.verify(old_token)[0] == 7
+    assert auth.TokenSigner(KEYS[:1]).verify(old_token) == (None, "unknown_key")
+
+
+def test_expired_token_is_401():
+    signer = auth.TokenSigner(KEYS, ttl=60)
+    client = make_client(auth.Auth(signer))
+    live, _ = signer.issue(7)
+    expired, _ = signer.issue(7, now=0)
+
+    assert client.get('/me', headers=bearer(live)).get_json() == {"id": 7}
+    response = client.get('/me', headers=bearer(expired))
+    assert response.status_code == 401
+    assert response.get_json()["success"] is False
+
+
+def test_unsigned_user_id_needs_legacy_mode():
+    signer = auth.TokenSigner(KEYS)
+    assert make_client(auth.Auth(signer)).get('/me', headers={"User-ID": "7"}).status_code == 401
+
+    legacy = make_client(auth.Auth(signer, legacy=True, user_exists=lambda user_id: user_id == 7))
+    assert legacy.get('/me', headers={"User-ID": "7"}).get_json() == {"id": 7}
+    assert legacy.get('/me', headers={"User-ID": "8"}).status_code == 401
+
+
+def test_from_env_refuses_to_start_without_keys_outside_dev(monkeypatch):
+    monkeypatch.delenv("KEMETPASS_AUTH_KEYS", raising=False)
+    monkeypatch.delenv("KEMETPASS_AUTH_LEGACY", raising=False)
+    monkeypatch.setenv("KEMETPASS_ENV", "production")
+    with pytest.raises(RuntimeError):
+        auth.from_env()
+
+    monkeypatch.setenv("KEMETPASS_ENV", "dev")
+    identity = auth.from_env()
+    assert identity.legacy is False
+    assert identity.signer.verify(identity.issue(7)[0]) == (7, None)
+
+
+def test_non_ascii_token_is_malformed_not_an_error():
+    signer = auth.TokenSigner(KEYS)
+    token, _ = signer.issue(7)
+    kid, user_id, expires, _ = token.split('.')
+    assert signer.verify(f"{kid}.{user_id}.{expires}.éé") == (None, "malformed")
+
+    client = make_client(auth.Auth(signer))
+    # Werkzeug hands latin-1 header bytes through as str
+    response = client.get('/me', headers={"Authorization": "Bearer k2.7.9999999999.é"})
+    assert response.status_code == 401
@@ -0,0 +1,151 @@
+import io
+import os
+import sqlite3
+
+import pytest
+from PIL import Image
+
+from blobstore import BLOBS_DIR, BlobStore, normalize_key
+from database import DatabaseHandler
+from derivatives import SIZES, DerivativeStore
+
+HOST = "192.168.1.4:8000"
+
+
+@pytest.fixture
+def store(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    # users and user_saves, which gc counts references from
+    DatabaseHandler(db_path)
+    return BlobStore(db_path, str(tmp_path), hosts=[HOST])
+
+
+def row(store, key):
+    conn = sqlite3.connect(store.db_path)
+    result = conn.execute('SELECT refcount, zero_since FROM blobs WHERE key = ?', (key,)).fetchone()
+    conn.close()
+    return result
+
+
+def set_avatar(store, value):
+    conn = sqlite3.connect(store.db_path)
+    conn.execute("INSERT INTO users (email, password_hash, profile_picture) VALUES ('a@example.com', 'x', ?)", (value,))
+    conn.commit()
+    conn.close()
+
+
+def age_zero_since(store, seconds):
+    conn = sqlite3.connect(store.db_path)
+    conn.execute('UPDATE blobs SET zero_since = zero_since - ?, last_put_at = last_put_at - ?', (seconds, seconds))
+    conn.commit()
+    conn.close()
+
+
+def test_normalize_key_maps_our_urls_back_to_keys():
+    key = f"{BLOBS_DIR}/ab/cd/abcd.jpg"
+    assert normalize_key(f"http://{HOST}/{key}", {HOST}) == key
+    assert normalize_key(f"/{key}", {HOST}) == key
+    assert normalize_key(f"https://elsewhere.example/{key}", {HOST}) == f"https://elsewhere.example/{key}"
+
+
+def test_foreign_and_traversing_urls_are_not_blobs(store):
+    assert not store.is_blob(f"https://elsewhere.example/{BLOBS_DIR}/ab/cd/abcd.jpg")
+    assert not store.is_blob(f"{BLOBS_DIR}/../../kemetpass.db")
+    assert not store.exists(f"http://{HOST}/{BLOBS_DIR}/ab/cd/missing.jpg")
+
+
+def test_avatar_url_refcounts_the_same_blob(store):
+    key = store.put(io.BytesIO(b"avatar"))
+    url = f"http://{HOST}/{key}"
+
+    store.incref(key)
+    # The client sends the avatar back as the URL it was given; that must not release it
+    store.incref(url)
+    store.decref(key)
+    assert row(store, key) == (1, None)
+    assert store.exists(url)
+
+
+def test_decref_to_zero_starts_the_grace_period(store):
+    key = store.put(io.BytesIO(b"avatar"))
+    store.incref(key)
+    assert row(store, key)[1] is None
+
+    store.decref(key)
+    refcount, zero_since = row(store, key)
+    assert refcount == 0 and zero_since is not None
+
+
+def test_gc_counts_grace_from_last_release_not_upload(store):
+    key = store.put(io.BytesIO(b"avatar"))
+    set_avatar(store, key)
+    store.incref(key)
+    # Uploaded long ago, referenced ever since
+    age_zero_since(store, 7 * 24 * 3600)
+
+    assert store.gc(grace_seconds=3600)["deleted"] == 0
+    # Released just now: kept for the grace period even though last_put_at is old
+    conn = sqlite3.connect(store.db_path)
+    conn.execute('UPDATE users SET profile_picture = NULL')
+    conn.commit()
+    conn.close()
+    store.decref(key)
+    assert store.gc(grace_seconds=3600)["deleted"] == 0
+    assert row(store, key)[0] == 0
+
+    age_zero_since(store, 2 * 3600)
+    assert store.gc(grace_seconds=3600)["deleted"] == 1
+    assert row(store, key) is None
+
+
+def test_gc_keeps_avatars_stored_as_urls(store):
+    key = store.put(io.BytesIO(b"avatar"))
+    set_avatar(store, f"http://{HOST}/{key}")
+    age_zero_since(store, 7 * 24 * 3600)
+
+    assert store.gc(grace_seconds=3600)["deleted"] == 0
+    assert row(store, key) == (1, None)
+
+
+def png(color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), color).save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def test_key_depends_on_the_bytes_only(store):
+    from werkzeug.datastructures import FileStorage
+
+    first = store.put(FileStorage(png(), filename="holiday.jpg"))
+    second = store.put(FileStorage(png(), filename="holiday.PNG"))
+
+    assert first == second
+    assert first.rsplit('/', 1)[1].isalnum() and '.' not in first
+    assert store.content_type(first) == 'image/png'
+    assert store.content_type(store.put(io.BytesIO(b"not an image"))) == 'application/octet-stream'
+
+
+def test_gc_deletes_derivatives_with_their_blob(store, tmp_path):
+    derivatives = DerivativeStore(store.db_path, str(tmp_path))
+    key = store.put(png('red'))
+    # Same bytes under an old-style key with the client's extension share the derived files
+    shared = store.put(png('blue'))
+    legacy = shared + '.png'
+    os.link(store.path(shared), store.path(legacy))
+    for source in (key, shared, legacy):
+        derivatives.schedule(source).result()
+    conn = sqlite3.connect(store.db_path)
+    conn.execute("INSERT INTO blobs (key, digest, size, refcount, last_put_at) VALUES (?, '', 0, 1, 0)", (legacy,))
+    conn.commit()
+    conn.close()
+    set_avatar(store, legacy)
+    derived = derivatives.lookup([key, shared])
+    age_zero_since(store, 2 * 3600)
+
+    result = store.gc(grace_seconds=3600)
+
+    assert result["deleted"] == 2 and result["derivatives_deleted"] == len(SIZES)
+    assert derivatives.lookup([key, shared, legacy]).keys() == {legacy}
+    assert not any(os.path.exists(tmp_path / path) for path in derived[key].values())
+    assert all(os.path.exists(tmp_path / path) for path in derived[shared].values())
@@ -0,0 +1,92 @@
+import sqlite3
+
+import pytest
+
+from database import MAX_PAGE, DatabaseHandler
+
+
+@pytest.fixture
+def db(tmp_path):
+    return DatabaseHandler(str(tmp_path / "test.db"))
+
+
+def test_chat_history_pages_with_a_cursor(db):
+    ids = [db.save_chat(1, f"q{i}", f"a{i}")["chat_id"] for i in range(5)]
+    db.save_chat(2, "other user", "not mine")
+
+    first = db.get_chat_history(1, limit=2)
+    assert [c["id"] for c in first["history"]] == ids[:-3:-1]
+    second = db.get_chat_history(1, limit=2, cursor=first["next_cursor"])
+    third = db.get_chat_history(1, limit=2, cursor=second["next_cursor"])
+    assert [c["id"] for c in second["history"] + third["history"]] == ids[2::-1]
+    assert third["next_cursor"] is None
+
+
+def test_chat_history_limit_is_not_capped(db):
+    for i in range(MAX_PAGE + 5):
+        db.save_chat(1, f"q{i}", f"a{i}")
+
+    result = db.get_chat_history(1, limit=MAX_PAGE + 10)
+    assert len(result["history"]) == MAX_PAGE + 5
+    assert result["next_cursor"] is None
+
+
+def test_changes_after_a_sync_position(db):
+    kept = db.save_item(1, "where_im", {"place": "Karnak"})["save_id"]
+    doomed = db.save_item(1, "who_im", {"person": "Ramesses"})["save_id"]
+    since = db.sync_position('user_saves', 1)
+    assert db.get_changes('user_saves', 1, since) == {
+        "success": True, "reset": False, "rows": [], "deleted": [], "next_since": since, "has_more": False}
+
+    added = db.save_item(1, "where_im", {"place": "Philae"})["save_id"]
+    db.delete_saved_item(doomed, 1)
+    db.save_item(2, "where_im", {"place": "someone else's"})
+
+    changes = db.get_changes('user_saves', 1, since)
+    assert [row["id"] for row in changes["rows"]] == [added]
+    assert changes["rows"][0]["content"] == '{"place":"Philae"}'
+    assert changes["deleted"] == [doomed]
+    assert changes["next_since"] == db.sync_position('user_saves', 1)
+    assert kept not in changes["deleted"]
+
+    # Tombstones pass the type filter: the client can't know the type of a row it no longer has
+    filtered = db.get_changes('user_saves', 1, since, item_type="who_im")
+    assert (filtered["rows"], filtered["deleted"]) == ([], [doomed])
+
+
+def test_changes_page_in_change_order(db):
+    ids = [db.save_chat(1, f"q{i}", f"a{i}")["chat_id"] for i in range(5)]
+
+    seen, since, pages = [], 0, 0
+    while True:
+        page = db.get_changes('chat_history', 1, since, limit=2)
+        seen += [row["id"] for row in page["rows"]]
+        since, pages = page["next_since"], pages + 1
+        if not page["has_more"]:
+            break
+    assert seen == ids and pages == 3
+
+
+def test_pruned_tombstones_force_a_resync(db):
+    first = db.save_item(1, "where_im", {"place": "Karnak"})["save_id"]
+    stale = db.sync_position('user_saves', 1)
+    db.delete_saved_item(first, 1)
+    current = db.sync_position('user_saves', 1)
+
+    assert db.prune_tombstones(max_age_days=30)["pruned"] == 0
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("UPDATE sync_changes SET changed_at = datetime('now', '-31 days') WHERE deleted = 1")
+    conn.commit()
+    conn.close()
+    assert db.prune_tombstones(max_age_days=30)["pruned"] == 1
+
+    # A client whose position is older than the pruned deletion can't learn about it
+    assert db.get_changes('user_saves', 1, stale)["reset"] is True
+    # One that already saw it, or one starting from scratch, carries on
+    assert db.get_changes('user_saves', 1, current)["reset"] is False
+    assert db.get_changes('user_saves', 1, 0)["reset"] is False
+
+
+def test_only_synced_tables(db):
+    with pytest.raises(ValueError):
+        db.get_changes('users', 1, 0)
@@ -0,0 +1,55 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import derivatives
+from derivatives import SIZES, DerivativeStore
+
+
+def test_concurrent_first_uploads_share_one_executor(tmp_path, monkeypatch):
+    created = []
+
+    class SlowToStart(ThreadPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            # Widen the window between the None check and the assignment
+            time.sleep(0.05)
+            created.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(derivatives, "ThreadPoolExecutor", SlowToStart)
+    store = DerivativeStore(str(tmp_path / "test.db"), str(tmp_path))
+    monkeypatch.setattr(store, "_generate", lambda path: path)
+    barrier = threading.Barrier(8)
+    futures = []
+
+    def upload(i):
+        barrier.wait()
+        futures.append(store.schedule(f"uploads/blobs/{i}"))
+
+    threads = [threading.Thread(target=upload, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert sorted(future.result() for future in futures) == [f"uploads/blobs/{i}" for i in range(8)]
+    store.shutdown()
+
+
+def test_generates_every_size_and_looks_them_up(tmp_path):
+    (tmp_path / "uploads").mkdir()
+    Image.new('RGB', (1600, 900), 'orange').save(tmp_path / "uploads" / "photo.jpg")
+    store = DerivativeStore(str(tmp_path / "test.db"), str(tmp_path))
+
+    digest = store.schedule("/uploads/photo.jpg").result()
+
+    paths = store.lookup(["uploads/photo.jpg", "/uploads/photo.jpg", "uploads/missing.jpg"])
+    assert list(paths) == ["uploads/photo.jpg"]
+    for size, edge in SIZES.items():
+        assert paths["uploads/photo.jpg"][size] == store.derived_path(digest, size, store.ext)
+        with Image.open(tmp_path / paths["uploads/photo.jpg"][size]) as img:
+            assert max(img.size) == edge
+    store.shutdown()
@@ -0,0 +1,96 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import descriptors
+from retrieval import Gallery
+
+
+def clustered_gallery(labels=10, per_label=10, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(labels, dim))
+    features = np.repeat(centres, per_label, axis=0) + 0.3 * rng.normal(size=(labels * per_label, dim))
+    return features.astype(np.float32), [f"place {i // per_label}" for i in range(labels * per_label)]
+
+
+def test_threshold_separates_genuine_from_impostor_matches():
+    features, labels = clustered_gallery()
+    threshold, stats = descriptors.calibrate_threshold(features, labels, max_false_accept=0.05)
+
+    assert stats["queries"] == 20
+    assert stats["impostor_accept"] <= 0.05
+    assert stats["genuine_accept"] >= 0.9
+    assert -1.0 <= threshold <= 1.0
+
+
+def test_calibration_needs_held_out_images():
+    with pytest.raises(ValueError):
+        descriptors.calibrate_threshold(np.eye(3, dtype=np.float32), ["a", "b", "c"])
+
+
+def test_calibrate_stores_the_threshold_gallery_reads(tmp_path):
+    features, labels = clustered_gallery()
+    path = tmp_path / "gallery.pkl"
+    with open(path, "wb") as f:
+        pickle.dump({"features": features, "labels": labels, "image_paths": []}, f)
+
+    descriptors.calibrate(str(path))
+
+    data = descriptors.load_gallery(str(path))
+    gallery = Gallery(data["features"], data["labels"], data["threshold"])
+    assert gallery.threshold == data["threshold"]
+    label, _, confident = gallery.identify(features[0])
+    assert (label, confident) == ("place 0", True)
+
+
+@pytest.mark.parametrize("pooling, dim", [("flatten", 7 * 7 * 512), ("avg", 512), ("max", 512), ("gem", 512)])
+def test_pooling_shapes(pooling, dim):
+    maps = np.random.default_rng(0).random((3, 7, 7, 512), dtype=np.float32)
+    head = descriptors.DescriptorHead(pooling)
+
+    assert head.dim == dim
+    assert head(maps).shape == (3, dim)
+    # Galleries store the flattened maps; pooling them must give the same descriptors
+    np.testing.assert_allclose(head(maps.reshape(3, -1)), head(maps))
+
+
+def test_gem_lies_between_average_and_max_pooling():
+    maps = np.random.default_rng(0).random((2, 7, 7, 512), dtype=np.float32)
+    avg, gem, peak = (descriptors.DescriptorHead(p)(maps) for p in ("avg", "gem", "max"))
+    assert np.all(avg <= gem + 1e-5) and np.all(gem <= peak + 1e-5)
+
+
+def test_unknown_pooling_is_rejected():
+    with pytest.raises(ValueError):
+        descriptors.DescriptorHead("sum")
+
+
+def test_pca_head_round_trips_and_keeps_neighbours():
+    features, labels = clustered_gallery(dim=7 * 7 * 512)
+    head = descriptors.DescriptorHead("avg").fit_pca(features, 32)
+    assert head.dim == 32
+
+    restored = descriptors.DescriptorHead.from_dict(pickle.loads(pickle.dumps(head.to_dict())))
+    compact = restored(features)
+    np.testing.assert_allclose(compact, head(features))
+    assert compact.shape == (len(features), 32) and compact.dtype == np.float32
+
+    gallery = Gallery(compact[1:], labels[1:], threshold=-1.0)
+    assert gallery.identify(compact[0])[0] == labels[0]
+
+
+def test_reindex_writes_a_calibrated_compact_gallery(tmp_path):
+    features, labels = clustered_gallery(dim=7 * 7 * 512)
+    source, out = tmp_path / "gallery.pkl", tmp_path / "gallery_gem.pkl"
+    with open(source, "wb") as f:
+        pickle.dump({"features": features, "labels": labels, "image_paths": []}, f)
+
+    descriptors.reindex(str(source), str(out), "gem", pca_dim=16)
+
+    data = descriptors.load_gallery(str(out))
+    assert data["features"].shape == (len(labels), 16)
+    assert data["descriptor"]["pooling"] == "gem"
+    assert "threshold" in data
+    with pytest.raises(ValueError):
+        descriptors.reindex(str(out), str(tmp_path / "again.pkl"), "avg")
@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+from flask import Flask, g
+
+from etags import DataVersions, conditional, user_scope
+
+
+@pytest.fixture
+def versions(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE chat_history (id INTEGER PRIMARY KEY, user_id INTEGER, message TEXT)")
+    conn.commit()
+    conn.close()
+    versions = DataVersions(db_path)
+    versions.track({'chat_history': ('chat_history', 'user_id')})
+    return versions
+
+
+def write(versions, sql, *params):
+    conn = sqlite3.connect(versions.db_path)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def test_writes_bump_only_their_users_scope(versions):
+    scopes = (user_scope('chat_history', 1), user_scope('chat_history', 2))
+    assert versions.current(scopes) == (0, 0)
+
+    write(versions, "INSERT INTO chat_history (user_id, message) VALUES (1, 'hi')")
+    write(versions, "UPDATE chat_history SET message = 'hello' WHERE user_id = 1")
+    assert versions.current(scopes) == (2, 0)
+    write(versions, "DELETE FROM chat_history WHERE user_id = 1")
+    assert versions.current(scopes) == (3, 0)
+
+
+def test_conditional_view_answers_304_without_running(versions):
+    app = Flask(__name__)
+    runs = []
+
+    @app.route('/history/<int:user_id>')
+    @conditional(versions, lambda: (user_scope('chat_history', g.user_id),))
+    def history(user_id):
+        runs.append(user_id)
+        return {"runs": len(runs)}
+
+    @app.before_request
+    def caller():
+        g.user_id = 1
+
+    client = app.test_client()
+    first = client.get('/history/1')
+    tag = first.headers["ETag"]
+    assert first.status_code == 200 and tag.startswith('W/')
+    assert first.headers["Cache-Control"] == 'private, no-cache'
+
+    again = client.get('/history/1', headers={"If-None-Match": tag})
+    assert again.status_code == 304 and again.headers["ETag"] == tag
+    assert runs == [1]
+
+    # Another path is another tag even with the same data
+    assert client.get('/history/2').headers["ETag"] != tag
+
+    write(versions, "INSERT INTO chat_history (user_id, message) VALUES (1, 'new')")
+    changed = client.get('/history/1', headers={"If-None-Match": tag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != tag
+
+
+def test_feed_revalidates_until_a_post_changes_it(client, register):
+    headers = register("etag@example.com")
+    tag = client.get('/posts').headers["ETag"]
+
+    assert client.get('/posts', headers={"If-None-Match": tag}).status_code == 304
+
+    client.post('/posts', headers=headers, data={"content": "New find at Saqqara"})
+    response = client.get('/posts', headers={"If-None-Match": tag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != tag
+    assert "New find at Saqqara" in [post["content"] for post in response.get_json()["posts"]]
+
+
+def test_chat_history_tag_is_per_user(app_module, client, register):
+    mine = register("mine@example.com")
+    theirs = client.post('/register', json={"email": "theirs@example.com", "password": "secret-password"}).get_json()
+    tag = client.get('/chat_history', headers=mine).headers["ETag"]
+
+    # Someone else chatting leaves my history's tag alone; my own chat changes it
+    app_module.db.save_chat(theirs["user_id"], "q", "a")
+    assert client.get('/chat_history', headers={**mine, "If-None-Match": tag}).status_code == 304
+    response = client.post('/login', json={"email": "mine@example.com", "password": "secret-password"})
+    app_module.db.save_chat(response.get_json()["user"]["id"], "q", "a")
+    assert client.get('/chat_history', headers={**mine, "If-None-Match": tag}).status_code == 200
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+from flask import Flask, jsonify
+
+import fastjson
+from fastjson import RawJSON
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def encoder(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(fastjson, "orjson", None)
+    return request.param
+
+
+def test_raw_fragments_are_spliced_verbatim(encoder):
+    saved = '{"place": "Karnak", "score": 0.91, "tags": ["temple"]}'
+    data = fastjson.dumps({"saves": [{"id": 1, "content": RawJSON(saved)}, {"id": 2, "content": RawJSON("[]")}]})
+
+    assert saved.encode() in data
+    assert json.loads(data) == {"saves": [{"id": 1, "content": json.loads(saved)}, {"id": 2, "content": []}]}
+
+
+def test_strings_that_look_like_placeholders_are_left_alone(encoder):
+    # Only the token of this call is replaced, so user text can't inject a fragment
+    data = fastjson.dumps({"a": RawJSON("1"), "text": "deadbeefdeadbeef:0"})
+    assert json.loads(data) == {"a": 1, "text": "deadbeefdeadbeef:0"}
+
+
+def test_output_is_compact_utf8(encoder):
+    assert fastjson.dumps({"name": "Ḥatšepsut", "n": [1, 2]}) == '{"name":"Ḥatšepsut","n":[1,2]}'.encode()
+
+
+def test_raw_json_decodes_when_disabled(monkeypatch):
+    monkeypatch.setattr(fastjson, "ENABLED", False)
+    assert fastjson.raw_json('{"a": 1}') == {"a": 1}
+
+
+def test_provider_sends_utf8_json_with_fragments():
+    app = Flask(__name__)
+    fastjson.install(app)
+
+    @app.route('/save')
+    def save():
+        return jsonify({"success": True, "content": fastjson.raw_json('{"image": "uploads/blobs/x"}')})
+
+    response = app.test_client().get('/save')
+    assert response.headers["Content-Type"] == fastjson.MIMETYPE
+    assert response.get_json() == {"success": True, "content": {"image": "uploads/blobs/x"}}
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from itinerary_stream import PlanDayParser, validate
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "city": {"type": "string"},
+        "plan": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"day": {"type": "integer"}, "entries": {"type": "array", "items": {"type": "string"}}},
+                "required": ["day", "entries"],
+            },
+        },
+    },
+    "required": ["city", "plan"],
+}
+
+ITINERARY = {
+    # Braces, brackets, quotes and the key name inside strings must not confuse the scanner
+    "city": 'Luxor {"plan": [} \\ "quoted"',
+    "notes": {"plan": [{"day": 99, "entries": []}]},
+    "plan": [
+        {"day": 1, "entries": ["Karnak [east bank]", "dinner } at 8"]},
+        {"day": 2, "entries": [], "extra": {"nested": [1, {"deep": "}"}]}},
+    ],
+}
+
+
+def test_days_complete_one_character_at_a_time():
+    text = json.dumps(ITINERARY, indent=1)
+    parser = PlanDayParser(SCHEMA)
+
+    completed = []
+    for i, ch in enumerate(text):
+        for day in parser.feed(ch):
+            completed.append((i, day))
+
+    assert [day for _, day in completed] == ITINERARY["plan"]
+    # Each day is released by the brace that closes it, not at the end of the stream
+    first, second = (i for i, _ in completed)
+    assert text[first] == text[second] == "}"
+    assert first < text.index('"day": 2') and second < len(text) - 2
+    assert parser.close(SCHEMA) == ITINERARY
+
+
+def test_chunk_boundaries_do_not_matter():
+    text = json.dumps(ITINERARY)
+    for size in (1, 2, 3, 7, len(text)):
+        parser = PlanDayParser(SCHEMA)
+        days = [day for start in range(0, len(text), size) for day in parser.feed(text[start:start + size])]
+        assert days == ITINERARY["plan"]
+
+
+def test_invalid_day_is_rejected_as_soon_as_it_closes():
+    parser = PlanDayParser(SCHEMA)
+    with pytest.raises(ValueError, match=r"\$\.plan\[\]: missing required field 'entries'"):
+        parser.feed('{"city": "Aswan", "plan": [{"day": 1}')
+
+
+def test_validate_rejects_booleans_as_numbers():
+    with pytest.raises(ValueError):
+        validate(True, {"type": "integer"})
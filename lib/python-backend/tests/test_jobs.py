@@ -0,0 +1,110 @@
+import sqlite3
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, QueueFull
+
+
+def make_queue(db_path, **kwargs):
+    queue = JobQueue(str(db_path), **kwargs)
+    queue.register('echo', lambda payload: {"echo": payload["value"]})
+    return queue
+
+
+def wait_for(queue, job_id, statuses, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {queue.get(job_id)['status']}")
+
+
+def test_starting_queue_leaves_leased_jobs_alone(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    first = make_queue(db_path, lease_seconds=30)
+    job_id = first.submit('echo', {"value": 1}, 'u1')
+    assert first._claim()[0] == job_id
+
+    second = make_queue(db_path, max_workers=1)
+    second.start()
+    time.sleep(0.3)
+    assert second.get(job_id)["status"] == RUNNING
+
+
+def test_expired_lease_is_requeued_and_run_once(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    first = make_queue(db_path, lease_seconds=0.1)
+    job_id = first.submit('echo', {"value": 2}, 'u1')
+    _, _, _, stale_token = first._claim()
+    time.sleep(0.2)
+
+    second = make_queue(db_path, max_workers=1)
+    assert second.requeue_expired() == 1
+    second.start()
+    job = wait_for(second, job_id, (DONE,))
+    assert job["result"] == {"echo": 2}
+
+    # The first process finishing late must not overwrite the result
+    first._finish(job_id, stale_token, FAILED, error="late")
+    assert second.get(job_id)["status"] == DONE
+
+
+def test_jobs_run_by_any_process(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    accepting = make_queue(db_path)
+    job_id = accepting.submit('echo', {"value": 3}, 'u1')
+
+    running = make_queue(db_path, max_workers=1)
+    running.start()
+    assert wait_for(running, job_id, (DONE,))["result"] == {"echo": 3}
+
+
+def test_job_out_of_attempts_fails(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    queue = make_queue(db_path, lease_seconds=0)
+    job_id = queue.submit('echo', {"value": 4}, 'u1')
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE jobs SET status = ?, attempts = 3, lease_until = 0 WHERE id = ?', (RUNNING, job_id))
+    conn.commit()
+    conn.close()
+
+    queue.requeue_expired()
+    assert queue.get(job_id)["status"] == FAILED
+
+
+def test_backlog_limit_is_shared(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    first = make_queue(db_path, max_pending=2)
+    second = make_queue(db_path, max_pending=2)
+    first.submit('echo', {"value": 5}, 'u1')
+    second.submit('echo', {"value": 6}, 'u2')
+
+    assert first.queue_depth() == second.queue_depth() == 2
+    with pytest.raises(QueueFull):
+        first.submit('echo', {"value": 7}, 'u1')
+
+
+def test_claims_alternate_between_users(tmp_path):
+    queue = make_queue(tmp_path / "jobs.db")
+    burst = [queue.submit('echo', {"value": i}, 'busy') for i in range(3)]
+    other = queue.submit('echo', {"value": 9}, 'other')
+
+    assert queue._claim()[0] == burst[0]
+    assert queue._claim()[0] == other
+
+
+def test_events_stop_for_missing_job(tmp_path):
+    queue = make_queue(tmp_path / "jobs.db")
+    assert list(queue.events('no-such-job', interval=0)) == []
+
+    job_id = queue.submit('echo', {"value": 8}, 'u1')
+    events = queue.events(job_id, interval=0)
+    assert next(events)["status"] == QUEUED
+    conn = sqlite3.connect(tmp_path / "jobs.db")
+    conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+    conn.commit()
+    conn.close()
+    assert list(events) == []
@@ -0,0 +1,87 @@
+import io
+import json
+import logging
+import queue
+
+import pytest
+
+import logs
+
+
+@pytest.fixture
+def output():
+    stream = io.StringIO()
+    yield stream
+    logs.configure()
+
+
+def records(stream):
+    logs.flush()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_records_are_json_lines_with_their_extra_fields(output):
+    logs.configure(level="INFO", fmt="json", stream=output, sample="")
+    log = logs.get_logger("test")
+
+    log.debug("not at INFO")
+    log.info("served %s", "/posts", extra={"status": 200, "ms": 1.5})
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        log.exception("failed")
+
+    served, failed = records(output)
+    assert served["level"] == "INFO" and served["logger"] == "kemetpass.test"
+    assert served["msg"] == "served /posts"
+    assert (served["status"], served["ms"]) == (200, 1.5)
+    assert failed["level"] == "ERROR" and "ZeroDivisionError" in failed["exc"]
+
+
+def test_sampled_routes_drop_info_but_never_warnings(output):
+    logs.configure(level="INFO", stream=output, sample="ping=0,uploads=1")
+    log = logs.get_logger("test")
+
+    for _ in range(20):
+        log.info("ping", extra={"sample": "ping"})
+    log.warning("ping failed", extra={"sample": "ping"})
+    log.info("upload", extra={"sample": "uploads"})
+
+    assert [entry["msg"] for entry in records(output)] == ["ping failed", "upload"]
+
+
+def test_sampled_records_carry_their_rate():
+    record = logging.LogRecord("kemetpass.test", logging.INFO, "", 0, "hit", (), None)
+    record.sample = "ping"
+    while not logs.SamplingFilter({"ping": 0.5}).filter(record):
+        pass
+    assert record.sample_rate == 0.5
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = logs.NonBlockingQueueHandler(queue.Queue(1))
+    log = logging.getLogger("kemetpass.test.full")
+    log.addHandler(handler)
+    log.propagate = False
+    try:
+        for _ in range(3):
+            log.warning("burst")
+    finally:
+        log.removeHandler(handler)
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 2
+
+
+def test_parse_sample_rates_clamps():
+    assert logs.parse_sample_rates("ping=0.01, uploads=2,bad") == {"ping": 0.01, "uploads": 1.0}
+
+
+def test_app_logs_events_as_structured_fields(app_module, client, output):
+    logs.configure(stream=output, sample="")
+
+    response = client.post('/register', json={"email": "logged@example.com", "password": "secret-password"})
+
+    registered = [entry for entry in records(output) if entry["msg"] == "user registered"]
+    assert len(registered) == 1
+    assert registered[0]["logger"] == "kemetpass.app"
+    assert registered[0]["user_id"] == response.get_json()["user_id"]
@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+from flask import Flask
+
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    return registry
+
+
+def test_disabled_spans_record_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    assert metrics.span("predict") is metrics.span("decode")
+
+
+def test_stages_are_recorded_under_the_bound_route(registry):
+    token = metrics.bind_route("/who_am_i")
+    try:
+        with metrics.span("predict"):
+            pass
+        metrics.observe("predict", 0.3)
+    finally:
+        metrics.unbind_route(token)
+    metrics.observe("predict", 100.0)
+
+    snapshot = registry.snapshot()
+    counts, total, count = snapshot[("kemetpass_stage_seconds", (("route", "/who_am_i"), ("stage", "predict")))]
+    assert count == 2 and total >= 0.3
+    assert counts[metrics.BUCKETS.index(0.5)] == 1
+    counts, _, _ = snapshot[("kemetpass_stage_seconds", (("route", "none"), ("stage", "predict")))]
+    assert counts[-1] == 1
+
+
+def test_render_is_cumulative_prometheus_text(registry):
+    registry.observe("kemetpass_stage_seconds", (("route", "/posts"), ("stage", 'say "hi"')), 0.003)
+    registry.observe("kemetpass_stage_seconds", (("route", "/posts"), ("stage", 'say "hi"')), 20.0)
+    registry.add_collector(lambda: [("kemetpass_user_cache_entries", "gauge", (), 7)])
+
+    text = registry.render()
+
+    labels = 'route="/posts",stage="say \\"hi\\""'
+    assert "# TYPE kemetpass_stage_seconds histogram" in text
+    assert f'kemetpass_stage_seconds_bucket{{{labels},le="0.0025"}} 0' in text
+    assert f'kemetpass_stage_seconds_bucket{{{labels},le="0.005"}} 1' in text
+    assert f'kemetpass_stage_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"kemetpass_stage_seconds_count{{{labels}}} 2" in text
+    assert "# TYPE kemetpass_user_cache_entries gauge\nkemetpass_user_cache_entries{} 7" in text
+
+
+def test_requests_and_commits_are_timed(registry, tmp_path):
+    app = Flask(__name__)
+
+    @app.route('/items/<int:item_id>')
+    def item(item_id):
+        conn = sqlite3.connect(tmp_path / "db.sqlite", factory=metrics.TimedConnection)
+        conn.execute("CREATE TABLE IF NOT EXISTS t (x)")
+        conn.commit()
+        conn.close()
+        return "ok"
+
+    metrics.install(app)
+    app.test_client().get('/items/1')
+    app.test_client().get('/nowhere')
+
+    keys = set(registry.snapshot())
+    assert ("kemetpass_request_seconds", (("route", "/items/<int:item_id>"), ("method", "GET"), ("status", "200"))) in keys
+    assert ("kemetpass_request_seconds", (("route", "unmatched"), ("method", "GET"), ("status", "404"))) in keys
+    assert ("kemetpass_stage_seconds", (("route", "/items/<int:item_id>"), ("stage", "sqlite.commit"))) in keys
+
+
+def test_metrics_endpoint(app_module, client, monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    assert client.get('/metrics').status_code == 404
+
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert "# TYPE kemetpass_user_cache_entries gauge" in response.get_data(as_text=True)
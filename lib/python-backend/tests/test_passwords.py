@@ -0,0 +1,40 @@
+import pytest
+
+import passwords
+
+
+@pytest.fixture(autouse=True)
+def inline(monkeypatch):
+    monkeypatch.setattr(passwords, "WORKERS", 0)
+
+
+@pytest.mark.parametrize("method, normalized", [
+    ("scrypt", "scrypt:32768:8:1"),
+    ("scrypt:1024", "scrypt:1024:8:1"),
+    ("scrypt:1024:4", "scrypt:1024:4:1"),
+    ("scrypt:1024:4:2", "scrypt:1024:4:2"),
+    ("pbkdf2:sha256:1000", "pbkdf2:sha256:1000"),
+])
+def test_partial_methods_get_the_defaults(method, normalized):
+    assert passwords.normalize_method(method) == normalized
+
+
+def test_too_many_parameters_are_rejected():
+    with pytest.raises(ValueError):
+        passwords.normalize_method("scrypt:1024:8:1:1")
+
+
+def test_partial_method_hashes_need_no_rehash():
+    stored = passwords.hash_password("secret", "scrypt:1024")
+
+    assert stored.startswith("scrypt:1024:8:1$")
+    assert passwords.verify_password(stored, "secret")
+    assert not passwords.needs_rehash(stored, "scrypt:1024")
+    assert not passwords.needs_rehash(stored, "scrypt:1024:8:1")
+    assert passwords.needs_rehash(stored, "scrypt:2048")
+    assert passwords.needs_rehash(stored, "pbkdf2:sha256:1000")
+
+
+def test_wrong_password_fails():
+    stored = passwords.hash_password("secret", "pbkdf2:sha256:1000")
+    assert not passwords.verify_password(stored, "guess")
@@ -0,0 +1,94 @@
+import os
+import signal
+import time
+
+import numpy as np
+from PIL import Image
+
+import preprocessing
+from preprocessing import PreprocessPool
+
+
+def test_pool_matches_inline_decode(tmp_path):
+    path = tmp_path / "query.jpg"
+    rng = np.random.default_rng(0)
+    Image.fromarray(rng.integers(0, 255, (300, 400, 3), dtype=np.uint8)).save(path)
+
+    pool = PreprocessPool(max_workers=1)
+    try:
+        pool.start()
+        # Forked, so the children never re-import the __main__ module
+        assert pool._executor._mp_context.get_start_method() == 'fork'
+        pooled = pool.load(str(path), (224, 224), preprocessing.VGG16, views=3)
+    finally:
+        pool.shutdown()
+
+    np.testing.assert_array_equal(pooled, preprocessing.load_image(str(path), (224, 224), preprocessing.VGG16, views=3))
+
+
+def test_pool_recovers_from_a_killed_worker(tmp_path):
+    path = tmp_path / "query.jpg"
+    Image.new('RGB', (64, 48), 'red').save(path)
+    expected = preprocessing.load_image(str(path), (32, 32), preprocessing.UNIT_SCALE)
+
+    pool = PreprocessPool(max_workers=1)
+    try:
+        pool.start()
+        broken = pool._executor
+        for pid in list(broken._processes):
+            os.kill(pid, signal.SIGKILL)
+        # Let the executor's manager thread notice the dead process
+        deadline = time.monotonic() + 10
+        while not broken._broken and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        # The request that finds the pool broken is decoded inline
+        np.testing.assert_array_equal(pool.load(str(path), (32, 32), preprocessing.UNIT_SCALE), expected)
+        assert pool._executor is not broken
+        # And the next one gets a new pool
+        np.testing.assert_array_equal(pool.load(str(path), (32, 32), preprocessing.UNIT_SCALE), expected)
+        assert pool._executor is not None and pool._executor is not broken
+    finally:
+        pool.shutdown()
+
+
+def halves(width, height):
+    """Left half red, right half blue"""
+    img = Image.new('RGB', (width, height), 'red')
+    img.paste(Image.new('RGB', (width // 2, height), 'blue'), (width // 2, 0))
+    return img
+
+
+def test_views_are_full_frame_mirror_then_crops(tmp_path):
+    path = tmp_path / "wide.png"
+    halves(400, 100).save(path)
+
+    views = preprocessing.decode_views(str(path), (32, 32), preprocessing.MAX_VIEWS)
+
+    assert views.shape == (8, 32, 32, 3) and views.dtype == np.float32
+    red, blue = [255, 0, 0], [0, 0, 255]
+    full, mirror, centre, left, right = views[:5]
+    np.testing.assert_array_equal(mirror, full[:, ::-1])
+    np.testing.assert_array_equal(full[0, 0], red)
+    np.testing.assert_array_equal(full[0, -1], blue)
+    # The square crops along the long side: the left end is all red, the right end all blue
+    assert (left == red).all() and (right == blue).all()
+    np.testing.assert_array_equal(centre[0, 0], red)
+    np.testing.assert_array_equal(centre[0, -1], blue)
+    np.testing.assert_array_equal(views[5:], views[2:5, :, ::-1])
+
+
+def test_crops_follow_the_long_side():
+    assert preprocessing._crop_boxes((400, 100)) == [(150, 0, 250, 100), (0, 0, 100, 100), (300, 0, 400, 100)]
+    assert preprocessing._crop_boxes((100, 400)) == [(0, 150, 100, 250), (0, 0, 100, 100), (0, 300, 100, 400)]
+
+
+def test_single_view_is_the_plain_resize(tmp_path):
+    path = tmp_path / "wide.png"
+    halves(400, 100).save(path)
+
+    batch = preprocessing.load_image(str(path), (32, 32), preprocessing.UNIT_SCALE, views=1)
+    multi = preprocessing.load_image(str(path), (32, 32), preprocessing.UNIT_SCALE, views=3)
+
+    assert batch.shape == (1, 32, 32, 3) and multi.shape == (3, 32, 32, 3)
+    np.testing.assert_array_equal(multi[0], batch[0])
@@ -0,0 +1,35 @@
+import os
+
+import profiling
+from profiling import Ring
+
+
+def make_profiles(directory, count):
+    paths = []
+    for i in range(count):
+        path = directory / f"{i}.folded"
+        path.write_text("main 1\n")
+        os.utime(path, (1000 + i, 1000 + i))
+        paths.append(path)
+    return paths
+
+
+def test_prune_keeps_the_newest(tmp_path):
+    paths = make_profiles(tmp_path, 5)
+    (tmp_path / os.path.basename(profiling.CONTROL_FILE)).write_text("{}")
+
+    Ring(str(tmp_path), keep=2).prune()
+
+    assert sorted(os.listdir(tmp_path)) == sorted(["3.folded", "4.folded", os.path.basename(profiling.CONTROL_FILE)])
+    assert not paths[0].exists()
+
+
+def test_prune_skips_files_another_worker_removed(tmp_path, monkeypatch):
+    make_profiles(tmp_path, 3)
+    listdir = os.listdir
+    # Listed, then pruned by another process before this one gets to stat or remove them
+    monkeypatch.setattr(profiling.os, "listdir", lambda d: listdir(d) + ["gone.folded", "gone-too.prof"])
+
+    Ring(str(tmp_path), keep=1).prune()
+
+    assert listdir(tmp_path) == ["2.folded"]
@@ -0,0 +1,38 @@
+import pytest
+from flask import Flask, jsonify
+
+import ratelimit
+
+
+def make_client(monkeypatch, trusted_proxies):
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXIES", trusted_proxies)
+    app = Flask(__name__)
+
+    @app.route('/ping')
+    def ping():
+        return jsonify({"ok": True})
+
+    # Two requests per IP, no refill to speak of
+    admission = ratelimit.Admission(ratelimit.MemoryStore(), user_rate=(0.001, 100), ip_rate=(0.001, 2),
+                                    concurrency={})
+    ratelimit.install(app, admission, identify=lambda: None)
+    return app.test_client()
+
+
+def statuses(client, forwarded_for):
+    return [client.get('/ping', headers={"X-Forwarded-For": forwarded_for}).status_code for _ in range(3)]
+
+
+@pytest.mark.skipif(not ratelimit.ENABLED, reason="rate limiting disabled")
+def test_trusted_proxy_buckets_by_forwarded_client_ip(monkeypatch):
+    client = make_client(monkeypatch, trusted_proxies=1)
+    assert statuses(client, "203.0.113.1") == [200, 200, 429]
+    assert statuses(client, "203.0.113.2") == [200, 200, 429]
+
+
+@pytest.mark.skipif(not ratelimit.ENABLED, reason="rate limiting disabled")
+def test_forwarded_for_is_ignored_without_trusted_proxies(monkeypatch):
+    client = make_client(monkeypatch, trusted_proxies=0)
+    assert statuses(client, "203.0.113.1") == [200, 200, 429]
+    # Same remote address, so a forged header doesn't buy a fresh bucket
+    assert statuses(client, "203.0.113.2") == [429, 429, 429]
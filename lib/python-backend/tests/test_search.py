@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+import search
+from database import DatabaseHandler
+from search import SearchIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    db = DatabaseHandler(str(tmp_path / "test.db"))
+    db.register_user("ada@example.com", "secret-password", "ada")
+    conn = sqlite3.connect(db.db_path)
+    conn.execute('CREATE TABLE community_posts (id TEXT PRIMARY KEY, user_id TEXT NOT NULL, content TEXT NOT NULL, '
+                 'created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    conn.commit()
+    conn.close()
+    index = SearchIndex(db.db_path)
+    index.db = db
+    return index
+
+
+def add_post(index, post_id, content):
+    conn = sqlite3.connect(index.db_path)
+    conn.execute("INSERT INTO community_posts (id, user_id, content) VALUES (?, 1, ?)", (post_id, content))
+    conn.commit()
+    conn.close()
+
+
+def test_post_snippets_escape_content_before_highlighting(index):
+    add_post(index, "p1", 'Karnak at dawn <img src=x onerror="alert(1)"> & <b>more</b>')
+    add_post(index, "p2", "Nothing to see")
+
+    result = index.search_posts("karnak")
+
+    assert [row["id"] for row in result["results"]] == ["p1"]
+    assert result["results"][0]["snippet"] == (
+        '<b>Karnak</b> at dawn &lt;img src=x onerror=&quot;alert(1)&quot;&gt; &amp; &lt;b&gt;more&lt;/b&gt;')
+    assert result["results"][0]["content"].startswith('Karnak at dawn <img')
+
+
+def test_chat_snippets_are_escaped_and_per_user(index):
+    index.db.save_chat(1, "Where is <Abu Simbel>?", "Abu Simbel is south of Aswan & Lake Nasser")
+    index.db.save_chat(2, "Abu Simbel tickets", "Not yours")
+
+    result = index.search_chat(1, "simbel")
+
+    assert len(result["results"]) == 1
+    hit = result["results"][0]
+    assert hit["messageSnippet"] == "Where is &lt;Abu <b>Simbel</b>&gt;?"
+    assert hit["responseSnippet"] == "Abu <b>Simbel</b> is south of Aswan &amp; Lake Nasser"
+
+
+def test_queries_are_sanitised_and_paged(index):
+    for i in range(3):
+        add_post(index, f"p{i}", f"temple number {i}")
+
+    # FTS5 syntax in the text is taken as words, never as operators
+    assert not index.search_posts('" * :')["success"]
+    assert index.search_posts('" OR *')["results"] == []
+    first = index.search_posts('temple" (', limit=2)
+    assert len(first["results"]) == 2 and first["next_offset"] == 2
+    assert len(index.search_posts("temp", offset=2)["results"]) == 1
+
+
+def test_highlight():
+    assert search.highlight(None) is None
+    start, end = search._MARKERS
+    assert search.highlight(f"{start}a<{end} & b") == "<b>a&lt;</b> &amp; b"
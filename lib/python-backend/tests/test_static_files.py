@@ -0,0 +1,60 @@
+import pytest
+from flask import Flask
+
+import static_files
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / "blobs").mkdir()
+    (tmp_path / "blobs" / "ab12.png").write_bytes(b"0123456789")
+    (tmp_path / "avatar.png").write_bytes(b"abcdef")
+    (tmp_path.parent / "secret.txt").write_text("outside uploads/")
+
+    app = Flask(__name__)
+
+    @app.route('/uploads/<path:filename>')
+    def serve_uploads(filename):
+        return static_files.send_upload(str(tmp_path), filename)
+
+    return app.test_client()
+
+
+def test_hashed_names_are_cached_for_good(client):
+    response = client.get('/uploads/blobs/ab12.png')
+    assert response.status_code == 200
+    assert response.data == b"0123456789"
+    assert response.headers["Cache-Control"] == f"public, max-age={static_files.IMMUTABLE_MAX_AGE}, immutable"
+    assert response.headers["ETag"] and response.headers["Last-Modified"]
+
+    response = client.get('/uploads/avatar.png')
+    assert response.headers["Cache-Control"] == f"public, max-age={static_files.MUTABLE_MAX_AGE}"
+
+
+def test_revalidation_and_ranges(client):
+    etag = client.get('/uploads/blobs/ab12.png').headers["ETag"]
+
+    response = client.get('/uploads/blobs/ab12.png', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    response = client.get('/uploads/blobs/ab12.png', headers={"Range": "bytes=2-5"})
+    assert response.status_code == 206
+    assert response.data == b"2345"
+    assert response.headers["Content-Range"] == "bytes 2-5/10"
+
+
+@pytest.mark.parametrize("path", ["/uploads/missing.png", "/uploads/blobs", "/uploads/../secret.txt",
+                                  "/uploads/%2e%2e/secret.txt"])
+def test_only_files_under_uploads_are_served(client, path):
+    assert client.get(path).status_code == 404
+
+
+def test_x_accel_hands_the_file_to_nginx(client, monkeypatch):
+    monkeypatch.setattr(static_files, "HANDOFF", "x-accel")
+
+    response = client.get('/uploads/blobs/ab12.png')
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["X-Accel-Redirect"] == static_files.ACCEL_PREFIX + "blobs/ab12.png"
+    assert "immutable" in response.headers["Cache-Control"]
@@ -0,0 +1,88 @@
+import io
+import struct
+
+import pytest
+from flask import Flask, jsonify, request
+
+import uploads
+from uploads import MB
+
+
+def png_header(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', width, height)
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    calls = []
+
+    @app.route('/upload_profile_image', methods=['POST'])
+    def upload_profile_image():
+        calls.append(request.files['profile_picture'].filename)
+        return jsonify({"success": True})
+
+    @app.route('/translate_hieroglyphic', methods=['POST'])
+    def translate():
+        calls.append(len(request.files.getlist('files')))
+        return jsonify({"success": True})
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        calls.append(request.get_json())
+        return jsonify({"success": True})
+
+    uploads.install(app)
+    client = app.test_client()
+    client.calls = calls
+    return client
+
+
+def post_file(client, path, data, field='profile_picture', name='me.png'):
+    return client.post(path, data={field: (io.BytesIO(data), name)}, content_type='multipart/form-data')
+
+
+def test_small_image_reaches_the_view(client):
+    response = post_file(client, '/upload_profile_image', png_header(64, 64) + b'\0' * 1024)
+    assert response.status_code == 200
+    assert client.calls == ['me.png']
+
+
+def test_non_image_is_415_before_the_view(client):
+    response = post_file(client, '/upload_profile_image', b'#!/bin/sh\necho not an image\n' * 10, name='me.png')
+    assert response.status_code == 415
+    assert response.get_json()["success"] is False
+    assert client.calls == []
+
+
+def test_oversize_file_is_413(client):
+    # Under the 6 MB body limit, over the 5 MB per-file limit
+    response = post_file(client, '/upload_profile_image', png_header(64, 64) + b'\0' * int(5.5 * MB))
+    assert response.status_code == 413
+    assert client.calls == []
+
+
+def test_oversize_body_is_413(client):
+    response = post_file(client, '/upload_profile_image', png_header(64, 64) + b'\0' * (7 * MB))
+    assert response.status_code == 413
+    assert client.calls == []
+
+
+def test_declared_dimensions_over_the_limit_are_413(client):
+    response = post_file(client, '/upload_profile_image', png_header(uploads.MAX_SIDE + 1, 10) + b'\0' * 64)
+    assert response.status_code == 413
+    assert client.calls == []
+
+
+def test_too_many_files_is_413(client):
+    files = [(io.BytesIO(png_header(8, 8)), f"{i}.png") for i in range(11)]
+    response = client.post('/translate_hieroglyphic', data={'files': files}, content_type='multipart/form-data')
+    assert response.status_code == 413
+    assert client.calls == []
+
+
+def test_non_upload_route_body_limit(client):
+    response = client.post('/login', data=b'{"email": "' + b'a' * (3 * MB) + b'"}', content_type='application/json')
+    assert response.status_code == 413
+    assert client.calls == []
@@ -0,0 +1,47 @@
+import multiprocessing
+
+import pytest
+
+import user_cache
+from user_cache import LocalGenerations, SharedGenerations, UserCache
+
+
+@pytest.mark.parametrize("env, shared", [
+    ({}, False),
+    ({"KEMETPASS_WORKERS": "1"}, False),
+    ({"KEMETPASS_WORKERS": "4"}, True),
+    ({"KEMETPASS_PREFORK": "1"}, True),
+    ({"KEMETPASS_PREFORK": "1", "KEMETPASS_USER_CACHE_SHARED": "0"}, False),
+    ({"KEMETPASS_USER_CACHE_SHARED": "1"}, True),
+])
+def test_generations_are_shared_when_several_processes_serve(monkeypatch, env, shared):
+    for name in ("KEMETPASS_WORKERS", "KEMETPASS_PREFORK", "KEMETPASS_USER_CACHE_SHARED"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+
+    cache = user_cache.from_env()
+    assert isinstance(cache.generations, SharedGenerations if shared else LocalGenerations)
+
+
+def test_invalidation_in_another_process_expires_the_entry():
+    cache = UserCache(shared=SharedGenerations())
+    rows = iter([{"id": 7, "name": "old"}, {"id": 7, "name": "new"}])
+    assert cache.get(7, lambda key: next(rows))["name"] == "old"
+
+    # A forked worker handles the profile update
+    worker = multiprocessing.get_context("fork").Process(target=cache.invalidate, args=(7,))
+    worker.start()
+    worker.join()
+
+    assert worker.exitcode == 0
+    assert cache.get("7", lambda key: next(rows))["name"] == "new"
+
+
+def test_missing_users_are_cached_too():
+    cache = UserCache()
+    loads = []
+    assert cache.get(3, lambda key: loads.append(key)) is None
+    assert cache.get(3, lambda key: loads.append(key)) is None
+    assert loads == [3]
+    assert cache.get("not-an-id", lambda key: loads.append(key)) is None
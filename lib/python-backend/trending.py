@@ -0,0 +1,207 @@
+"""Materialised trending scores for community posts.
+
+A post's score is its time-decayed engagement
+
+    sum(weight * 2 ** ((event_time - now) / half_life))
+
+over the post itself, its likes, comments and bookmarks. Kept in log space
+relative to a fixed epoch (log-sum-exp of log(weight) + (t - EPOCH) / tau)
+the `now` term is the same for every post, so scores never have to be
+decayed: the order only changes when a post gets new engagement. Triggers
+mark such posts in community_score_dirty and a background thread rescores
+just those, so /posts/trending is one range read on the score index.
+"""
+import math
+import sqlite3
+import threading
+import time
+
+import logs
+from metrics import TimedConnection
+
+log = logs.get_logger("trending")
+
+WEIGHTS = {
+    'post': 1.0,
+    'like': 1.0,
+    'comment': 2.0,
+    'bookmark': 3.0,
+}
+
+# Scores are relative to this instant (2024-01-01 UTC)
+EPOCH = 1704067200
+
+MAX_LIMIT = 50
+
+
+class TrendingScores:
+    def __init__(self, db_path='kemetpass.db', half_life_hours=24.0):
+        """Trending score per post, rescored incrementally from engagement changes"""
+        self.db_path = db_path
+        self.tau = half_life_hours * 3600 / math.log(2)
+        self._thread = None
+        self._stop = threading.Event()
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Create the score tables, indexes and dirty-marking triggers"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'community_post_scores'")
+        backfill = cursor.fetchone() is None
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS community_post_scores (
+            post_id TEXT PRIMARY KEY,
+            score REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (post_id) REFERENCES community_posts (id)
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS community_score_dirty (
+            post_id TEXT PRIMARY KEY
+        )
+        ''')
+
+        cursor.executescript('''
+        CREATE INDEX IF NOT EXISTS idx_community_post_scores_rank ON community_post_scores (score DESC, post_id DESC);
+        CREATE INDEX IF NOT EXISTS idx_community_likes_post ON community_likes (post_id);
+        CREATE INDEX IF NOT EXISTS idx_community_comments_post ON community_comments (post_id);
+        CREATE INDEX IF NOT EXISTS idx_community_bookmarks_post ON community_bookmarks (post_id);
+
+        CREATE TRIGGER IF NOT EXISTS community_posts_score_insert AFTER INSERT ON community_posts BEGIN
+            INSERT OR IGNORE INTO community_score_dirty (post_id) VALUES (new.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS community_posts_score_delete AFTER DELETE ON community_posts BEGIN
+            DELETE FROM community_post_scores WHERE post_id = old.id;
+            DELETE FROM community_score_dirty WHERE post_id = old.id;
+        END;
+        ''')
+        for table in ('community_likes', 'community_comments', 'community_bookmarks'):
+            cursor.executescript(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_score_insert AFTER INSERT ON {table} BEGIN
+                INSERT OR IGNORE INTO community_score_dirty (post_id) VALUES (new.post_id);
+            END;
+            CREATE TRIGGER IF NOT EXISTS {table}_score_delete AFTER DELETE ON {table} BEGIN
+                INSERT OR IGNORE INTO community_score_dirty (post_id) VALUES (old.post_id);
+            END;
+            ''')
+
+        if backfill:
+            cursor.execute('INSERT OR IGNORE INTO community_score_dirty (post_id) SELECT id FROM community_posts')
+
+        conn.commit()
+        conn.close()
+
+    def log_score(self, events):
+        """log(sum(weight * exp((t - EPOCH) / tau))) for (weight, unix time) events, without overflow"""
+        terms = [math.log(weight) + (t - EPOCH) / self.tau for weight, t in events]
+        top = max(terms)
+        return top + math.log(sum(math.exp(term - top) for term in terms))
+
+    def recompute(self, batch=500):
+        """Rescore up to `batch` dirty posts; returns how many were processed"""
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection, timeout=30)
+        cursor = conn.cursor()
+        try:
+            # Claim the batch atomically so several workers never rescore the same posts
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(
+                'DELETE FROM community_score_dirty WHERE post_id IN '
+                '(SELECT post_id FROM community_score_dirty LIMIT ?) RETURNING post_id',
+                (batch,)
+            )
+            post_ids = [row[0] for row in cursor.fetchall()]
+            if not post_ids:
+                conn.commit()
+                return 0
+
+            placeholders = ", ".join("?" for _ in post_ids)
+            cursor.execute(f'''
+            SELECT id, 'post', CAST(strftime('%s', created_at) AS INTEGER) FROM community_posts WHERE id IN ({placeholders})
+            UNION ALL
+            SELECT post_id, 'like', CAST(strftime('%s', created_at) AS INTEGER) FROM community_likes WHERE post_id IN ({placeholders})
+            UNION ALL
+            SELECT post_id, 'comment', CAST(strftime('%s', created_at) AS INTEGER) FROM community_comments WHERE post_id IN ({placeholders})
+            UNION ALL
+            SELECT post_id, 'bookmark', CAST(strftime('%s', created_at) AS INTEGER) FROM community_bookmarks WHERE post_id IN ({placeholders})
+            ''', post_ids * 4)
+
+            events = {}
+            for post_id, kind, created in cursor.fetchall():
+                events.setdefault(post_id, []).append((WEIGHTS[kind], created or EPOCH))
+
+            now = time.time()
+            # Posts deleted since they were marked have no 'post' event and are skipped
+            cursor.executemany(
+                'INSERT OR REPLACE INTO community_post_scores (post_id, score, updated_at) VALUES (?, ?, ?)',
+                [(post_id, self.log_score(post_events), now) for post_id, post_events in events.items()]
+            )
+            conn.commit()
+            return len(post_ids)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def start(self, interval=30.0):
+        """Rescore dirty posts every `interval` seconds on a daemon thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="trending", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                while self.recompute() and not self._stop.is_set():
+                    pass
+            except sqlite3.Error:
+                log.exception("trending recompute failed")
+            self._stop.wait(interval)
+
+    def page(self, limit=20, cursor=None):
+        """Highest-scoring posts after `cursor` ("score:post_id" from the previous page)"""
+        limit = max(1, min(limit, MAX_LIMIT))
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
+        conn.row_factory = sqlite3.Row
+        db_cursor = conn.cursor()
+
+        query = '''
+        SELECT cp.id, cp.user_id, cp.content, cp.created_at,
+               u.username, u.profile_picture as userImage,
+               u.firstName, u.secondName,
+               s.score
+        FROM community_post_scores s
+        JOIN community_posts cp ON cp.id = s.post_id
+        JOIN users u ON cp.user_id = u.id
+        '''
+        params = []
+        if cursor:
+            try:
+                score, post_id = cursor.split(':', 1)
+                score = float(score)
+            except ValueError:
+                conn.close()
+                return {"success": False, "error": "Invalid cursor"}
+            query += 'WHERE (s.score, s.post_id) < (?, ?)\n'
+            params += [score, post_id]
+        query += 'ORDER BY s.score DESC, s.post_id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        db_cursor.execute(query, params)
+        rows = [dict(row) for row in db_cursor.fetchall()]
+        conn.close()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1]['score']!r}:{rows[-1]['id']}"
+        return {"success": True, "results": rows, "next_cursor": next_cursor}
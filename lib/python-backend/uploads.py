@@ -0,0 +1,226 @@
+"""Streaming limits and validation for multipart uploads.
+
+UploadRequest gives each upload route its own body size, file count and
+per-file size limits (LIMITS, keyed by URL rule; other routes get
+MAX_CONTENT_LENGTH). Files are spooled in memory up to SPOOL_BYTES and to a
+temporary file past that. While a file streams in, its first bytes are
+checked: anything that isn't a JPEG, PNG, WebP, GIF or BMP, or whose
+header declares more than MAX_SIDE pixels a side or MAX_PIXELS in total, is
+rejected on the spot, so the rest of the body is never read.
+
+install() parses upload routes' bodies in a before_request hook. Limit
+errors then surface as 413/415 JSON responses, not as exceptions inside the
+views' own error handling.
+
+    KEMETPASS_MAX_BODY_BYTES     non-upload routes (default 2 MB)
+    KEMETPASS_SPOOL_BYTES        in-memory size per file before spooling to disk (default 1 MB)
+"""
+import os
+import struct
+import tempfile
+from collections import namedtuple
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+MB = 1 << 20
+
+UploadLimit = namedtuple('UploadLimit', 'max_bytes max_files max_file_bytes')
+
+LIMITS = {
+    '/translate_hieroglyphic': UploadLimit(50 * MB, 10, 10 * MB),
+    '/jobs/translate_hieroglyphic': UploadLimit(50 * MB, 10, 10 * MB),
+    '/predict_where_im': UploadLimit(11 * MB, 1, 10 * MB),
+    '/who_am_i': UploadLimit(11 * MB, 1, 10 * MB),
+    '/posts': UploadLimit(11 * MB, 1, 10 * MB),
+    '/update_profile': UploadLimit(6 * MB, 1, 5 * MB),
+    '/upload_profile_image': UploadLimit(6 * MB, 1, 5 * MB),
+}
+
+MAX_BODY_BYTES = int(os.getenv("KEMETPASS_MAX_BODY_BYTES", str(2 * MB)))
+SPOOL_BYTES = int(os.getenv("KEMETPASS_SPOOL_BYTES", str(MB)))
+
+# Text fields allowed next to the files of an upload route
+MAX_FIELDS = 16
+
+MAX_SIDE = 10000
+MAX_PIXELS = 50_000_000
+
+# Give up looking for the dimensions after this much of a file (JPEG metadata comes first)
+MAX_HEADER_BYTES = MB
+
+# JPEG start-of-frame markers, which carry the dimensions
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_size(head):
+    """(format, width, height) from the first bytes of an image; None if more bytes are needed.
+
+    Raises ValueError for data that isn't a supported image.
+    """
+    if head[:2] == b'\xff\xd8':
+        return _jpeg_size(head)
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(head) < 24:
+            return None
+        width, height = struct.unpack('>II', head[16:24])
+        return 'png', width, height
+    if head[:4] == b'RIFF' and len(head) >= 12:
+        if head[8:12] != b'WEBP':
+            raise ValueError("RIFF file is not WebP")
+        return _webp_size(head)
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        if len(head) < 10:
+            return None
+        width, height = struct.unpack('<HH', head[6:10])
+        return 'gif', width, height
+    if head[:2] == b'BM':
+        if len(head) < 26:
+            return None
+        width, height = struct.unpack('<ii', head[18:26])
+        return 'bmp', width, abs(height)
+    if len(head) < 12:
+        return None
+    raise ValueError("Not a supported image")
+
+
+def _jpeg_size(head):
+    i = 2
+    while True:
+        if i + 4 > len(head):
+            return None
+        if head[i] != 0xFF:
+            raise ValueError("Corrupt JPEG")
+        marker = head[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            if i + 9 > len(head):
+                return None
+            height, width = struct.unpack('>HH', head[i + 5:i + 9])
+            return 'jpeg', width, height
+        if marker == 0xDA:
+            raise ValueError("JPEG has no frame header")
+        i += 2 + struct.unpack('>H', head[i + 2:i + 4])[0]
+
+
+def _webp_size(head):
+    if len(head) < 30:
+        return None
+    chunk = head[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', head[26:30])
+        return 'webp', width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        b0, b1, b2, b3 = head[21:25]
+        return 'webp', 1 + (((b1 & 0x3F) << 8) | b0), 1 + (((b3 & 0xF) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+    if chunk == b'VP8X':
+        return 'webp', 1 + int.from_bytes(head[24:27], 'little'), 1 + int.from_bytes(head[27:30], 'little')
+    raise ValueError("Unknown WebP chunk")
+
+
+def check_dimensions(width, height):
+    if width <= 0 or height <= 0:
+        raise UnsupportedMediaType("Image has no dimensions")
+    if width > MAX_SIDE or height > MAX_SIDE or width * height > MAX_PIXELS:
+        raise RequestEntityTooLarge(f"Image is {width}x{height}; at most {MAX_SIDE} px a side and {MAX_PIXELS // 1_000_000} MP")
+
+
+class ImageSpool:
+    """Upload container that spools past SPOOL_BYTES and validates the image header as it arrives"""
+
+    def __init__(self, max_bytes):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.image = None
+        self._head = bytearray()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"Each file may be at most {self.max_bytes // MB} MB")
+        if self.image is None:
+            self._head += data
+            self._inspect(final=False)
+        return self._file.write(data)
+
+    def _inspect(self, final):
+        try:
+            found = image_size(bytes(self._head))
+        except ValueError as e:
+            raise UnsupportedMediaType(str(e))
+        if found is None:
+            if final or len(self._head) > MAX_HEADER_BYTES:
+                raise UnsupportedMediaType("Could not read the image dimensions")
+            return
+        check_dimensions(found[1], found[2])
+        self.image = found
+        self._head = None
+
+    def finish(self):
+        """Validate a file that ended before its header was complete; empty parts are left to the view"""
+        if self.image is None and self.size:
+            self._inspect(final=True)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    @property
+    def upload_limit(self):
+        return LIMITS.get(self.url_rule.rule) if self.url_rule is not None else None
+
+    @property
+    def max_content_length(self):
+        limit = self.upload_limit
+        if limit is not None:
+            return limit.max_bytes
+        configured = super().max_content_length
+        return configured if configured is not None else MAX_BODY_BYTES
+
+    @property
+    def max_form_parts(self):
+        limit = self.upload_limit
+        return limit.max_files + MAX_FIELDS if limit is not None else MAX_FIELDS
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        limit = self.upload_limit
+        if limit is None:
+            return tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        self._upload_count = getattr(self, '_upload_count', 0) + 1
+        if self._upload_count > limit.max_files:
+            raise RequestEntityTooLarge(f"At most {limit.max_files} files per request")
+        return ImageSpool(limit.max_file_bytes)
+
+
+def install(app):
+    """Use UploadRequest and reject bad uploads before the views run"""
+    from flask import jsonify, request
+
+    app.request_class = UploadRequest
+
+    @app.before_request
+    def _parse_uploads():
+        if request.upload_limit is None or request.mimetype != 'multipart/form-data':
+            return None
+        for _, upload in request.files.items(multi=True):
+            if isinstance(upload.stream, ImageSpool):
+                upload.stream.finish()
+        return None
+
+    @app.errorhandler(RequestEntityTooLarge)
+    def _too_large(e):
+        return jsonify({"success": False, "error": e.description}), 413
+
+    @app.errorhandler(UnsupportedMediaType)
+    def _unsupported(e):
+        return jsonify({"success": False, "error": e.description}), 415
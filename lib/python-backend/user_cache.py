@@ -0,0 +1,144 @@
+"""Bounded, TTL'd in-process cache of user rows.
+
+Entries are invalidated by whoever writes the users table (DatabaseHandler
+does it in update_user_profile and register_user). With a SharedGenerations
+table, created in the gunicorn master before fork, an invalidation in one
+worker bumps a generation counter that every other worker checks on read,
+so no worker serves a row older than the last write.
+
+    KEMETPASS_USER_CACHE_SIZE     entries per process (default 10000)
+    KEMETPASS_USER_CACHE_TTL      seconds (default 60)
+    KEMETPASS_USER_CACHE_SHARED   1/0 forces shared generations on or off; by
+                                  default they are on when serve.py preforks
+                                  the app or KEMETPASS_WORKERS > 1
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Cached "no such user" so polling with an unknown id doesn't hit SQLite either
+MISSING = object()
+
+
+class LocalGenerations:
+    def __init__(self, slots=4096):
+        """Per-process generation counters; stop a load that raced an invalidation from being cached as fresh"""
+        self.slots = slots
+        self._values = [0] * slots
+
+    def current(self, key):
+        return self._values[hash(key) % self.slots]
+
+    def bump(self, key):
+        self._values[hash(key) % self.slots] += 1
+
+
+class SharedGenerations:
+    def __init__(self, slots=4096):
+        """Generation counters in shared memory, one per hash slot of user ids"""
+        self.slots = slots
+        self._array = multiprocessing.Array('Q', slots)
+        # Reads skip the lock: aligned 64-bit loads are atomic and a stale read only costs a miss later
+        self._values = self._array.get_obj()
+
+    def current(self, key):
+        return self._values[hash(key) % self.slots]
+
+    def bump(self, key):
+        with self._array.get_lock():
+            self._values[hash(key) % self.slots] += 1
+
+
+class UserCache:
+    def __init__(self, max_entries=10000, ttl=60.0, shared=None):
+        """LRU of user id -> row dict with expiry and optional cross-process invalidation"""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generations = shared if shared is not None else LocalGenerations()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, load):
+        """Cached row for user_id, calling load(user_id) on a miss; None if there is no such user"""
+        key = _key(user_id)
+        if key is None:
+            return None
+        # Read before loading: an invalidation during the load leaves the entry already stale
+        generation = self.generations.current(key)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now and entry[2] == generation:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return None if entry[0] is MISSING else entry[0]
+            self.misses += 1
+
+        value = load(key)
+        with self._lock:
+            self._entries[key] = (MISSING if value is None else value, now + self.ttl, generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, user_id):
+        key = _key(user_id)
+        if key is None:
+            return
+        with self._lock:
+            self.generations.bump(key)
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def collect(self):
+        """Samples for metrics.REGISTRY.add_collector"""
+        stats = self.stats()
+        return [
+            ("kemetpass_user_cache_lookups_total", "counter", (("result", "hit"),), stats["hits"]),
+            ("kemetpass_user_cache_lookups_total", "counter", (("result", "miss"),), stats["misses"]),
+            ("kemetpass_user_cache_evictions_total", "counter", (), stats["evictions"]),
+            ("kemetpass_user_cache_entries", "gauge", (), stats["size"]),
+        ]
+
+
+def from_env():
+    """UserCache configured from the environment; call before fork so workers share its generations"""
+    shared = os.getenv("KEMETPASS_USER_CACHE_SHARED")
+    if shared is None:
+        # Several processes each caching rows would otherwise serve stale ones for up to the TTL
+        shared = os.getenv("KEMETPASS_PREFORK") == "1" or int(os.getenv("KEMETPASS_WORKERS", "1")) > 1
+    else:
+        shared = shared == "1"
+    return UserCache(
+        max_entries=int(os.getenv("KEMETPASS_USER_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("KEMETPASS_USER_CACHE_TTL", "60")),
+        shared=SharedGenerations() if shared else None,
+    )
+
+
+def _key(user_id):
+    # Ids arrive as ints from the session and as strings from headers and forms
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return None
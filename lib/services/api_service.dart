@@ -3,9 +3,41 @@ import 'dart:io';
 import 'dart:async';
 import 'package:http/http.dart' as http;
 import 'package:shared_preferences/shared_preferences.dart';
+import '../core/navigation/navigation_service.dart';
+
+// HTTP client for the backend: a 401 on an authenticated request means the token
+// is missing, expired or no longer accepted, so drop it and send the user to login
+class AuthClient extends http.BaseClient {
+  final http.Client _inner = http.Client();
+
+  @override
+  Future<http.StreamedResponse> send(http.BaseRequest request) async {
+    final response = await _inner.send(request);
+    if (response.statusCode == 401 && request.headers.containsKey('Authorization')) {
+      await ApiService.handleUnauthorized();
+    }
+    return response;
+  }
+}
 
 class ApiService {
   static const String baseUrl = "http://192.168.1.4:8000";
+
+  static final AuthClient client = AuthClient();
+  static bool _redirectingToLogin = false;
+
+  // Clear the stored credentials and show the login screen once, however many requests failed
+  static Future<void> handleUnauthorized() async {
+    await logout();
+    if (_redirectingToLogin) return;
+    _redirectingToLogin = true;
+    try {
+      await NavigationService.navigatorKey.currentState
+          ?.pushNamedAndRemoveUntil('/login', (route) => false);
+    } finally {
+      _redirectingToLogin = false;
+    }
+  }
   
   // Get user token from SharedPreferences
   static Future<String?> getToken() async {
@@ -26,7 +58,8 @@ class ApiService {
     };
     
     final token = await getToken();
-    if (token != null) {
+    // Only signed server tokens (kid.user.expiry.signature); older builds stored placeholders
+    if (token != null && token.split('.').length == 4) {
       headers['Authorization'] = 'Bearer $token';
     }
     
@@ -45,7 +78,7 @@ class ApiService {
       
       // تحقق من إمكانية الوصول للخادم قبل محاولة تسجيل الدخول
       try {
-        final pingResponse = await http.get(Uri.parse('$baseUrl/ping')).timeout(
+        final pingResponse = await client.get(Uri.parse('$baseUrl/ping')).timeout(
           const Duration(seconds: 5),
           onTimeout: () {
             throw TimeoutException('Server connection timed out');
@@ -63,7 +96,6 @@ class ApiService {
             return {
               'success': true,
               'message': 'Logged in using cached credentials (offline mode)',
-              'token': 'offline_token',
             };
           }
         }
@@ -78,12 +110,11 @@ class ApiService {
           return {
             'success': true,
             'message': 'Logged in using cached credentials (offline mode)',
-            'token': 'offline_token',
           };
         }
       }
       
-      final response = await http.post(
+      final response = await client.post(
         Uri.parse('$baseUrl/login'),
         headers: {'Content-Type': 'application/json'},
         body: jsonEncode({
@@ -108,9 +139,11 @@ class ApiService {
             await prefs.setString('user_id', userId);
           }
           
-          // إنشاء رمز مميز افتراضي إذا لم يكن موجوداً في الاستجابة
-          final token = responseData['token'] ?? 'session_token_${DateTime.now().millisecondsSinceEpoch}';
-          await prefs.setString('user_token', token);
+          // Only the token the server signed; a placeholder would be sent back and rejected
+          final token = responseData['token'];
+          if (token != null) {
+            await prefs.setString('user_token', token);
+          }
           
           // حفظ البريد الإلكتروني والبيانات الأخرى
           await prefs.setString('email', email);
@@ -224,7 +257,7 @@ class ApiService {
       try {
         // Check server availability
         print('Checking server availability...');
-        final pingResponse = await http.get(Uri.parse('$baseUrl/ping')).timeout(
+        final pingResponse = await client.get(Uri.parse('$baseUrl/ping')).timeout(
           const Duration(seconds: 3),
           onTimeout: () {
             throw TimeoutException('Server connection timed out');
@@ -247,8 +280,8 @@ class ApiService {
         final formattedUserId = userId.toString().trim();
         headers['User-ID'] = formattedUserId;
         
-        // Add authorization header if token exists
-        if (token != null) {
+        // Add authorization header if a signed token exists
+        if (token != null && token.split('.').length == 4) {
           headers['Authorization'] = 'Bearer $token';
         }
         
@@ -261,7 +294,7 @@ class ApiService {
         print('Request URL: $baseUrl/get_profile');
         print('Request Headers: $headers');
         
-        final response = await http.get(
+        final response = await client.get(
           Uri.parse('$baseUrl/get_profile'),
           headers: headers,
         ).timeout(const Duration(seconds: 8));
@@ -546,7 +579,7 @@ class ApiService {
     await prefs.setString('firstName', actualFirstName);
     await prefs.setString('secondName', actualSecondName);
     
-    final response = await http.post(
+    final response = await client.post(
       Uri.parse('$baseUrl/register'),
       headers: {'Content-Type': 'application/json'},
       body: jsonEncode({
@@ -562,6 +595,9 @@ class ApiService {
     
     if (response.statusCode == 200 && data['success'] == true) {
       await prefs.setString('user_id', data['user_id'].toString());
+      if (data['token'] != null) {
+        await prefs.setString('user_token', data['token']);
+      }
       return {'success': true, 'user_id': data['user_id']};
     } else {
       return {'success': false, 'error': data['error'] ?? 'Unknown error'};
@@ -621,7 +657,7 @@ class ApiService {
         ));
         
         // إرسال الطلب
-        final streamedResponse = await request.send();
+        final streamedResponse = await client.send(request);
         final response = await http.Response.fromStream(streamedResponse);
         
         if (response.statusCode == 200) {
@@ -655,7 +691,7 @@ class ApiService {
         }
       } else {
         // استخدام الطريقة القديمة إذا لم تكن هناك صورة للتحميل
-        final response = await http.post(
+        final response = await client.post(
           Uri.parse('$baseUrl/update_profile'),
           headers: headers,
           body: jsonEncode({
@@ -727,7 +763,7 @@ class ApiService {
         imageFile.path,
       ));
       
-      final streamedResponse = await request.send();
+      final streamedResponse = await client.send(request);
       final response = await http.Response.fromStream(streamedResponse);
       
       if (response.statusCode == 200) {
@@ -757,9 +793,10 @@ class ApiService {
   static Future<Map<String, dynamic>> chatWithBot(String question, String context) async {
     final userId = await getUserId();
     
-    final response = await http.post(
+    final response = await client.post(
       Uri.parse('$baseUrl/chat'),
-      headers: {'Content-Type': 'application/json'},
+      // With the token, so the server keeps the chat history of logged-in users
+      headers: await getHeaders(),
       body: jsonEncode({
         'question': question,
         'context': context,
@@ -788,7 +825,7 @@ class ApiService {
     final headers = await getHeaders();
     request.headers.addAll(headers);
     
-    final streamedResponse = await request.send();
+    final streamedResponse = await client.send(request);
     final response = await http.Response.fromStream(streamedResponse);
     
     final data = jsonDecode(response.body);
@@ -815,7 +852,7 @@ class ApiService {
     final headers = await getHeaders();
     request.headers.addAll(headers);
     
-    final streamedResponse = await request.send();
+    final streamedResponse = await client.send(request);
     final response = await http.Response.fromStream(streamedResponse);
     
     final data = jsonDecode(response.body);
@@ -841,7 +878,7 @@ class ApiService {
     final headers = await getHeaders();
     final uri = Uri.parse('$baseUrl/get_saves${type != null ? '?type=$type' : ''}');
     
-    final response = await http.get(uri, headers: headers);
+    final response = await client.get(uri, headers: headers);
     
     final data = jsonDecode(response.body);
     
@@ -859,7 +896,7 @@ class ApiService {
     }
     
     final headers = await getHeaders();
-    final response = await http.delete(
+    final response = await client.delete(
       Uri.parse('$baseUrl/delete_save/$saveId'),
       headers: headers,
     );
@@ -875,7 +912,7 @@ class ApiService {
     }
     
     final headers = await getHeaders();
-    final response = await http.get(
+    final response = await client.get(
       Uri.parse('$baseUrl/chat_history?limit=$limit'),
       headers: headers,
     );
@@ -928,7 +965,7 @@ class ApiService {
         }
         
         // Send request
-        final streamedResponse = await request.send().timeout(const Duration(seconds: 15));
+        final streamedResponse = await client.send(request).timeout(const Duration(seconds: 15));
         final response = await http.Response.fromStream(streamedResponse);
         
         if (response.statusCode == 200 || response.statusCode == 201) {
@@ -938,7 +975,7 @@ class ApiService {
         }
       } else {
         // No image, use regular POST request
-        final response = await http.post(
+        final response = await client.post(
           Uri.parse('$baseUrl/posts'),
           headers: headers,
           body: jsonEncode(postData),
@@ -969,7 +1006,7 @@ class ApiService {
     
     try {
       // Check server availability
-      final pingResponse = await http.get(
+      final pingResponse = await client.get(
         Uri.parse('$baseUrl/ping'),
       ).timeout(const Duration(seconds: 3));
       
@@ -137,7 +137,7 @@ class CommunityDbService {
   // Check if server is available
   Future<bool> isServerAvailable() async {
     try {
-      final response = await http.get(
+      final response = await ApiService.client.get(
         Uri.parse('${ApiService.baseUrl}/ping'),
         headers: await ApiService.getHeaders(),
       ).timeout(const Duration(seconds: 3));
@@ -156,7 +156,7 @@ class CommunityDbService {
     // Get posts from the server only
     try {
       if (await isServerAvailable()) {
-        final response = await http.get(
+        final response = await ApiService.client.get(
           Uri.parse('${ApiService.baseUrl}/posts'),
           headers: await ApiService.getHeaders(),
         ).timeout(const Duration(seconds: 8));
@@ -244,7 +244,7 @@ class CommunityDbService {
       
       // إرسال الطلب مع زيادة مهلة الانتظار
       try {
-        final streamedResponse = await request.send()
+        final streamedResponse = await ApiService.client.send(request)
             .timeout(const Duration(seconds: 30)); // زيادة المهلة إلى 30 ثانية
           
         final response = await http.Response.fromStream(streamedResponse)
@@ -289,7 +289,7 @@ class CommunityDbService {
         };
       }
       
-      final response = await http.post(
+      final response = await ApiService.client.post(
         Uri.parse('${ApiService.baseUrl}/posts/${postId}/like'),
         headers: await ApiService.getHeaders(),
       ).timeout(const Duration(seconds: 8));
@@ -338,7 +338,7 @@ class CommunityDbService {
       final method = bookmark ? 'POST' : 'DELETE';
       final url = Uri.parse('${ApiService.baseUrl}/posts/${postId}/bookmark');
       
-      final response = await http.post(
+      final response = await ApiService.client.post(
         url,
         headers: await ApiService.getHeaders(),
         body: jsonEncode({'bookmark': bookmark}),
@@ -394,7 +394,7 @@ class CommunityDbService {
       print('CommunityDbService: Request URL: ${ApiService.baseUrl}/posts/bookmarked');
       print('CommunityDbService: Request Headers: $headers');
 
-      final response = await http.get(
+      final response = await ApiService.client.get(
         Uri.parse('${ApiService.baseUrl}/posts/bookmarked'),
         headers: headers,
       ).timeout(const Duration(seconds: 8));
@@ -474,7 +474,7 @@ class CommunityDbService {
           request.fields['existingImageUrl'] = existingImageUrl!;
         }
 
-        final streamedResponse = await request.send().timeout(const Duration(seconds: 30));
+        final streamedResponse = await ApiService.client.send(request).timeout(const Duration(seconds: 30));
         final response = await http.Response.fromStream(streamedResponse);
 
         if (response.statusCode == 200) {
@@ -484,7 +484,7 @@ class CommunityDbService {
         }
       } else if (removeImage) {
         // If image is explicitly removed, send a JSON request with a flag to remove it
-        final response = await http.put(
+        final response = await ApiService.client.put(
           Uri.parse('${ApiService.baseUrl}/posts/$postId'),
           headers: headers,
           body: jsonEncode({
@@ -501,7 +501,7 @@ class CommunityDbService {
         }
       } else {
         // No image changes, use JSON request
-        final response = await http.put(
+        final response = await ApiService.client.put(
           Uri.parse('${ApiService.baseUrl}/posts/$postId'),
           headers: headers,
           body: jsonEncode({
@@ -539,7 +539,7 @@ class CommunityDbService {
       
       final headers = await ApiService.getHeaders();
 
-      final response = await http.delete(
+      final response = await ApiService.client.delete(
         Uri.parse('${ApiService.baseUrl}/posts/$postId'),
         headers: headers,
         body: jsonEncode({'userId': userId}), // Send userId for verification on backend